@@ -0,0 +1,66 @@
+"""
+Benchmark of the ni_analyser kernels (get_subset_by_y, get_power_law_fit_curve, max. values) against the
+former pure python loops, using the complete curve of nan_error_dyn_10000uN (and an interpolated version
+with 400000 points, like long dynamic measurements).
+"""
+import os
+import timeit
+
+import numpy as np
+
+from pi88reader.ni_analyser import get_subset_by_y, get_power_law_fit_curve, power_law_fit_function, \
+    calc_unloading_data
+from pi88reader.pi88_importer import PI88Measurement
+
+filename = os.path.join(os.path.dirname(__file__), '..', 'resources', 'nan_error_dyn_10000uN.tdm')
+
+
+def get_subset_by_y_loop(x_data, y_data, upper, lower):
+    result = {"x": [], "y": []}
+    y_max = max(y_data)
+    for x, y in zip(x_data, y_data):
+        if lower * y_max <= y <= upper * y_max:
+            result["x"].append(x)
+            result["y"].append(y)
+    return result
+
+
+def get_power_law_fit_curve_loop(fit_A, fit_hf, fit_m, h_max, n_steps=100, **_):
+    load = []
+    disp = []
+    for h in np.linspace(fit_hf, h_max, n_steps):
+        load.append(power_law_fit_function(h, fit_A, fit_hf, fit_m))
+        disp.append(h)
+    return disp, load
+
+
+def benchmark(name, loop_function, vectorized_function, number=5):
+    loop_time = timeit.timeit(loop_function, number=number) / number
+    vectorized_time = timeit.timeit(vectorized_function, number=number) / number
+    print(f"{name:40s} loop: {loop_time * 1e3:9.3f} ms   numpy: {vectorized_time * 1e3:7.3f} ms   "
+          f"speedup: {loop_time / vectorized_time:7.1f}x")
+
+
+def main():
+    measurement = PI88Measurement(filename)
+    fit = calc_unloading_data(measurement)
+    n_points = 400000
+    curves = {
+        f"{len(measurement.depth)} points": (measurement.depth, measurement.load),
+        f"{n_points} points": (np.interp(np.linspace(0, 1, n_points), np.linspace(0, 1, len(measurement.depth)),
+                                         measurement.depth),
+                               np.interp(np.linspace(0, 1, n_points), np.linspace(0, 1, len(measurement.load)),
+                                         measurement.load))
+    }
+    for curve_name, (depth, load) in curves.items():
+        print(f"{measurement.base_name} ({curve_name}):")
+        benchmark("get_subset_by_y", lambda: get_subset_by_y_loop(depth, load, 0.95, 0.2),
+                  lambda: get_subset_by_y(depth, load, 0.95, 0.2))
+        benchmark("max(displacement), max(load)", lambda: (max(depth), max(load)),
+                  lambda: (np.nanmax(depth), np.nanmax(load)))
+    benchmark("get_power_law_fit_curve (10000 steps)", lambda: get_power_law_fit_curve_loop(**fit, n_steps=10000),
+              lambda: get_power_law_fit_curve(**fit, n_steps=10000))
+
+
+if __name__ == "__main__":
+    main()
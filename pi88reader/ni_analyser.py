@@ -2,12 +2,13 @@
 @author: Nathanael Jöhrmann
 """
 import math
-from typing import Iterable, Tuple
+from typing import Iterable, Tuple, Optional
 
 import numpy as np
 from scipy.optimize import curve_fit
 
-from pi88reader.pi88_importer import SegmentType
+from pi88reader.ni_creep import calc_creep_windows
+from pi88reader.pi88_importer import SegmentType, PI88Settings
 
 
 def calc_stiffness(fit_A, fit_hf, fit_m, h_max, **_):
@@ -32,71 +33,130 @@ def calc_E(Er: float, poisson_ratio: float, E_tip: float = 1140, poisson_ratio_t
     return (1 - poisson_ratio ** 2) / (1 / Er - (1 - poisson_ratio_tip ** 2) / (E_tip))  # * 1e9))
 
 
+def calc_Er_from_E(E: float, poisson_ratio: float, E_tip: float = 1140, poisson_ratio_tip: float = 0.07) -> float:
+    """Inverse of calc_E."""
+    return 1 / ((1 - poisson_ratio ** 2) / E + (1 - poisson_ratio_tip ** 2) / E_tip)
+
+
 def power_law_fit_function(x, _A, _hf, _m):
     return _A * (x - _hf) ** _m
 
 
-def get_power_law_fit(x_data: Iterable, y_data: Iterable, start_values: list,) -> dict:
-    """
+def power_law_fit_jacobian(x, _A, _hf, _m):
+    """Analytic jacobian of power_law_fit_function (columns: d/dA, d/dhf, d/dm)."""
+    dx = x - _hf
+    valid = dx > 0  # at x == hf the derivatives are set to 0
+    dx = np.where(valid, dx, 1)
+    dx_m = np.where(valid, dx ** _m, 0)
+    # last axis: parameters (x may also be a stack of curves, with parameters of shape (n_curves, 1))
+    return np.stack((dx_m, -_A * _m * dx_m / dx, _A * dx_m * np.log(dx)), axis=-1)
+
 
-    :return: {"fit_failed": bool, "fit_A": float, "fit_hf": float, "fit_m": float}
+def get_power_law_start_values(x_data: Iterable, y_data: Iterable, n_hf: int = 40) -> Optional[list]:
+    """
+    Estimates start values [A, hf, m] for a power law fit. For a set of hf candidates (between 0 and min(x_data))
+    log(y) = log(A) + m*log(x - hf) is solved by linear regression (all candidates at once); the candidate
+    with the smallest squared error of y is returned. Returns None, if there is no valid estimate.
+    """
+    x_data = np.asarray(x_data, dtype=float)
+    y_data = np.asarray(y_data, dtype=float)
+    valid = y_data > 0
+    x_data, y_data = x_data[valid], y_data[valid]
+    if len(x_data) < 3 or np.ptp(x_data) == 0 or not np.min(x_data) > 0:
+        return None
+
+    hf = np.min(x_data) * (1 - np.geomspace(1e-4, 1, n_hf))  # candidates, shape (n_hf,)
+    log_dx = np.log(x_data[np.newaxis, :] - hf[:, np.newaxis])  # shape (n_hf, n)
+    log_y = np.log(y_data)
+    log_dx_mean = log_dx.mean(axis=1, keepdims=True)
+    m = (((log_dx - log_dx_mean) * (log_y - log_y.mean())).sum(axis=1)
+         / ((log_dx - log_dx_mean) ** 2).sum(axis=1))
+    log_A = log_y.mean() - m * log_dx_mean[:, 0]
+    squared_error = ((np.exp(log_A[:, np.newaxis] + m[:, np.newaxis] * log_dx) - y_data) ** 2).sum(axis=1)
+    squared_error[~(m > 0)] = np.inf
+    best = np.argmin(squared_error)
+    if not np.isfinite(squared_error[best]):
+        return None
+    return [float(np.exp(log_A[best])), float(hf[best]), float(m[best])]
+
+
+def get_triboscan_start_values(settings: dict) -> Optional[list]:
+    """Returns the power law fit parameters [A, hf, m] found by TriboScan (PI88Settings.dict) or None."""
+    names = PI88Settings.quasi_analysis_fit_parameter_names
+    values = [settings.get(names[key]) for key in ("A", "hf", "m")]
+    if any(value is None or not np.isfinite(value) for value in values) or values[0] <= 0 or values[2] <= 0:
+        return None
+    return values
+
+
+def get_power_law_fit(x_data: Iterable, y_data: Iterable, start_values: list = None, use_jacobian: bool = True) -> dict:
+    """
+    Fits power_law_fit_function to the data.
+    :param start_values: [A, hf, m], optional (e.g. get_triboscan_start_values as warm start).
+        If None or outside the valid range (hf < min(x_data)), get_power_law_start_values is used.
+    :param use_jacobian: use power_law_fit_jacobian instead of finite differences
+    :return: {"fit_failed": bool, "fit_A": float, "fit_hf": float, "fit_m": float, "fit_nfev": int}
+        fit_nfev ... number of function evaluations; the fit fails for less than 3 points (3 parameters)
     """
 
     result = {}
 
-    x_data = np.array(x_data)
-    y_data = np.array(y_data)
+    x_data = np.asarray(x_data, dtype=float)
+    y_data = np.asarray(y_data, dtype=float)
+    if len(x_data) < 3:
+        return {"fit_failed": True, "fit_A": 0, "fit_hf": 0, "fit_m": 0, "fit_nfev": 0}
+    maxfev = 10000
+    x_min = x_data.min()
+    if start_values is None or not (start_values[0] > 0 and 0 <= start_values[1] < x_min and start_values[2] > 0):
+        start_values = get_power_law_start_values(x_data, y_data)
+    if start_values is None:
+        start_values = [0.1, x_min * 0.9, 1.8]
     start_values = np.array(start_values)
 
     try:
-        popt, pcov = curve_fit(power_law_fit_function, x_data, y_data, p0=start_values, maxfev=10000, method='trf', #method='lm',
-                               bounds=((0, 0, 0), (np.inf, min(x_data), np.inf)))
-        result.update({"fit_failed": False, "fit_A": popt[0], "fit_hf": popt[1], "fit_m": popt[2]})
+        popt, pcov, infodict, _, _ = curve_fit(power_law_fit_function, x_data, y_data, p0=start_values,
+                                               maxfev=maxfev, method='trf', full_output=True,  # method='lm',
+                                               jac=power_law_fit_jacobian if use_jacobian else None,
+                                               bounds=((0, 0, 0), (np.inf, x_min, np.inf)))
+        result.update({"fit_failed": False, "fit_A": popt[0], "fit_hf": popt[1], "fit_m": popt[2],
+                       "fit_nfev": infodict["nfev"]})
     except ValueError as e:
-        result.update({"fit_failed": True, "fit_A": 0, "fit_hf": 0, "fit_m": 0})
+        result.update({"fit_failed": True, "fit_A": 0, "fit_hf": 0, "fit_m": 0, "fit_nfev": 0})
     except RuntimeError:  # no solution with maxfev (maximal number of function evaluations) iterations
-        result.update({"fit_failed": True, "fit_A": 0, "fit_hf": 0, "fit_m": 0})
+        result.update({"fit_failed": True, "fit_A": 0, "fit_hf": 0, "fit_m": 0, "fit_nfev": maxfev})
     return result
 
 
 def get_power_law_fit_curve(fit_A: float, fit_hf: float, fit_m: float,
-                            h_max: float, n_steps: int = 100, **_) -> Tuple[list, list]:
-    load = []
-    disp = []
-
-
-    for h in np.linspace(fit_hf, h_max, n_steps):
-        load.append(power_law_fit_function(h, fit_A, fit_hf, fit_m))
-        disp.append(h)
-
+                            h_max: float, n_steps: int = 100, **_) -> Tuple[np.ndarray, np.ndarray]:
+    disp = np.linspace(fit_hf, h_max, n_steps)
+    load = power_law_fit_function(disp, fit_A, fit_hf, fit_m)
     return disp, load
 
-def get_subset_by_y(x_data: Iterable, y_data: Iterable, upper: float, lower: float) -> dict:
-    """Get a subset of given data by using upper and lower limit on y_data."""
-    result = {"x": [], "y": []}
-    y_max = max(y_data)
-
-    for x, y in zip(x_data, y_data):
-        if lower*y_max <= y <= upper*y_max:
-            result["x"].append(x)
-            result["y"].append(y)
 
-    return result
+def get_subset_by_y(x_data: Iterable, y_data: Iterable, upper: float, lower: float) -> dict:
+    """
+    Get a subset of given data by using upper and lower limit on y_data (fraction of max. y_data; nan is ignored).
+    :return: {"x": np.ndarray, "y": np.ndarray}
+    """
+    x_data = np.asarray(x_data)
+    y_data = np.asarray(y_data)
+    if len(y_data) == 0:
+        return {"x": x_data[:0], "y": y_data[:0]}
+    y_max = np.nanmax(y_data)
+    mask = (y_data >= lower * y_max) & (y_data <= upper * y_max)
+    return {"x": x_data[mask], "y": y_data[mask]}
 
 
-def fit_unloading(displacement: Iterable, load: Iterable, upper, lower) -> dict:
+def fit_unloading(displacement: Iterable, load: Iterable, upper, lower, start_values: list = None) -> dict:
     """
     Power law fit for unloading curve. Returns a dictionary with fit parameters
+    :param start_values: optional [A, hf, m] (see get_power_law_fit)
     """
     result = {}
     x_data, y_data = get_subset_by_y(displacement, load, upper, lower).values()
     if len(x_data) == 0:
         return result
-    A_estimate = 0.1
-    hf_estimate = min(displacement) * 0.9
-    m_start = 1.8
-
-    start_values = [A_estimate, hf_estimate, m_start]
 
     result = get_power_law_fit(x_data, y_data, start_values)
 
@@ -104,94 +164,270 @@ def fit_unloading(displacement: Iterable, load: Iterable, upper, lower) -> dict:
     return result
 
 
-def calc_unloading_data(measurement, upper=0.95, lower=0.20, beta=1, poisson_ratio=0.3) -> dict:
+def calc_unloading_data(measurement, upper=0.95, lower=0.20, beta=1, poisson_ratio=0.3, warm_start=False) -> dict:
+    """
+    :param warm_start: if True, the power law fit starts with the fit parameters found by TriboScan (if available)
+    """
+    header, time, displacement, load = measurement.get_segment_curve(SegmentType.UNLOAD, occurence=-1)
+    start_values = get_triboscan_start_values(measurement.settings.dict) if warm_start else None
+    return calc_unloading_data_from_curve(displacement, load, measurement.area_function,
+                                          upper, lower, beta, poisson_ratio,
+                                          name=measurement.name, base_name=measurement.base_name,
+                                          start_values=start_values)
+
+
+def calc_unloading_data_from_curve(displacement, load, area_function, upper=0.95, lower=0.20, beta=1,
+                                   poisson_ratio=0.3, name=None, base_name=None, start_values=None) -> dict:
+    """
+    Same as calc_unloading_data, but for a given unloading curve and area function
+    (e.g. to analyse many measurements in worker processes).
+    :param start_values: optional [A, hf, m] for the power law fit (see get_power_law_fit)
+    """
     result = {
-        "name": measurement.name,
+        "name": name,
+        "base_name": base_name,
         "upper": upper,
         "lower": lower,
         "beta": beta,
         "poisson_ratio": poisson_ratio,
         "h_max": 0, "P_max": 0,
-        "fit_A": 0, "fit_hf": 0, "fit_m": 0, "fit_failed": True,
+        "fit_A": 0, "fit_hf": 0, "fit_m": 0, "fit_failed": True, "fit_nfev": 0,
         "stiffness": 0,
         "hc_max": 0, "Ac_max": 0,
         "hardness": 0,
         "Er": 0, "E": 0
     }
-    header, time, displacement, load = measurement.get_segment_curve(SegmentType.UNLOAD, occurence=-1)
     if len(displacement) == 0:
         return result
-    result["h_max"] = max(displacement)
-    result["P_max"] = max(load)
-    result.update(fit_unloading(displacement, load, upper, lower))
+    result["h_max"] = float(np.nanmax(displacement))
+    result["P_max"] = float(np.nanmax(load))
+    result.update(fit_unloading(displacement, load, upper, lower, start_values))
     if result["fit_failed"]:
         return result
+    _calc_fit_results(result, area_function)
+    return result
+
+
+def _calc_fit_results(result: dict, area_function) -> None:
+    """Adds stiffness, hc_max, Ac_max, hardness, Er and E to result (fit parameters, h_max, P_max, beta ...)."""
     result["stiffness"] = calc_stiffness(**result)
     result["hc_max"] = calc_hc(**result)
-    result["Ac_max"] = measurement.area_function.get_area(result["hc_max"])
+    result["Ac_max"] = area_function.get_area(result["hc_max"])
     result["hardness"] = calc_hardness(**result)
     result["Er"] = calc_Er(**result)
     result["E"] = calc_E(**result)
+
+
+def _get_best_start_values(x_data, y_data, start_values) -> Optional[list]:
+    """Returns start_values or get_power_law_start_values, whichever has the smaller squared error."""
+    candidates = [get_power_law_start_values(x_data, y_data)]
+    if start_values is not None and start_values[1] < np.min(x_data):
+        candidates.append(start_values)
+    candidates = [values for values in candidates if values is not None]
+    if len(candidates) == 0:
+        return None
+    errors = [np.sum((power_law_fit_function(x_data, *values) - y_data) ** 2) for values in candidates]
+    return candidates[int(np.argmin(errors))]
+
+
+# names of the results of calc_fit_window_sweep_from_curve
+FIT_WINDOW_SWEEP_NAMES = ("fit_A", "fit_hf", "fit_m", "fit_nfev", "stiffness", "hc_max", "Ac_max", "hardness", "Er", "E")
+
+
+def calc_fit_window_sweep_from_curve(displacement, load, area_function, uppers: Iterable, lowers: Iterable,
+                                     beta=1, poisson_ratio=0.3, start_values=None, min_points: int = 3) -> dict:
+    """
+    Unloading analysis (see calc_unloading_data_from_curve) for each fit window (upper, lower) of a grid.
+    The unloading curve is sorted by load once; each window is a slice of the sorted data. The grid is
+    walked row by row in alternating direction; each fit starts with the result of the previous window
+    (if it is closer to the data than get_power_law_start_values).
+    :param uppers: upper limits (fraction of P_max), rows of the result
+    :param lowers: lower limits (fraction of P_max), columns of the result
+    :param start_values: optional [A, hf, m] for the first fit (see get_power_law_fit)
+    :param min_points: windows with less points are not fitted (at least 3 -> power law has 3 parameters)
+    :return: {name: array of shape (len(uppers), len(lowers))} for FIT_WINDOW_SWEEP_NAMES and "fit_failed".
+        Values of failed fits (or windows with upper <= lower or less than min_points points) are nan.
+    """
+    uppers = np.asarray(uppers, dtype=float)
+    lowers = np.asarray(lowers, dtype=float)
+    shape = (len(uppers), len(lowers))
+    result = {name: np.full(shape, np.nan) for name in FIT_WINDOW_SWEEP_NAMES}
+    result["fit_failed"] = np.ones(shape, dtype=bool)
+    if len(displacement) == 0:
+        return result
+
+    displacement = np.asarray(displacement, dtype=float)
+    load = np.asarray(load, dtype=float)
+    order = np.argsort(load, kind='stable')
+    sorted_displacement = displacement[order]
+    sorted_load = load[order]
+    P_max = sorted_load[-1]
+    starts = np.searchsorted(sorted_load, lowers * P_max, side='left')
+    stops = np.searchsorted(sorted_load, uppers * P_max, side='right')
+    min_points = max(min_points, 3)
+
+    data = {"h_max": displacement.max(), "P_max": P_max, "beta": beta, "poisson_ratio": poisson_ratio}
+    for i in range(len(uppers)):
+        columns = range(len(lowers)) if i % 2 == 0 else reversed(range(len(lowers)))
+        for j in columns:
+            if stops[i] - starts[j] < min_points:  # empty window or not enough points for 3 parameters
+                continue
+            x_data = sorted_displacement[starts[j]:stops[i]]
+            y_data = sorted_load[starts[j]:stops[i]]
+            fit = get_power_law_fit(x_data, y_data, _get_best_start_values(x_data, y_data, start_values))
+            if fit["fit_failed"]:
+                continue
+            start_values = [fit["fit_A"], fit["fit_hf"], fit["fit_m"]]
+            fit.update(data)
+            _calc_fit_results(fit, area_function)
+            for name in FIT_WINDOW_SWEEP_NAMES:
+                result[name][i, j] = fit[name]
+            result["fit_failed"][i, j] = False
+    return result
+
+
+def fit_power_law_batch(x_data: np.ndarray, y_data: np.ndarray, start_values, n_iterations: int = 100,
+                        tolerance: float = 1e-10) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Power law fits of many curves at once (Levenberg-Marquardt with power_law_fit_jacobian, vectorized
+    over the curves). Bounds are the same as in get_power_law_fit (A, m > 0; 0 <= hf < min(x)).
+    :param x_data: shape (n_points,) or (n_curves, n_points)
+    :param y_data: shape (n_curves, n_points)
+    :param start_values: [A, hf, m] or shape (n_curves, 3), e.g. the fit of the original curve
+    :return: (parameters of shape (n_curves, 3), converged of shape (n_curves,))
+    """
+    y_data = np.asarray(y_data, dtype=float)
+    x_data = np.broadcast_to(np.asarray(x_data, dtype=float), y_data.shape)
+    params = np.array(np.broadcast_to(start_values, (len(y_data), 3)), dtype=float)
+    hf_max = x_data.min(axis=1) * (1 - 1e-9)
+    params[:, 1] = np.clip(params[:, 1], 0, hf_max)
+
+    def get_sse(p, rows):
+        residuals = y_data[rows] - power_law_fit_function(x_data[rows], p[:, :1], p[:, 1:2], p[:, 2:])
+        return np.einsum('ij,ij->i', residuals, residuals), residuals
+
+    sse, residuals = get_sse(params, slice(None))
+    damping = np.full(len(y_data), 1e-3)
+    converged = np.zeros(len(y_data), dtype=bool)
+    for _ in range(n_iterations):
+        active = ~converged
+        if not active.any():
+            break
+        jacobian = power_law_fit_jacobian(x_data[active], params[active, :1], params[active, 1:2], params[active, 2:])
+        jtj = np.einsum('kni,knj->kij', jacobian, jacobian)
+        gradient = np.einsum('kni,kn->ki', jacobian, residuals[active])
+        diagonal = np.einsum('kii->ki', jtj)
+        lhs = jtj + (damping[active, np.newaxis] * diagonal)[:, :, np.newaxis] * np.eye(3)
+        try:
+            step = np.linalg.solve(lhs, gradient[:, :, np.newaxis])[:, :, 0]
+        except np.linalg.LinAlgError:  # at least one singular matrix
+            step = np.einsum('kij,kj->ki', np.linalg.pinv(lhs), gradient)
+        new_params = params[active] + step
+        new_params[:, 0] = np.maximum(new_params[:, 0], 1e-12)
+        new_params[:, 1] = np.clip(new_params[:, 1], 0, hf_max[active])
+        new_params[:, 2] = np.maximum(new_params[:, 2], 1e-12)
+
+        new_sse, new_residuals = get_sse(new_params, active)
+        improved = new_sse < sse[active]  # (only active curves)
+        small_change = improved & (sse[active] - new_sse <= tolerance * sse[active])
+        improved_index = np.flatnonzero(active)[improved]
+        params[improved_index] = new_params[improved]
+        residuals[improved_index] = new_residuals[improved]
+        sse[improved_index] = new_sse[improved]
+        damping[improved_index] /= 3
+        damping[np.flatnonzero(active)[~improved]] *= 4
+        converged[np.flatnonzero(active)[small_change]] = True
+        converged |= damping > 1e10  # no further improvement possible
+    return params, converged
+
+
+# names of the results with confidence intervals (calc_unloading_bootstrap_from_curve)
+BOOTSTRAP_NAMES = ("stiffness", "hardness", "Er", "E")
+
+
+def calc_unloading_bootstrap(measurement, upper=0.95, lower=0.20, beta=1, poisson_ratio=0.3, **kwargs) -> dict:
+    """
+    calc_unloading_data with bootstrap confidence intervals (see calc_unloading_bootstrap_from_curve).
+    """
+    header, time, displacement, load = measurement.get_segment_curve(SegmentType.UNLOAD, occurence=-1)
+    return calc_unloading_bootstrap_from_curve(displacement, load, measurement.area_function,
+                                               upper, lower, beta, poisson_ratio,
+                                               name=measurement.name, base_name=measurement.base_name, **kwargs)
+
+
+def calc_unloading_bootstrap_from_curve(displacement, load, area_function, upper=0.95, lower=0.20, beta=1,
+                                        poisson_ratio=0.3, name=None, base_name=None, n_resamples: int = 1000,
+                                        method: str = "residual", confidence: float = 0.95,
+                                        seed=None, chunk_size: int = 250) -> dict:
+    """
+    Same as calc_unloading_data_from_curve, plus bootstrap confidence intervals for BOOTSTRAP_NAMES.
+    The power law fit is repeated for n_resamples resampled curves (all at once, see fit_power_law_batch).
+    :param method: "residual" (fitted curve + resampled residuals) or "pairs" (resampled data points)
+    :param confidence: e.g. 0.95 -> 2.5 % and 97.5 % percentiles
+    :param seed: seed for numpy.random.default_rng
+    :param chunk_size: resamples fitted at once (limits memory)
+    :return: dict with the keys of calc_unloading_data_from_curve and for each name in BOOTSTRAP_NAMES:
+        name_lower, name_upper (percentile interval), name_std; n_resamples, confidence and
+        bootstrap_failed (number of resamples without converged/valid fit).
+        Intervals are nan for less than 2 resamples (e.g. n_resamples=0 -> point estimate only).
+    """
+    if n_resamples < 0:
+        raise ValueError(f"n_resamples has to be >= 0 (got {n_resamples})")
+    result = calc_unloading_data_from_curve(displacement, load, area_function, upper, lower, beta, poisson_ratio,
+                                            name=name, base_name=base_name)
+    result.update({"n_resamples": n_resamples, "confidence": confidence, "bootstrap_failed": n_resamples})
+    for key in BOOTSTRAP_NAMES:
+        result.update({f"{key}_lower": np.nan, f"{key}_upper": np.nan, f"{key}_std": np.nan})
+    if result["fit_failed"] or n_resamples < 2:
+        return result
+
+    x_data, y_data = (np.asarray(values, dtype=float)
+                      for values in get_subset_by_y(displacement, load, upper, lower).values())
+    fit_params = np.array([result["fit_A"], result["fit_hf"], result["fit_m"]])
+    fitted = power_law_fit_function(x_data, *fit_params)
+    rng = np.random.default_rng(seed)
+
+    params = []
+    for n_chunk in np.diff(np.append(np.arange(0, n_resamples, chunk_size), n_resamples)):
+        index = rng.integers(0, len(x_data), size=(n_chunk, len(x_data)))
+        if method == "residual":
+            chunk_x, chunk_y = x_data, fitted + (y_data - fitted)[index]
+        elif method == "pairs":
+            chunk_x, chunk_y = x_data[index], y_data[index]
+        else:
+            raise ValueError(f"Unknown bootstrap method: {method}")
+        chunk_params, converged = fit_power_law_batch(chunk_x, chunk_y, fit_params)
+        chunk_params[~converged] = np.nan
+        params.append(chunk_params)
+    params = np.concatenate(params)
+
+    samples = {"h_max": result["h_max"], "P_max": result["P_max"], "beta": beta, "poisson_ratio": poisson_ratio,
+               "fit_A": params[:, 0], "fit_hf": params[:, 1], "fit_m": params[:, 2]}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        _calc_fit_results(samples, area_function)
+    valid = np.all([np.isfinite(samples[key]) for key in BOOTSTRAP_NAMES], axis=0)
+    result["bootstrap_failed"] = int(n_resamples - valid.sum())
+    if valid.sum() < 2:
+        return result
+    percentiles = [50 * (1 - confidence), 50 * (1 + confidence)]
+    for key in BOOTSTRAP_NAMES:
+        lower_value, upper_value = np.percentile(samples[key][valid], percentiles)
+        result.update({f"{key}_lower": lower_value, f"{key}_upper": upper_value,
+                       f"{key}_std": np.std(samples[key][valid], ddof=1)})
     return result
 
 
 # ********************************************************************************
 # in development
 # ********************************************************************************
-# from pi88reader.pi88_importer import SegmentType
-from bisect import bisect
-
-
-def get_avg_strain_rate_and_sigma(time, disp, load, area_function):  # todo: area_function; -> PI88Measurement.get_dict_for_creep_analyse
+def get_avg_strain_rate_and_sigma(time, disp, load, area_function, parts: int = 10, t_min: float = 50):  # -> PI88Measurement.get_dict_for_creep_analyse
     """
     Uses data from a hold segment (time, displacement, load) and an area-function,
-     to calculate avg. strain rate and sigma
+     to calculate avg. strain rate [1/s] and sigma [N/m^2] (see ni_creep.calc_creep_windows)
     """
     # QS
     # header, time, disp, load = measurement.get_segment_curve(SegmentType.HOLD)
     # for DMA:
     # header, time, disp, load = measurement.get_segment_curve(SegmentType.HOLD, occurence=2)
-
-    # find index with t > 50
-    min_index = bisect(time, 50)
-
-    # divide in roughly 130 parts
-    parts = 10  # 4
-    n = len(time[min_index:]) // parts  # average over n values; // -> floor division
-
-    avg_time = []
-    avg_disp = []
-    avg_load = []
-
-    delta_time = []  # [s]
-    delta_disp = []  # [m]
-
-    area_avg = []  # [m^2]
-    load_over_area_avg = []  # [N/m^2]
-    creep_rate_avg = []  # [m/s]
-
-    start_index = min_index - n
-    end_index = start_index + n
-    avg_time.append(np.mean(time[start_index:end_index]))
-    avg_disp.append(np.mean(disp[start_index:end_index]))
-    avg_load.append(np.mean(load[start_index:end_index]))
-
-    for i in range(0, parts):
-        start_index = min_index + i * n
-        end_index = start_index + n
-        avg_time.append(np.mean(time[start_index:end_index]))
-        avg_disp.append(np.mean(disp[start_index:end_index]))
-        avg_load.append(np.mean(load[start_index:end_index]))
-        # avg_load.append(np.mean(load[min_index:]))
-        # avg_disp.append(np.mean(disp[min_index:]))
-
-        delta_time.append(avg_time[-1] - avg_time[-2])
-        delta_disp.append((avg_disp[-1] - avg_disp[-2]) * 1e-9)
-
-        averaged_area = area_function(avg_disp[-1]) * 1e-18
-        area_avg.append(averaged_area)
-        averaged_load_over_area = avg_load[-1] * 1e-6 / averaged_area
-        load_over_area_avg.append(averaged_load_over_area)
-        creep_rate_avg.append((delta_disp[-1] / avg_disp[-2]) / delta_time[-1])
-
-    return creep_rate_avg, load_over_area_avg
+    result = calc_creep_windows(time, disp, load, area_function, n_windows=parts, t_min=t_min)
+    return result["strain_rate"], result["stress"]
@@ -0,0 +1,170 @@
+"""
+Batch versions of the nanoindentation analysis in ni_analyser for many measurements.
+Only the needed data (e.g. the unloading curve and the area function) is sent to worker processes.
+Results are returned as columnar tables: {column name: numpy array (or list for strings)}.
+@author: Nathanael Jöhrmann
+"""
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import partial
+from typing import Iterable, List
+
+import numpy as np
+
+from pi88reader.ni_analyser import calc_unloading_data_from_curve, get_triboscan_start_values, \
+    calc_fit_window_sweep_from_curve, calc_unloading_bootstrap_from_curve
+from pi88reader.ni_cache import UnloadingDataCache, get_unloading_data_key
+from pi88reader.pi88_importer import SegmentType
+
+
+def map_jobs(function, jobs: list, workers: int = None, executor: Executor = None) -> list:
+    """
+    Returns [function(job) for job in jobs], calculated serial, in a process pool with
+    workers processes or with executor. function has to be a module level function.
+    """
+    if executor is not None:
+        return list(executor.map(function, jobs))
+    if workers is not None and workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(function, jobs, chunksize=max(1, len(jobs) // (4 * workers))))
+    return [function(job) for job in jobs]
+
+
+def get_table_from_rows(rows: List[dict]) -> dict:
+    """Converts a list of dicts (same keys) into {key: column}. Numeric columns become numpy arrays."""
+    result = {}
+    if len(rows) == 0:
+        return result
+    for key in rows[0]:
+        column = [row[key] for row in rows]
+        if all(isinstance(value, (bool, int, float, np.number, np.bool_)) for value in column):
+            result[key] = np.array(column)
+        else:
+            result[key] = column
+    return result
+
+
+def get_rows_from_table(table: dict) -> List[dict]:
+    """Converts {key: column} into a list of dicts (e.g. the result format of calc_unloading_data)."""
+    if len(table) == 0:
+        return []
+    n_rows = len(next(iter(table.values())))
+    return [{key: (column[i].item() if isinstance(column, np.ndarray) else column[i])
+             for key, column in table.items()}
+            for i in range(n_rows)]
+
+
+def get_unloading_job(measurement) -> tuple:
+    """
+    Returns the data of measurement needed for an unloading analysis:
+    (displacement, load, area_function, name, base_name, TriboScan fit parameters or None)
+    """
+    header, time, displacement, load = measurement.get_segment_curve(SegmentType.UNLOAD, occurence=-1)
+    return (np.array(displacement), np.array(load), measurement.area_function,
+            measurement.name, measurement.base_name, get_triboscan_start_values(measurement.settings.dict))
+
+
+def _calc_unloading_data_job(job: tuple, upper, lower, beta, poisson_ratio, warm_start=False) -> dict:
+    displacement, load, area_function, name, base_name, triboscan_start_values = job
+    return calc_unloading_data_from_curve(displacement, load, area_function, upper, lower, beta,
+                                          poisson_ratio, name=name, base_name=base_name,
+                                          start_values=triboscan_start_values if warm_start else None)
+
+
+def _get_job_key(job: tuple, upper, lower, beta, poisson_ratio, warm_start) -> str:
+    displacement, load, area_function, name, base_name, triboscan_start_values = job
+    return get_unloading_data_key(displacement, load, area_function, upper, lower, beta, poisson_ratio,
+                                  triboscan_start_values if warm_start else None)
+
+
+def calc_unloading_data_batch(measurements: Iterable, upper=0.95, lower=0.20, beta=1, poisson_ratio=0.3,
+                              workers: int = None, executor: Executor = None, warm_start: bool = False,
+                              cache: UnloadingDataCache = None) -> dict:
+    """
+    Oliver-Pharr analysis (ni_analyser.calc_unloading_data) of many measurements.
+    The power law fits run in a process pool, if workers > 1 (or with executor).
+    :param warm_start: see ni_analyser.calc_unloading_data
+    :param cache: Optional UnloadingDataCache (e.g. ni_cache.unloading_data_cache). Only measurements
+        without a cached result are analysed; new results are added to the cache.
+    :return: dict
+        {column name: column} with the keys of calc_unloading_data
+        (h_max, P_max, fit_A, fit_hf, fit_m, fit_failed, stiffness, hc_max, Ac_max, hardness, Er, E ...)
+        One row per measurement (same order); use get_rows_from_table to get a list of dicts.
+    """
+    jobs = [get_unloading_job(measurement) for measurement in measurements]
+    calc_job = partial(_calc_unloading_data_job, upper=upper, lower=lower, beta=beta, poisson_ratio=poisson_ratio,
+                       warm_start=warm_start)
+    if cache is None:
+        return get_table_from_rows(map_jobs(calc_job, jobs, workers, executor))
+
+    keys = [_get_job_key(job, upper, lower, beta, poisson_ratio, warm_start) for job in jobs]
+    rows = [cache.get(key, name=job[3], base_name=job[4]) for key, job in zip(keys, jobs)]
+    missing = {}  # {key: index of first job} -> identical curves are analysed only once
+    for i, (key, row) in enumerate(zip(keys, rows)):
+        if row is None:
+            missing.setdefault(key, i)
+    results = dict(zip(missing, map_jobs(calc_job, [jobs[i] for i in missing.values()], workers, executor)))
+    for key, result in results.items():
+        cache.put(key, result)
+    for i, row in enumerate(rows):
+        if row is None:
+            rows[i] = dict(results[keys[i]], name=jobs[i][3], base_name=jobs[i][4])
+    return get_table_from_rows(rows)
+
+
+def _calc_fit_window_sweep_job(job: tuple, uppers, lowers, beta, poisson_ratio, warm_start=False,
+                               min_points=3) -> dict:
+    displacement, load, area_function, name, base_name, triboscan_start_values = job
+    return calc_fit_window_sweep_from_curve(displacement, load, area_function, uppers, lowers, beta, poisson_ratio,
+                                            start_values=triboscan_start_values if warm_start else None,
+                                            min_points=min_points)
+
+
+def calc_fit_window_sweep_batch(measurements: Iterable, uppers: Iterable = np.linspace(0.5, 0.98, 13),
+                                lowers: Iterable = np.linspace(0.05, 0.45, 9), beta=1, poisson_ratio=0.3,
+                                workers: int = None, executor: Executor = None, warm_start: bool = False,
+                                min_points: int = 3) -> dict:
+    """
+    Sensitivity of the unloading analysis to the fit window: ni_analyser.calc_fit_window_sweep_from_curve
+    for many measurements (one job per measurement; in a process pool, if workers > 1 or with executor).
+    :param min_points: see calc_fit_window_sweep_from_curve
+    :return: dict (result cube)
+        {"upper": array, "lower": array, "name": list, "base_name": list,
+         "Er", "hardness", "E", "stiffness", "fit_failed" ...: array of shape (n_measurements, n_upper, n_lower)}
+        e.g. result["Er"][k, i, j] is Er of measurement k with the window (upper[i], lower[j])
+    """
+    uppers = np.asarray(uppers, dtype=float)
+    lowers = np.asarray(lowers, dtype=float)
+    jobs = [get_unloading_job(measurement) for measurement in measurements]
+    calc_job = partial(_calc_fit_window_sweep_job, uppers=uppers, lowers=lowers, beta=beta,
+                       poisson_ratio=poisson_ratio, warm_start=warm_start, min_points=min_points)
+    sweeps = map_jobs(calc_job, jobs, workers, executor)
+
+    result = {"upper": uppers, "lower": lowers,
+              "name": [job[3] for job in jobs], "base_name": [job[4] for job in jobs]}
+    if sweeps:
+        for key in sweeps[0]:
+            result[key] = np.stack([sweep[key] for sweep in sweeps])
+    return result
+
+
+def _calc_unloading_bootstrap_job(job_and_seed: tuple, upper, lower, beta, poisson_ratio, **kwargs) -> dict:
+    (displacement, load, area_function, name, base_name, _), seed = job_and_seed
+    return calc_unloading_bootstrap_from_curve(displacement, load, area_function, upper, lower, beta, poisson_ratio,
+                                               name=name, base_name=base_name, seed=seed, **kwargs)
+
+
+def calc_unloading_bootstrap_batch(measurements: Iterable, upper=0.95, lower=0.20, beta=1, poisson_ratio=0.3,
+                                   workers: int = None, executor: Executor = None, seed=None, **kwargs) -> dict:
+    """
+    Unloading analysis with bootstrap confidence intervals (ni_analyser.calc_unloading_bootstrap_from_curve)
+    for many measurements (one job per measurement; in a process pool, if workers > 1 or with executor).
+    :param seed: seed for the random resampling (independent random streams for each measurement)
+    :param kwargs: passed to calc_unloading_bootstrap_from_curve (n_resamples, method, confidence, chunk_size)
+    :return: dict
+        {column name: column}; columns of calc_unloading_data_batch plus e.g. Er_lower, Er_upper, Er_std
+    """
+    jobs = [get_unloading_job(measurement) for measurement in measurements]
+    seeds = np.random.SeedSequence(seed).spawn(len(jobs))
+    calc_job = partial(_calc_unloading_bootstrap_job, upper=upper, lower=lower, beta=beta,
+                       poisson_ratio=poisson_ratio, **kwargs)
+    return get_table_from_rows(map_jobs(calc_job, list(zip(jobs, seeds)), workers, executor))
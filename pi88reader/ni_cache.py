@@ -0,0 +1,178 @@
+"""
+Cache for results of the unloading analysis (ni_analyser.calc_unloading_data). Entries are keyed by
+the content of the unloading curve, the area function and the analysis parameters - not by the
+measurement object - so the same fit is reused by plots, PPTX tables and Excel export (and, with
+cache_dir, by later runs). LRUFileCache is also the base of pi88_plotter.FigureCache.
+@author: Nathanael Jöhrmann
+"""
+import abc
+import hashlib
+import json
+import os
+import warnings
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+# increase, whenever the analysis (and thereby the cached results) changes
+UNLOADING_CACHE_VERSION = 3
+AREA_FUNCTION_COEFFICIENTS = ("b", "c0", "c1", "c2", "c3", "c4", "c5")
+
+
+def get_unloading_data_key(displacement, load, area_function, upper, lower, beta, poisson_ratio,
+                           start_values=None) -> str:
+    """Returns a hash (hex string) of the unloading curve, the area function coefficients and the parameters."""
+    key = hashlib.sha1()
+    for array in (displacement, load):
+        array = np.ascontiguousarray(array, dtype=float)
+        key.update(str(len(array)).encode())
+        key.update(array.tobytes())
+    coefficients = [getattr(area_function, name, None) for name in AREA_FUNCTION_COEFFICIENTS]
+    key.update(repr((UNLOADING_CACHE_VERSION, coefficients, float(upper), float(lower), float(beta),
+                     float(poisson_ratio), start_values)).encode())
+    return key.hexdigest()
+
+
+def _encode_json(value):
+    if isinstance(value, np.generic):  # numpy scalars (e.g. np.bool_) -> python types
+        return value.item()
+    raise TypeError(f"Can't write {type(value).__name__} into the unloading data cache")
+
+
+class LRUFileCache(abc.ABC):
+    """
+    LRU cache {key: value}, limited by the total size of the values (see _get_size; default: number of values).
+    Optionally, values are also written to (and read from) cache_dir (one file per key).
+    Subclasses define the serialisation (abstract methods _dumps, _loads) and file_extension.
+    """
+    file_extension = ".cache"
+
+    def __init__(self, max_size: int, cache_dir: Optional[str] = None):
+        """
+        :param max_size: maximal total size of the values kept in memory (least recently used are removed first)
+        :param cache_dir: Optional folder. If given, values are also written to (and read from) this folder.
+        """
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self._data = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data or (self.cache_dir is not None and os.path.isfile(self._get_filename(key)))
+
+    def clear(self) -> None:
+        """Removes all values from memory (files in cache_dir are kept)."""
+        self._data.clear()
+        self.size = 0
+
+    def _get_size(self, value) -> int:
+        return 1
+
+    @abc.abstractmethod
+    def _dumps(self, value) -> bytes:
+        """Returns value as bytes (content of the cache file)."""
+
+    @abc.abstractmethod
+    def _loads(self, data: bytes):
+        """Returns the value read from data (see _dumps). Raises an exception, if data is not valid."""
+
+    def _get_filename(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + self.file_extension)
+
+    def _read_file(self, key: str):
+        filename = self._get_filename(key)
+        try:
+            with open(filename, 'rb') as file:
+                return self._loads(file.read())
+        except FileNotFoundError:
+            return None
+        except Exception as e:  # damaged cache file -> will be overwritten
+            warnings.warn(f"Couldn't read cache file {filename}: {e}")
+            return None
+
+    def _write_file(self, key: str, value) -> None:
+        filename = self._get_filename(key)
+        temp_filename = f"{filename}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(temp_filename, 'wb') as file:
+                file.write(self._dumps(value))
+            os.replace(temp_filename, filename)  # never leave a half written cache file
+        except OSError as e:
+            warnings.warn(f"Couldn't write cache file {filename}: {e}")
+
+    def get(self, key: str):
+        """Returns the cached value or None."""
+        value = self._data.get(key)
+        if value is None and self.cache_dir is not None:
+            value = self._read_file(key)
+            if value is not None:
+                self._add(key, value)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key: str, value) -> None:
+        self._add(key, value)
+        if self.cache_dir is not None:
+            self._write_file(key, value)
+
+    def _add(self, key: str, value) -> None:
+        if key in self._data:
+            self.size -= self._get_size(self._data.pop(key))
+        self._data[key] = value
+        self.size += self._get_size(value)
+        while self.size > self.max_size and len(self._data) > 1:  # keep at least the newest value
+            self.size -= self._get_size(self._data.popitem(last=False)[1])
+
+
+class UnloadingDataCache(LRUFileCache):
+    """
+    LRU cache {key: result of calc_unloading_data} (see get_unloading_data_key), files: <key>.unloading (JSON,
+    so reading files of a shared cache_dir can't execute code)
+    Name and base_name of the measurement are not part of the cached result (stored as None); they are set
+    by get(). The key order of a cached result is the same as that of a new one (e.g. Excel column order).
+    """
+    file_extension = ".unloading"
+
+    def __init__(self, max_size: int = 4096, cache_dir: Optional[str] = None):
+        """
+        :param max_size: maximal number of results kept in memory (least recently used are removed first)
+        :param cache_dir: Optional folder. If given, results are also written to (and read from) this folder.
+        """
+        super().__init__(max_size, cache_dir)
+
+    def _dumps(self, value: dict) -> bytes:
+        return json.dumps(value, default=_encode_json).encode("utf-8")
+
+    def _loads(self, data: bytes) -> dict:
+        result = json.loads(data.decode("utf-8"))
+        if not isinstance(result, dict):
+            raise ValueError("not an unloading result")
+        return result
+
+    def get(self, key: str, name=None, base_name=None) -> Optional[dict]:
+        """Returns a copy of the cached result (with name and base_name) or None."""
+        result = super().get(key)
+        if result is None:
+            return None
+        result = dict(result)
+        result["name"] = name
+        result["base_name"] = base_name
+        return result
+
+    def put(self, key: str, result: dict) -> None:
+        super().put(key, {name: (None if name in ("name", "base_name") else value) for name, value in result.items()})
+
+
+# cache shared by PI88Plotter, PI88ToPPTX and PI88ToExcel (use unloading_data_cache.cache_dir for persistence)
+unloading_data_cache = UnloadingDataCache()
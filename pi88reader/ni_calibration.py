@@ -0,0 +1,117 @@
+"""
+Area function calibration from reference indents with known (reduced) modulus, e.g. fused silica.
+For each indent the unloading analysis (ni_analyser.calc_unloading_data) gives stiffness S and contact
+depth hc; the area needed to get the known modulus is Ac = pi * (0.5 * S * 1000 / (beta * Er))^2.
+The area function coefficients are fitted to (hc, Ac) of all indents at once (weighted least squares).
+@author: Nathanael Jöhrmann
+"""
+from concurrent.futures import Executor
+from typing import Iterable, Optional, Union
+
+import numpy as np
+
+from pi88reader.ni_analyser import calc_Er_from_E
+from pi88reader.ni_batch import calc_unloading_data_batch
+from pi88reader.ni_cache import UnloadingDataCache
+from pi88reader.pi88_importer import PI88AreaFunction
+
+# reduced modulus of fused silica [GPa] (E = 72 GPa, poisson ratio 0.17, diamond tip)
+FUSED_SILICA_ER = calc_Er_from_E(72, 0.17)
+# exponents of the area function terms c0 ... c5
+AREA_FUNCTION_EXPONENTS = (2, 1, 1 / 2, 1 / 4, 1 / 8, 1 / 16)
+
+
+def get_calibration_data(measurements: Iterable, Er: Union[float, Iterable] = FUSED_SILICA_ER, upper=0.95,
+                         lower=0.20, beta=1, workers: int = None, executor: Executor = None,
+                         cache: Optional[UnloadingDataCache] = None) -> dict:
+    """
+    Contact depth and contact area (as needed for the known modulus) of reference indents.
+    The area function of the measurements is not used (hc depends on the unloading fit only).
+    :param Er: known reduced modulus [GPa] (float or one value per measurement)
+    :param workers, executor, cache: see ni_batch.calc_unloading_data_batch
+    :return: {"name", "base_name": list, "hc_max", "Ac", "stiffness", "P_max", "h_max": array}
+        (failed unloading fits are removed)
+    """
+    measurements = list(measurements)
+    table = calc_unloading_data_batch(measurements, upper, lower, beta, workers=workers, executor=executor,
+                                      cache=cache)
+    if len(measurements) == 0:
+        result = {"name": [], "base_name": []}
+        result.update({name: np.zeros(0) for name in ("stiffness", "P_max", "h_max", "hc_max", "Ac")})
+        return result
+    valid = ~np.asarray(table["fit_failed"], dtype=bool)
+    Er = np.broadcast_to(np.asarray(Er, dtype=float), valid.shape)[valid]
+    stiffness = table["stiffness"][valid]
+    result = {"name": [name for name, ok in zip(table["name"], valid) if ok],
+              "base_name": [name for name, ok in zip(table["base_name"], valid) if ok],
+              "stiffness": stiffness,
+              "P_max": table["P_max"][valid],
+              "h_max": table["h_max"][valid]}
+    result["hc_max"] = result["h_max"] - 0.75 * result["P_max"] / stiffness  # see ni_analyser.calc_hc
+    result["Ac"] = np.pi * (0.5 * stiffness * 1000 / (beta * Er)) ** 2  # calc_Er solved for Ac_max
+    return result
+
+
+def fit_area_function_coefficients(hc, area, weights=None, n_terms: int = 6, c0: Optional[float] = None) -> np.ndarray:
+    """
+    Weighted least squares fit of area = c0*hc^2 + c1*hc + c2*hc^(1/2) + ... + c5*hc^(1/16).
+    :param weights: one weight per point (default: 1/area -> relative deviations)
+    :param n_terms: number of terms used (1 ... 6); coefficients of unused terms are 0
+    :param c0: optional fixed c0 (e.g. 24.5 for an ideal Berkovich tip)
+    :return: array [c0, c1, c2, c3, c4, c5]
+    Raises ValueError, if there are less (distinct) points than free coefficients (underdetermined fit).
+    """
+    hc = np.asarray(hc, dtype=float)
+    area = np.asarray(area, dtype=float)
+    weights = 1 / area if weights is None else np.asarray(weights, dtype=float)
+    n_free = n_terms - (c0 is not None)
+    n_points = len(np.unique(hc[weights != 0]))
+    if n_points < n_free:
+        raise ValueError(f"Area function fit with {n_free} free coefficients needs at least {n_free} "
+                         f"reference points (got {n_points})")
+    design = hc[:, np.newaxis] ** np.array(AREA_FUNCTION_EXPONENTS[:n_terms])
+    target = area.copy()
+    free = np.ones(n_terms, dtype=bool)
+    if c0 is not None:
+        target -= c0 * design[:, 0]
+        free[0] = False
+    design = design[:, free] * weights[:, np.newaxis]
+    scale = np.linalg.norm(design, axis=0)  # column scaling -> better conditioned problem
+    scale[scale == 0] = 1
+    solution, *_ = np.linalg.lstsq(design / scale, target * weights, rcond=None)
+
+    result = np.zeros(len(AREA_FUNCTION_EXPONENTS))
+    result[:n_terms][free] = solution / scale
+    if c0 is not None:
+        result[0] = c0
+    return result
+
+
+def get_area_function(coefficients, b=None, filename: str = "calibrated") -> PI88AreaFunction:
+    """Returns a PI88AreaFunction with the given coefficients [c0, ... c5]."""
+    names = dict(PI88AreaFunction.data_names)
+    settings = {names["filename"]: filename, names["b"]: b}
+    settings.update({names[f"c{i}"]: float(coefficient) for i, coefficient in enumerate(coefficients)})
+    return PI88AreaFunction(settings)
+
+
+def calibrate_area_function(measurements: Iterable, Er: Union[float, Iterable] = FUSED_SILICA_ER, upper=0.95,
+                            lower=0.20, beta=1, n_terms: int = 6, c0: Optional[float] = None, weights=None,
+                            workers: int = None, executor: Executor = None,
+                            cache: Optional[UnloadingDataCache] = None) -> PI88AreaFunction:
+    """
+    Calibrates a new area function from reference indents (see module doc string).
+    :param measurements: reference measurements (PI88Measurement), e.g. on fused silica at different loads
+    :param Er: known reduced modulus [GPa] (float or one value per measurement)
+    :param n_terms, c0, weights: see fit_area_function_coefficients (weights per successful fit);
+        n_terms is reduced, if there are less reference indents than free coefficients
+    :param workers, executor, cache: see ni_batch.calc_unloading_data_batch
+    :return: PI88AreaFunction
+    """
+    data = get_calibration_data(measurements, Er, upper, lower, beta, workers, executor, cache)
+    n_indents = len(np.unique(data["hc_max"]))
+    if n_indents == 0:
+        raise ValueError("No reference indent with a successful unloading fit")
+    n_terms = min(n_terms, n_indents + (c0 is not None))
+    coefficients = fit_area_function_coefficients(data["hc_max"], data["Ac"], weights, n_terms, c0)
+    return get_area_function(coefficients)
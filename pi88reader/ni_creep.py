@@ -0,0 +1,231 @@
+"""
+Creep analysis of hold segments (no plotting). The hold segment is divided into windows (a number of
+windows with the same number of points, or windows of the same duration); averages of each window
+are calculated for all windows at once via cumulative sums.
+Units: time [s], displacement [nm], load [µN], stress [N/m^2], strain rate [1/s]
+@author: Nathanael Jöhrmann
+"""
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+
+from pi88reader.pi88_importer import SegmentType
+
+# names of the results of calc_creep_windows (one value per window)
+CREEP_WINDOW_NAMES = ("time", "displacement", "load", "area", "stress", "strain_rate")
+
+
+def get_hold_segment(measurement, occurence: int = 1) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns time, displacement and load of a hold segment of measurement (see get_segment_curve)."""
+    header, time, displacement, load = measurement.get_segment_curve(SegmentType.HOLD, occurence=occurence)
+    return np.asarray(time, dtype=float), np.asarray(displacement, dtype=float), np.asarray(load, dtype=float)
+
+
+def get_creep_window_edges(time, n_windows: int = 10, window_time: Optional[float] = None,
+                           t_min: float = 50) -> np.ndarray:
+    """
+    Returns index edges of the averaging windows (window i is [edges[i], edges[i+1])). The first window
+    is a reference window before t_min (only used for the first strain rate); followed by the windows
+    after t_min.
+    :param time: time of the hold segment (sorted)
+    :param n_windows: number of windows after t_min (same number of points); ignored, if window_time is given
+    :param window_time: duration of each window [s] (number of windows depends on the segment length)
+    :param t_min: data before t_min (except the reference window) is ignored
+    :return: array of n + 2 indices (n windows after t_min)
+    """
+    time = np.asarray(time)
+    min_index = np.searchsorted(time, t_min, side='right')
+    if window_time is not None:
+        if len(time) == 0 or time[-1] <= t_min:
+            return np.zeros(0, dtype=int)
+        n_windows = int((time[-1] - t_min) // window_time)
+        edge_times = t_min + window_time * np.arange(-1, n_windows + 1)
+        return np.searchsorted(time, edge_times, side='right')
+    n = (len(time) - min_index) // n_windows  # points per window
+    if n == 0:
+        return np.zeros(0, dtype=int)
+    return np.maximum(min_index + n * np.arange(-1, n_windows + 1), 0)
+
+
+def calc_window_means(values, edges) -> np.ndarray:
+    """Returns the mean of values for each window [edges[i], edges[i+1]) (nan for empty windows)."""
+    values = np.asarray(values, dtype=float)
+    edges = np.asarray(edges)
+    if len(edges) < 2:
+        return np.zeros(0)
+    offset = values[0] if len(values) else 0  # better precision of the cumulative sum
+    cumsum = np.concatenate(([0], np.cumsum(values - offset)))
+    counts = np.diff(edges)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (cumsum[edges[1:]] - cumsum[edges[:-1]]) / counts + offset
+
+
+def _calc_creep_results(result: dict, area_function) -> None:
+    """Adds area, stress and strain_rate to result (window means incl. reference window) and drops the reference window."""
+    get_area = getattr(area_function, "get_area", area_function)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result["area"] = get_area(result["displacement"]) * 1e-18  # [m^2]
+        result["stress"] = result["load"] * 1e-6 / result["area"]  # [N/m^2]
+        strain_rate = (np.diff(result["displacement"], axis=-1) / result["displacement"][..., :-1]
+                       / np.diff(result["time"], axis=-1))
+    for name in ("time", "displacement", "load", "area", "stress"):
+        result[name] = result[name][..., 1:]
+    result["strain_rate"] = strain_rate
+
+
+def calc_creep_windows(time, displacement, load, area_function, n_windows: int = 10,
+                       window_time: Optional[float] = None, t_min: float = 50) -> dict:
+    """
+    Windowed creep analysis of a hold segment (see get_creep_window_edges for the windows).
+    :param area_function: PI88AreaFunction (or a function area(displacement))
+    :return: {name: array with one value per window} for CREEP_WINDOW_NAMES
+        strain_rate ... (change of mean displacement / mean displacement of the previous window) / change of mean time
+    """
+    edges = get_creep_window_edges(time, n_windows, window_time, t_min)
+    result = {"time": calc_window_means(time, edges),
+              "displacement": calc_window_means(displacement, edges),
+              "load": calc_window_means(load, edges)}
+    if len(edges) < 2:
+        return {name: np.zeros(0) for name in CREEP_WINDOW_NAMES}
+    _calc_creep_results(result, area_function)
+    return result
+
+
+def calc_creep_windows_batch(measurements: Iterable, n_windows: int = 10, window_time: Optional[float] = None,
+                             t_min: float = 50, occurence: int = 1) -> dict:
+    """
+    calc_creep_windows for the hold segments of many measurements. The segments are concatenated and the
+    window means of all measurements are calculated in one pass.
+    :param occurence: hold segment to use (see PI88Measurement.get_segment_curve)
+    :return: dict
+        {"name": list, "base_name": list, "n_windows": array, name: array of shape (n_measurements, max. windows)}
+        for CREEP_WINDOW_NAMES; measurements with less windows are padded with nan.
+    """
+    measurements = list(measurements)
+    segments = [get_hold_segment(measurement, occurence) for measurement in measurements]
+    all_edges = []
+    offset = 0
+    for time, displacement, load in segments:
+        all_edges.append(get_creep_window_edges(time, n_windows, window_time, t_min) + offset)
+        offset += len(time)
+    window_counts = np.array([max(len(edges) - 2, 0) for edges in all_edges])
+    max_windows = window_counts.max(initial=0)
+
+    # windows of all measurements; each measurement contributes its windows + an empty gap window
+    edges = np.concatenate([edges for edges in all_edges if len(edges)] or [np.zeros(0, dtype=int)])
+    result = {"name": [measurement.name for measurement in measurements],
+              "base_name": [measurement.base_name for measurement in measurements],
+              "n_windows": window_counts}
+    means = {}
+    for i, name in enumerate(("time", "displacement", "load")):
+        values = np.concatenate([segment[i] for segment in segments] or [np.zeros(0)])
+        means[name] = calc_window_means(values, edges) if len(edges) else np.zeros(0)
+
+    shape = (len(measurements), max_windows + 1)
+    windows = {name: np.full(shape, np.nan) for name in means}
+    start = 0
+    for k, edges_k in enumerate(all_edges):
+        if len(edges_k) == 0:
+            continue
+        for name in means:
+            windows[name][k, :len(edges_k) - 1] = means[name][start:start + len(edges_k) - 1]
+        start += len(edges_k)  # skip gap window between measurements
+
+    result.update({name: np.full((len(measurements), max_windows), np.nan) for name in CREEP_WINDOW_NAMES})
+    for k, measurement in enumerate(measurements):
+        if window_counts[k] == 0:
+            continue
+        creep = {name: windows[name][k, :window_counts[k] + 1] for name in windows}
+        _calc_creep_results(creep, measurement.area_function)
+        for name in CREEP_WINDOW_NAMES:
+            result[name][k, :window_counts[k]] = creep[name]
+    return result
+
+
+def fit_creep_exponents(stress, strain_rate) -> dict:
+    """
+    Power law creep (strain_rate = B * stress^n): linear fits of log(strain_rate) over log(stress),
+    one for each row (measurement). Non positive or nan values are ignored.
+    :param stress: array of shape (n_measurements, n_windows) (or (n_windows,))
+    :param strain_rate: same shape as stress
+    :return: {"n", "n_stderr", "log_B", "r_squared", "n_points": array of shape (n_measurements,)}
+        values are nan for less than 3 valid points
+    """
+    stress = np.atleast_2d(np.asarray(stress, dtype=float))
+    strain_rate = np.atleast_2d(np.asarray(strain_rate, dtype=float))
+    valid = (stress > 0) & (strain_rate > 0)  # (nan compares False)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x = np.where(valid, np.log(np.where(valid, stress, 1)), 0)
+        y = np.where(valid, np.log(np.where(valid, strain_rate, 1)), 0)
+        n_points = valid.sum(axis=1)
+        x_mean = x.sum(axis=1) / n_points
+        y_mean = y.sum(axis=1) / n_points
+        dx = np.where(valid, x - x_mean[:, np.newaxis], 0)
+        dy = np.where(valid, y - y_mean[:, np.newaxis], 0)
+        sxx = (dx * dx).sum(axis=1)
+        syy = (dy * dy).sum(axis=1)
+        n = (dx * dy).sum(axis=1) / sxx
+        ssr = syy - n ** 2 * sxx  # sum of squared residuals
+        n_stderr = np.sqrt(np.maximum(ssr, 0) / (n_points - 2) / sxx)
+        r_squared = 1 - ssr / syy
+    enough = n_points >= 3
+    return {"n": np.where(enough, n, np.nan),
+            "n_stderr": np.where(enough, n_stderr, np.nan),
+            "log_B": np.where(enough, y_mean - n * x_mean, np.nan),
+            "r_squared": np.where(enough, r_squared, np.nan),
+            "n_points": n_points}
+
+
+def fit_global_creep_exponent(stress, strain_rate, individual_intercepts: bool = True) -> dict:
+    """
+    One creep exponent n for all measurements (e.g. a set of creep measurements with different loads).
+    :param stress: array of shape (n_measurements, n_windows)
+    :param strain_rate: same shape as stress
+    :param individual_intercepts: if True, each measurement has its own log_B (only the slope is shared;
+        robust against offsets between measurements, e.g. drift); otherwise all points are fitted with one
+        straight line.
+    :return: {"n", "n_stderr", "n_points", "n_measurements"} (log_B and r_squared for a common intercept)
+    """
+    stress = np.atleast_2d(np.asarray(stress, dtype=float))
+    strain_rate = np.atleast_2d(np.asarray(strain_rate, dtype=float))
+    valid = (stress > 0) & (strain_rate > 0)
+    used_rows = valid.any(axis=1)
+    if not individual_intercepts:
+        result = fit_creep_exponents(stress[valid], strain_rate[valid])
+        result = {name: value[0] for name, value in result.items()}
+        result["n_measurements"] = int(used_rows.sum())
+        return result
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x = np.where(valid, np.log(np.where(valid, stress, 1)), 0)
+        y = np.where(valid, np.log(np.where(valid, strain_rate, 1)), 0)
+        row_points = valid.sum(axis=1, keepdims=True)
+        dx = np.where(valid, x - x.sum(axis=1, keepdims=True) / row_points, 0)
+        dy = np.where(valid, y - y.sum(axis=1, keepdims=True) / row_points, 0)
+        sxx = (dx * dx).sum()
+        n = (dx * dy).sum() / sxx
+        ssr = (dy * dy).sum() - n ** 2 * sxx
+        n_points = int(valid.sum())
+        degrees_of_freedom = n_points - int(used_rows.sum()) - 1  # one intercept per measurement + slope
+        n_stderr = np.sqrt(max(ssr, 0) / degrees_of_freedom / sxx) if degrees_of_freedom > 0 else np.nan
+    return {"n": n, "n_stderr": n_stderr, "n_points": n_points, "n_measurements": int(used_rows.sum())}
+
+
+def calc_creep_exponents_batch(measurements: Iterable, n_windows: int = 10, window_time: Optional[float] = None,
+                               t_min: float = 50, occurence: int = 1, individual_intercepts: bool = True) -> dict:
+    """
+    Creep exponents of many measurements: calc_creep_windows_batch + fit_creep_exponents (per measurement)
+    + fit_global_creep_exponent (all measurements).
+    :return: dict
+        {"name", "base_name", "n", "n_stderr", "log_B", "r_squared", "n_points": one entry per measurement,
+         "global_n", "global_n_stderr": pooled fit,
+         "windows": result of calc_creep_windows_batch}
+    """
+    windows = calc_creep_windows_batch(measurements, n_windows, window_time, t_min, occurence)
+    result = {"name": windows["name"], "base_name": windows["base_name"]}
+    result.update(fit_creep_exponents(windows["stress"], windows["strain_rate"]))
+    global_fit = fit_global_creep_exponent(windows["stress"], windows["strain_rate"], individual_intercepts)
+    result["global_n"] = global_fit["n"]
+    result["global_n_stderr"] = global_fit["n_stderr"]
+    result["windows"] = windows
+    return result
@@ -0,0 +1,140 @@
+"""
+Analysis of the averaged dynamic data (e.g. storage modulus and hardness over contact depth).
+PI88Measurement cleans each average dynamic channel separately (remove_nans), so the cleaned channels
+are not necessarily aligned. Here one valid-sample mask is used for all channels of interest instead.
+@author: Nathanael Jöhrmann
+"""
+from typing import Iterable, Optional, Sequence, Union
+
+import numpy as np
+
+from pi88reader.pi88_importer import PI88Measurement
+
+DYNAMIC_NAMES = tuple(attribute_name for name_tuples in PI88Measurement.dynamic_groups.values()
+                      for attribute_name, _ in name_tuples)
+# default channels of calc_depth_profiles
+DEPTH_PROFILE_NAMES = ("average_dynamic_storage_mod", "average_dynamic_loss_mod", "average_dynamic_complex_mod",
+                       "average_dynamic_tan_delta", "average_dynamic_hardness")
+
+
+def _get_raw_channels(measurement, names: Iterable[str]) -> dict:
+    """Returns {name: raw channel (incl. nan)} for all names available in measurement."""
+    result = {}
+    for name in names:
+        value = measurement.get_average_dynamic_raw(name)
+        if value is not None:
+            result[name] = np.asarray(value, dtype=float)
+    return result
+
+
+def get_dynamic_valid_mask(measurement, names: Optional[Sequence[str]] = None) -> np.ndarray:
+    """
+    Returns one mask of the samples, that are valid (finite) in all given average dynamic channels.
+    Channels of different length are truncated to the shortest one (missing channels are ignored).
+    :param names: attribute names (default: DYNAMIC_NAMES)
+    :return: bool array
+    """
+    channels = _get_raw_channels(measurement, DYNAMIC_NAMES if names is None else names)
+    if not channels:
+        return np.zeros(0, dtype=bool)
+    length = min(len(channel) for channel in channels.values())
+    mask = np.ones(length, dtype=bool)
+    for channel in channels.values():
+        mask &= np.isfinite(channel[:length])
+    return mask
+
+
+def get_dynamic_table(measurement, names: Optional[Sequence[str]] = None) -> dict:
+    """
+    Returns the valid samples (see get_dynamic_valid_mask) of the average dynamic channels names, aligned.
+    If all samples are valid, the columns are views of the loaded channels; otherwise the valid samples
+    are copied once into one block and the columns are views (rows) of this block.
+    :param names: attribute names (default: DYNAMIC_NAMES); missing channels are not part of the result
+    :return: {name: array} (all arrays have the same length)
+    """
+    channels = _get_raw_channels(measurement, DYNAMIC_NAMES if names is None else names)
+    mask = get_dynamic_valid_mask(measurement, list(channels))
+    if mask.all():
+        return {name: channel[:len(mask)] for name, channel in channels.items()}
+
+    block = np.empty((len(channels), np.count_nonzero(mask)))
+    for row, channel in zip(block, channels.values()):
+        np.compress(mask, channel[:len(mask)], out=row)
+    return dict(zip(channels, block))
+
+
+def _get_bin_edges(depths: np.ndarray, bins: Union[int, Sequence[float]]) -> np.ndarray:
+    if not np.isscalar(bins):
+        return np.asarray(bins, dtype=float)
+    if len(depths) == 0:
+        return np.linspace(0, 1, bins + 1)
+    return np.linspace(depths.min(), depths.max(), bins + 1)
+
+
+def calc_depth_profiles(measurements: Iterable, bins: Union[int, Sequence[float]] = 20,
+                        names: Sequence[str] = DEPTH_PROFILE_NAMES,
+                        depth_name: str = "average_dynamic_contact_depth") -> dict:
+    """
+    Depth profiles of average dynamic channels (e.g. hardness(contact depth)) for many measurements:
+    mean and standard deviation of the valid samples in each depth bin, for each measurement and pooled
+    (all samples of all measurements). All measurements and channels are binned in one pass (bincount).
+    :param bins: number of bins (between min. and max. depth of all measurements) or bin edges (sorted);
+        samples outside the bin edges are ignored
+    :param names: attribute names of the averaged channels
+    :param depth_name: attribute name of the depth channel
+    :return: dict
+        {"bin_edges": array (n_bins + 1,), "bin_centers": array (n_bins,), "name": list, "base_name": list,
+         "counts": array (n_measurements, n_bins), "pooled_counts": array (n_bins,),
+         name + "_mean", name + "_std": array (n_measurements, n_bins),
+         name + "_pooled_mean", name + "_pooled_std": array (n_bins,)}
+        mean and std are nan for empty bins; std with ddof=0
+    """
+    measurements = list(measurements)
+    names = list(names)
+    tables = [get_dynamic_table(measurement, [depth_name] + names) for measurement in measurements]
+    lengths = np.array([len(table.get(depth_name, ())) if set(table) >= {depth_name, *names} else 0
+                        for table in tables], dtype=int)
+    used = [table for table, length in zip(tables, lengths) if length]
+    depths = np.concatenate([table[depth_name] for table in used] or [np.zeros(0)])
+    values = np.array([np.concatenate([table[name] for table in used] or [np.zeros(0)]) for name in names])
+    values = values.reshape(len(names), len(depths))
+
+    bin_edges = _get_bin_edges(depths, bins)
+    n_bins = len(bin_edges) - 1
+    n_cells = len(measurements) * n_bins
+    bin_index = np.searchsorted(bin_edges, depths, side='right') - 1
+    bin_index[depths == bin_edges[-1]] = n_bins - 1  # last bin includes the right edge
+    valid = (bin_index >= 0) & (bin_index < n_bins)
+    cell = np.repeat(np.arange(len(measurements)), lengths) * n_bins + bin_index
+    cell, bin_index, values = cell[valid], bin_index[valid], values[:, valid]
+
+    # one index for each (channel, measurement, bin) -> all channels in one bincount
+    index = (np.arange(len(names))[:, np.newaxis] * n_cells + cell).ravel()
+    counts = np.bincount(cell, minlength=n_cells).reshape(len(measurements), n_bins)
+    pooled_counts = counts.sum(axis=0)
+    shape = (len(names), len(measurements), n_bins)
+    sums = np.bincount(index, weights=values.ravel(), minlength=len(names) * n_cells).reshape(shape)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+        pooled_means = sums.sum(axis=1) / pooled_counts
+        # second pass (deviations from the mean) -> no cancellation for large values with small scatter
+        deviations = values - means.reshape(len(names), n_cells)[:, cell]
+        squares = np.bincount(index, weights=(deviations ** 2).ravel(),
+                              minlength=len(names) * n_cells).reshape(shape)
+        stds = np.sqrt(squares / counts)
+        pooled_deviations = values - pooled_means[:, bin_index]
+        pooled_index = (np.arange(len(names))[:, np.newaxis] * n_bins + bin_index).ravel()
+        pooled_squares = np.bincount(pooled_index, weights=(pooled_deviations ** 2).ravel(),
+                                     minlength=len(names) * n_bins).reshape(len(names), n_bins)
+        pooled_stds = np.sqrt(pooled_squares / pooled_counts)
+
+    result = {"bin_edges": bin_edges, "bin_centers": (bin_edges[1:] + bin_edges[:-1]) / 2,
+              "name": [measurement.name for measurement in measurements],
+              "base_name": [measurement.base_name for measurement in measurements],
+              "counts": counts, "pooled_counts": pooled_counts}
+    for i, name in enumerate(names):
+        result[name + "_mean"] = means[i]
+        result[name + "_std"] = stds[i]
+        result[name + "_pooled_mean"] = pooled_means[i]
+        result[name + "_pooled_std"] = pooled_stds[i]
+    return result
@@ -1,14 +1,12 @@
 """
 @author: Nathanael Jöhrmann
 """
-from bisect import bisect
-
 import matplotlib.pyplot as plt
 import matplotlib.ticker as ticker
 import numpy as np
 
 from pptx_tools.templates import TemplateExample
-from pi88reader.pi88_importer import SegmentType
+from pi88reader.ni_creep import calc_creep_windows, get_hold_segment
 from pi88reader.plotter_styles import GraphStyler
 from pi88reader.pi88_to_pptx import PI88ToPPTX
 from pptx_tools.creator import PPTXPosition
@@ -101,54 +99,11 @@ def create_figure(x_label="", y_label=""):
     return figure, axes
 
 
-def get_avg_strain_rate_and_sigma(measurement):
-    header, time, disp, load = measurement.get_segment_curve(SegmentType.HOLD)
-    # for DMA:
-    header, time, disp, load = measurement.get_segment_curve(SegmentType.HOLD, occurence=2)
-
-    # find index with t > 50
-    min_index = bisect(time, 50)
-
-    # divide in roughly 130 parts
-    parts = 10  # 4
-    n = len(time[min_index:]) // parts  # average over n values; // -> floor division
-
-    avg_time = []
-    avg_disp = []
-    avg_load = []
-
-    delta_time = []  # [s]
-    delta_disp = []  # [m]
-
-    area_avg = []  # [m^2]
-    load_over_area_avg = []  # [N/m^2]
-    creep_rate_avg = []  # [m/s]
-
-    start_index = min_index - n
-    end_index = start_index + n
-    avg_time.append(np.mean(time[start_index:end_index]))
-    avg_disp.append(np.mean(disp[start_index:end_index]))
-    avg_load.append(np.mean(load[start_index:end_index]))
-
-    for i in range(0, parts):
-        start_index = min_index + i * n
-        end_index = start_index + n
-        avg_time.append(np.mean(time[start_index:end_index]))
-        avg_disp.append(np.mean(disp[start_index:end_index]))
-        avg_load.append(np.mean(load[start_index:end_index]))
-        # avg_load.append(np.mean(load[min_index:]))
-        # avg_disp.append(np.mean(disp[min_index:]))
-
-        delta_time.append(avg_time[-1] - avg_time[-2])
-        delta_disp.append((avg_disp[-1] - avg_disp[-2]) * 1e-9)
-
-        averaged_area = measurement.area_function.get_area(avg_disp[-1]) * 1e-18
-        area_avg.append(averaged_area)
-        averaged_load_over_area = avg_load[-1] * 1e-6 / averaged_area
-        load_over_area_avg.append(averaged_load_over_area)
-        creep_rate_avg.append((delta_disp[-1] / avg_disp[-2]) / delta_time[-1])
-
-    return creep_rate_avg, load_over_area_avg
+def get_avg_strain_rate_and_sigma(measurement, parts: int = 10, t_min: float = 50, occurence: int = 2):
+    # QS: occurence=1; for DMA: occurence=2
+    time, disp, load = get_hold_segment(measurement, occurence)
+    result = calc_creep_windows(time, disp, load, measurement.area_function, n_windows=parts, t_min=t_min)
+    return result["strain_rate"], result["stress"]
 
 
 def add_dlog_plot(axes, x, y, style, label="", fit_deg=0):
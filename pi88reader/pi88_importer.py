@@ -3,8 +3,11 @@
 """
 import glob
 import os
+from concurrent.futures import Executor, ProcessPoolExecutor
 from enum import Enum, auto
+from functools import partial
 from pathlib import Path
+from typing import Dict, List, Tuple
 
 import numpy as np
 
@@ -49,14 +52,153 @@ DATA_TYPE_DICT = {  # name, unit, PI88Measurement attribute name
 }
 
 
-def load_tdm_files(path: str, sort_key=os.path.getctime) -> list:  # sorted by creation time (using windows)
+def _load_tdm_file(file, cache_dir=None, lazy=False):
+    """Returns (measurement, None) or (None, exception). Module level function -> usable with a process pool."""
+    try:
+        return PI88Measurement(file, cache_dir=cache_dir, lazy=lazy), None
+    except Exception as e:
+        return None, e
+
+
+def _load_tdm_header(file):
+    """Returns (header, None) or (None, exception). Module level function -> usable with a process pool."""
+    try:
+        return PI88Header(file), None
+    except Exception as e:
+        return None, e
+
+
+def _map_files(load_file, files: list, workers: int = None, executor: Executor = None, errors: list = None) -> list:
+    """
+    Calls load_file for all files (serial, in a process pool or with executor) and returns the results
+    in the order of files. load_file has to return (result, None) or (None, exception).
+    """
     result = []
+    if executor is not None:
+        loaded = list(executor.map(load_file, files))
+    elif workers is not None and workers > 1 and len(files) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            loaded = list(pool.map(load_file, files, chunksize=max(1, len(files) // (4 * workers))))
+    else:
+        loaded = map(load_file, files)  # lazy -> stops at first error, if errors is None
+
+    for file, (value, error) in zip(files, loaded):
+        if error is not None:
+            if errors is None:
+                raise error
+            errors.append((file, error))
+        else:
+            result.append(value)
+    return result
+
+
+def load_tdm_files(path: str, sort_key=os.path.getctime, cache_dir=None,
+                   workers: int = None, executor: Executor = None, errors: list = None,
+                   lazy: bool = False, use_store: bool = False) -> list:  # sorted by creation time (using windows)
+    """
+    Loads all *.tdm files in path. The result is sorted by sort_key, no matter if the files are
+    loaded one after another or in parallel.
+    :param cache_dir: optional folder for the TDM metadata cache (see tdm_importer.TDMData)
+    :param workers: int, optional
+        If > 1, the files are parsed in a process pool with this number of processes.
+    :param executor: concurrent.futures.Executor, optional
+        Used instead of a new process pool (e.g. a ThreadPoolExecutor).
+    :param errors: list, optional
+        If given, files that can't be loaded are skipped and (file, exception) is appended to errors.
+        Otherwise the first error is raised.
+    :param lazy: bool (see PI88Measurement). Lazy measurements returned from a process pool are fully read.
+    :param use_store: bool
+        If True and path contains an up to date measurement store (see pi88_store.write_folder_store),
+        the measurements are read from the store instead of the tdm files. Damaged or foreign stores are ignored.
+    :return: list of PI88Measurement
+    """
     files = sorted(Path(path).glob('*.tdm'), key=sort_key)
+    if use_store:
+        from pi88reader.pi88_store import STORE_FILENAME, read_up_to_date_store  # pi88_store imports this module
+        result = read_up_to_date_store(os.path.join(path, STORE_FILENAME), files, lazy)
+        if result is not None:
+            return result
     # files = glob.glob(os.path.join(path, '*.tdm'))
     # files.sort(key=sort_key)
-    for file in files:
-        result.append(PI88Measurement(file))
-    return result
+    load_file = partial(_load_tdm_file, cache_dir=cache_dir, lazy=lazy)
+    return _map_files(load_file, files, workers, executor, errors)
+
+
+class TDMFolderSync:
+    """
+    Keeps the measurements of a folder up to date, while new files are written into it.
+    refresh() only parses new or changed (size or modification time) *.tdm files and drops
+    deleted ones. The measurements stay sorted by sort_key (like load_tdm_files).
+    """
+
+    def __init__(self, path: str, sort_key=os.path.getctime, cache_dir=None, lazy: bool = False,
+                 workers: int = None, executor: Executor = None):
+        """
+        :param path: folder with *.tdm files
+        :param sort_key, cache_dir, lazy, workers, executor: see load_tdm_files
+        """
+        self.path = path
+        self.sort_key = sort_key
+        self.cache_dir = cache_dir
+        self.lazy = lazy
+        self.workers = workers
+        self.executor = executor
+        self.measurements = []
+        self._files = {}  # file -> ((size, mtime), measurement)
+
+    def refresh(self, errors: list = None) -> Tuple[list, list, list]:
+        """
+        Parses new and changed files and drops deleted files.
+        :param errors: list, optional
+            If given, files that can't be loaded (e.g. not completely written yet) are skipped and
+            (file, exception) is appended to errors. They are tried again with the next refresh().
+            Otherwise the first error is raised.
+        :return: list, list, list
+            added, changed and removed files
+        """
+        current = {}
+        for file in Path(self.path).glob('*.tdm'):
+            stat = file.stat()
+            current[file] = (stat.st_size, stat.st_mtime_ns)
+
+        removed = [file for file in self._files if file not in current]
+        added = [file for file in current if file not in self._files]
+        changed = [file for file in current if file in self._files and self._files[file][0] != current[file]]
+
+        for file in removed:
+            del self._files[file]
+
+        files = added + changed
+        failed = []
+        load_file = partial(_load_tdm_file, cache_dir=self.cache_dir, lazy=self.lazy)
+        measurements = _map_files(load_file, files, self.workers, self.executor, failed if errors is not None else None)
+        failed_files = {file for file, _ in failed}
+        for file, measurement in zip([file for file in files if file not in failed_files], measurements):
+            self._files[file] = (current[file], measurement)
+        for file in failed_files:
+            self._files.pop(file, None)  # changed, but not readable -> old data is outdated
+        if errors is not None:
+            errors.extend(failed)
+
+        self.measurements = [self._files[file][1] for file in sorted(self._files, key=self.sort_key)]
+        return ([file for file in added if file not in failed_files],
+                [file for file in changed if file not in failed_files],
+                removed)
+
+
+def scan_tdm_headers(path: str, pattern: str = '**/*.tdm', sort_key=os.path.getctime,
+                     workers: int = None, executor: Executor = None, errors: list = None) -> list:
+    """
+    Reads only the settings (instance attributes) of all *.tdm files in path and its sub folders.
+    No measurement data is read (see PI88Header). The result can be filtered and summarized
+    with the functions in utils_pi88measurements, e.g. to decide which files to load.
+    :param pattern: glob pattern relative to path (default: all *.tdm files in the directory tree)
+    :param workers, executor, errors: see load_tdm_files
+    :return: list of PI88Header
+    """
+    files = sorted(Path(path).glob(pattern), key=sort_key)
+    return _map_files(_load_tdm_header, files, workers, executor, errors)
+
 
 class PI88AreaFunction:
     data_names = [
@@ -80,6 +222,7 @@ class PI88AreaFunction:
         self.c4 = None
         self.c5 = None
         # --------------------------------------------------
+        self._inverse_table = None  # (coefficients, areas, depths) see get_contact_depth
         self.read(settings_dict)
 
     def read(self, settings):
@@ -93,15 +236,70 @@ class PI88AreaFunction:
                 setattr(self, data_name[0], settings[data_name[1]])
             else:
                 setattr(self, data_name[0], None)
+        self._inverse_table = None
+
+    @property
+    def coefficients(self) -> Tuple[float, float, float, float, float, float]:
+        return self.c0, self.c1, self.c2, self.c3, self.c4, self.c5
+
+    @staticmethod
+    def _get_roots(h) -> tuple:
+        """Returns h^(1/2), h^(1/4), h^(1/8), h^(1/16) (chain of square roots)."""
+        root_2 = np.sqrt(h)
+        root_4 = np.sqrt(root_2)
+        root_8 = np.sqrt(root_4)
+        return root_2, root_4, root_8, np.sqrt(root_8)
 
     def get_area(self, h):
-        return (self.c0 * h**2
-                + self.c1 * h
-                + self.c2 * h**(1/2)
-                + self.c3 * h**(1/4)
-                + self.c4 * h**(1/8)
-                + self.c5 * h**(1/16)
-                )
+        """
+        Returns the contact area [nm^2] for contact depth h [nm] (float or array; nan for h < 0).
+        h^(1/4) ... h^(1/16) are calculated as chain of square roots (in place, no temporary arrays per term).
+        """
+        is_scalar = np.ndim(h) == 0
+        h = np.atleast_1d(np.asarray(h, dtype=float))
+        result = self.c0 * h
+        result += self.c1
+        result *= h
+        with np.errstate(invalid='ignore'):
+            root = np.sqrt(h)  # h^(1/2), h^(1/4), h^(1/8), h^(1/16)
+            term = np.empty_like(root)
+            for coefficient in (self.c2, self.c3, self.c4, self.c5):
+                np.multiply(root, coefficient, out=term)
+                result += term
+                np.sqrt(root, out=root)
+        return float(result[0]) if is_scalar else result
+
+    def get_area_derivative(self, h):
+        """Returns d(area)/dh for contact depth h [nm] (float or array)."""
+        h = np.asarray(h, dtype=float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            root_2, root_4, root_8, root_16 = self._get_roots(h)
+            result = (2 * self.c0 * h + self.c1
+                      + (self.c2 / 2 * root_2 + self.c3 / 4 * root_4 + self.c4 / 8 * root_8 + self.c5 / 16 * root_16) / h)
+        return result if result.ndim else float(result)
+
+    def _get_inverse_table(self, max_depth: float = 1e5, n_points: int = 4000) -> Tuple[np.ndarray, np.ndarray]:
+        # coefficients can be set directly (e.g. c0 = ...) -> table is valid only for the same coefficients
+        if self._inverse_table is None or self._inverse_table[0] != self.coefficients:
+            depths = np.concatenate(([0], np.geomspace(1e-4, max_depth, n_points)))
+            areas = np.maximum.accumulate(self.get_area(depths))  # monotone (for not monotone area functions)
+            self._inverse_table = self.coefficients, areas, depths
+        return self._inverse_table[1:]
+
+    def get_contact_depth(self, area, refine: bool = True):
+        """
+        Inverse of get_area: returns contact depth [nm] for area [nm^2] (float or array), using a
+        precomputed interpolation table (0 ... 1e5 nm). nan outside the table.
+        :param refine: one Newton step after interpolation (relative error ~1e-10 instead of ~1e-6)
+        """
+        areas, depths = self._get_inverse_table()
+        area = np.asarray(area, dtype=float)
+        result = np.interp(area, areas, depths, left=np.nan, right=np.nan)
+        if refine:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                step = (self.get_area(result) - area) / self.get_area_derivative(result)
+            result = np.where(np.isfinite(step) & (result > 0), result - step, result)
+        return result if result.ndim else float(result)
 
 
 class SegmentType(Enum):
@@ -187,6 +385,22 @@ class PI88Segments:
 
         return (begin <= array) & (array <= end)
 
+    def get_segment_index(self, time) -> Dict[SegmentType, List[slice]]:
+        """
+        Returns a slice for each segment (in order of occurence) per SegmentType.
+        Uses binary search on the monotonic time array, instead of a full boolean mask.
+        Slicing data with the result gives the same values as get_segment_mask, but as views (no copy).
+        :param time: numpy.ndarray (monotonic)
+        :return: dict
+            {SegmentType: [slice, ...]}
+        """
+        starts = np.searchsorted(time, self.timestamp_begin, side='left')
+        stops = np.searchsorted(time, self.timestamp_end, side='right')
+        result = {segment_type: [] for segment_type in SegmentType}
+        for segment_type, start, stop in zip(self.segment_type, starts, stops):
+            result[segment_type].append(slice(int(start), int(max(start, stop))))
+        return result
+
 
 class PI88Settings:
     # self.settings dictonary names for important settings
@@ -223,7 +437,39 @@ class PI88Settings:
         self.dict = data.get_instance_attributes_dict()
 
 
-class PI88Measurement:
+class PI88File:
+    """Name handling shared by PI88Header and PI88Measurement (needs self.filename and self.name)."""
+
+    @property
+    def _name(self) -> str:
+        """Returns given name (if not None) or base_name."""
+        if self.name is not None:
+            return self.name
+        return self.base_name
+
+    @property
+    def base_name(self) -> str:
+        return Path(self.filename).stem  # filename can be str or Path
+        # return self.filename[:-4].split("/")[-1].split("\\")[-1]
+
+
+class PI88Header(PI88File):
+    """
+    Settings (and area function) of a *.tdm file without any measurement data.
+    Only the instance attributes are stream-parsed; the tdx-file is never touched.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.name = None  # is used as base_name if set
+        self.settings = PI88Settings(self)
+        self.area_function = PI88AreaFunction(self.settings.dict)
+
+    def get_instance_attributes_dict(self) -> dict:
+        """Used by PI88Settings (same interface as tdm_importer.TDMData)."""
+        return tdm.read_instance_attributes(self.filename)
+
+
+class PI88Measurement(PI88File):
     # (attribute_name, TDM-channelname)
     static_name_tuples = [
         ("time", "Test Time"),
@@ -263,9 +509,41 @@ class PI88Measurement:
         ("average_dynamic_contact_area", "Contact Area"),
         ("average_dynamic_contact_depth", "Contact Depth")
     ]
+    # channel groupname -> dynamic_name_tuples belonging to this group
+    dynamic_groups = {
+        "Indentation Averaged Values": dynamic_name_tuples[0:7],
+        "Basic Dynamic Averaged Values 1": dynamic_name_tuples[7:14],
+        "Visco-Elastic: Indentation Averaged Values 1": dynamic_name_tuples[14:]
+    }
 
-    def __init__(self, filename):
+    def __init__(self, filename, cache_dir=None, lazy=False, data=None):
+        """
+        :param filename: *.tdm file
+        :param cache_dir: optional folder for the TDM metadata cache (see tdm_importer.TDMData)
+        :param lazy: If True, only settings and area function are read on construction. Segments,
+            quasi static data and each group of average dynamic data are read (and cleaned from nans)
+            on first access of one of their attributes. The tdx-file stays mapped until all data
+            is read or close() is called.
+        :param data: optional data source used instead of reading filename (same interface as
+            tdm_importer.TDMData, e.g. pi88_store.PI88StoreData)
+        """
         self.filename = filename
+        self.name = None  # is used as base_name if set
+        self._segment_index = None  # see get_segment_slice
+        self._data = None  # open TDMData (lazy mode only)
+        self._lazy_attributes = {}  # attribute name -> channel group name, for groups not read yet (lazy mode only)
+        self._average_dynamic_raw = {}  # attribute name -> average dynamic channel before remove_nans
+
+        if data is None:
+            data = tdm.TDMData(filename, lazy=True, cache_dir=cache_dir)
+
+        if lazy:
+            self._data = data
+            self.settings = PI88Settings(self._data)
+            self.area_function = PI88AreaFunction(self.settings.dict)
+            self._init_lazy_attributes()
+            return
+
         # only to make code completition in pycharm work:
         self.time = None
         self.depth = None
@@ -275,19 +553,64 @@ class PI88Measurement:
         self.load_unit = None
         # -------------------------------------------------
 
-        # todo: how to make it work with 'with' statement
-        data = tdm.TDMData(filename)
-
-        self.segments = PI88Segments(data)
-        self.settings = PI88Settings(data)
-        self.area_function = PI88AreaFunction(self.settings.dict)
-        self._read_quasi_static(data)
-        self._read_average_dynamic(data)
-
-        for name_tuple in PI88Measurement.dynamic_name_tuples:
-            self.remove_nans(name_tuple[0])
-
-        self.name = None  # is used as base_name if set
+        with data:
+            self.segments = PI88Segments(data)
+            self.settings = PI88Settings(data)
+            self.area_function = PI88AreaFunction(self.settings.dict)
+            self._read_quasi_static(data)
+            self._read_average_dynamic(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __getattr__(self, name):
+        # only called, if name isn't found the normal way -> read channel group on first access (lazy mode)
+        lazy_attributes = self.__dict__.get("_lazy_attributes")
+        if lazy_attributes and name in lazy_attributes:
+            self._read_lazy_group(lazy_attributes[name])
+            return getattr(self, name)
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+    def __getstate__(self):
+        self.read_all()  # an open TDMData can't be pickled (e.g. for a process pool)
+        return self.__dict__.copy()
+
+    def close(self) -> None:
+        """Closes the tdm data of a lazy measurement. Not yet read data can't be accessed afterwards."""
+        if self._data is not None:
+            self._data.close()
+            self._data = None
+        self._lazy_attributes = {}
+
+    def read_all(self) -> None:
+        """Reads all channel groups, that are not read yet (lazy mode)."""
+        for group_name in set(self._lazy_attributes.values()):
+            self._read_lazy_group(group_name)
+
+    def _init_lazy_attributes(self):
+        self._lazy_attributes["segments"] = "Segments"
+        group_name_tuples = {"Indentation All Data Points": PI88Measurement.static_name_tuples}
+        group_name_tuples.update(PI88Measurement.dynamic_groups)
+        for group_name, name_tuples in group_name_tuples.items():
+            for name_tuple in name_tuples:
+                self._lazy_attributes[name_tuple[0]] = group_name
+                self._lazy_attributes[name_tuple[0] + "_unit"] = group_name
+
+    def _read_lazy_group(self, group_name):
+        if group_name == "Segments":
+            self.segments = PI88Segments(self._data)
+        elif group_name == "Indentation All Data Points":
+            self._read_quasi_static(self._data)
+        else:
+            self._read_average_dynamic_group(self._data, group_name)
+
+        self._lazy_attributes = {key: value for key, value in self._lazy_attributes.items()
+                                 if value != group_name}
+        if not self._lazy_attributes:
+            self.close()
 
     def _read_quasi_static(self, data):
         group_name = "Indentation All Data Points"
@@ -295,15 +618,23 @@ class PI88Measurement:
         # print(data.channel_dict(group_name))
 
     def _read_average_dynamic(self, data):
-        group_name = "Indentation Averaged Values"
-        data.read_from_channel_group(group_name, PI88Measurement.dynamic_name_tuples[0:7], self)
-        # print(data.channel_dict(group_name))
-
-        group_name = "Basic Dynamic Averaged Values 1"
-        data.read_from_channel_group(group_name, PI88Measurement.dynamic_name_tuples[7:14], self)
+        for group_name in PI88Measurement.dynamic_groups:
+            self._read_average_dynamic_group(data, group_name)
+
+    def _read_average_dynamic_group(self, data, group_name):
+        name_tuples = PI88Measurement.dynamic_groups[group_name]
+        data.read_from_channel_group(group_name, name_tuples, self)
+        for name_tuple in name_tuples:
+            self._average_dynamic_raw[name_tuple[0]] = getattr(self, name_tuple[0])
+            self.remove_nans(name_tuple[0])
 
-        group_name = "Visco-Elastic: Indentation Averaged Values 1"
-        data.read_from_channel_group(group_name, PI88Measurement.dynamic_name_tuples[14:], self)
+    def get_average_dynamic_raw(self, attribute_name):
+        """
+        Returns the average dynamic channel attribute_name including invalid values (nan). Other than
+        the cleaned attributes (see remove_nans), all raw channels are aligned (see ni_dynamic).
+        """
+        value = getattr(self, attribute_name)  # reads the channel group (lazy mode)
+        return self.__dict__.get("_average_dynamic_raw", {}).get(attribute_name, value)
 
     def remove_nans(self, attribute_name):
         """
@@ -338,23 +669,29 @@ class PI88Measurement:
             header, time_data, depth_data, load_data
         """
         # todo: check, if it is right measurement type (e.g. quasi static, not aborted ...)
-        mask = self.segments.get_segment_mask(self.time, segment_type, occurence=occurence)
+        segment_slice = self.get_segment_slice(segment_type, occurence=occurence)
         header = [f"time [{self.time_unit}]",
                   f"depth[{self.depth_unit}]",
                   f"load[{self.load_unit}]"]
-        return header, self.time[mask], self.depth[mask], self.load[mask]
-
-    @property
-    def _name(self) -> str:
-        """Returns given name (if not None) or base_name."""
-        if self.name is not None:
-            return self.name
-        return self.base_name
+        return header, self.time[segment_slice], self.depth[segment_slice], self.load[segment_slice]
 
-    @property
-    def base_name(self) -> str:
-        return self.filename.stem
-        # return self.filename[:-4].split("/")[-1].split("\\")[-1]
+    def get_segment_slice(self, segment_type, occurence=1) -> slice:
+        """
+        Returns a slice selecting segment_type from quasi static data (time, depth, load ...).
+        The segment index is calculated once (binary search on self.time) and reused afterwards.
+        :param segment_type: SegmentType
+        :param occurence: int, optional (-1 find last; 0 selects nothing - get_segment_mask selects nothing, too,
+            unless the first segment is of segment_type)
+        :return: slice
+        """
+        if self._segment_index is None:
+            self._segment_index = self.segments.get_segment_index(self.time)
+        slices = self._segment_index[segment_type]
+        if len(slices) == 0 or occurence == 0:
+            return slice(0, 0)
+        if 1 <= occurence <= len(slices):
+            return slices[occurence - 1]
+        return slices[-1]  # same as get_segment_mask: -1 (or < -1) or occurence not found -> last one
 
 if __name__ == "__main__":
     main()
@@ -1,16 +1,25 @@
 """
 @author: Nathanael Jöhrmann
 """
+import copy
+import hashlib
+import io
 import os
+from concurrent.futures import Executor
 from typing import Union, List, Tuple, Iterable, Optional, ValuesView
 
+import matplotlib
 import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from matplotlib.figure import Figure
 from matplotlib.pyplot import Axes
 
 import pi88reader.pi88_importer as pi88_importer
-from pi88reader.ni_analyser import calc_unloading_data
-from pi88reader.pi88_importer import PI88Measurement, load_tdm_files
+from pi88reader.ni_batch import calc_unloading_data_batch, get_rows_from_table, calc_fit_window_sweep_batch, map_jobs
+from pi88reader.ni_cache import unloading_data_cache, AREA_FUNCTION_COEFFICIENTS, LRUFileCache
+from pi88reader.ni_creep import calc_creep_windows_batch, fit_creep_exponents
+from pi88reader.pi88_importer import PI88Measurement, PI88Segments, load_tdm_files, TDMFolderSync
 from pi88reader.plotter_styles import PlotterStyle, GraphStyler
 
 
@@ -21,12 +30,31 @@ class PI88Plotter:
 
     def __init__(self, pi88_measurements: Union[PI88Measurement, List[PI88Measurement]]):
         self.measurements = []
+        self.folder_sync = None  # see sync_tdm_folder
         self.add_measurements(pi88_measurements)
         self.figure_size = (5.6, 5.0)
         self.dpi = 150
+        self.use_pyplot = True  # False: figures are not managed by pyplot (Agg canvas; thread-safe, see render_plot_job)
+        self.workers = None  # number of processes used for the unloading analysis (see ni_batch)
+        self.unloading_data_cache = unloading_data_cache  # shared with PI88ToPPTX and PI88ToExcel (see ni_cache)
 
         self.graph_styler = GraphStyler(len(self.measurements))
 
+    def sync_tdm_folder(self, path: str = None, sort_key=os.path.getctime, errors: list = None, **kwargs) -> None:
+        """
+        Replaces the measurements with those of the folder path. Only new or changed *.tdm files
+        are parsed, when called again (see pi88_importer.TDMFolderSync).
+        :param path: folder (default: folder of the last call)
+        :param errors: see TDMFolderSync.refresh
+        :param kwargs: passed to TDMFolderSync (e.g. cache_dir, lazy, workers, executor)
+        """
+        if path is None and self.folder_sync is None:
+            raise ValueError("sync_tdm_folder needs a path (no folder synced yet)")
+        if self.folder_sync is None or (path is not None and path != self.folder_sync.path):
+            self.folder_sync = TDMFolderSync(path, sort_key, **kwargs)
+        self.folder_sync.refresh(errors)
+        self.measurements = list(self.folder_sync.measurements)
+
     def add_measurements(self, measurements: Union[PI88Measurement, Iterable[PI88Measurement]]) -> None:
         """
         Adds a single PI88Measurement or a list o PI88Measurement's to the plotter.
@@ -37,11 +65,16 @@ class PI88Plotter:
             except TypeError:
                 self.measurements.append(measurements)
 
-    def load_tdm_files(self, path: str, sort_key=os.path.getctime):  # sorted by creation time (using windows)
-        self.measurements.extend(load_tdm_files(path, sort_key))
+    def load_tdm_files(self, path: str, sort_key=os.path.getctime, **kwargs):  # sorted by creation time (using windows)
+        """kwargs are passed to pi88_importer.load_tdm_files() (e.g. workers, executor, errors, cache_dir)."""
+        self.measurements.extend(load_tdm_files(path, sort_key, **kwargs))
 
     def create_figure_with_axes(self, x_label: str = "", y_label: str = "") -> Tuple[Figure, Axes]:
-        figure = plt.figure(figsize=self.figure_size, dpi=self.dpi, facecolor='w', edgecolor='w', frameon=True)
+        if self.use_pyplot:
+            figure = plt.figure(figsize=self.figure_size, dpi=self.dpi, facecolor='w', edgecolor='w', frameon=True)
+        else:
+            figure = Figure(figsize=self.figure_size, dpi=self.dpi, facecolor='w', edgecolor='w', frameon=True)
+            FigureCanvasAgg(figure)
         axes = figure.add_subplot()
         axes.set_xlabel(x_label)
         axes.set_ylabel(y_label)
@@ -90,8 +123,9 @@ class PI88Plotter:
                                  upper: float = 0.95, lower: float = 0.2, beta: float = 1.0):
         if data_list is None:
             data_list = []
-        for measurement in self.measurements:
-            data_list.append(calc_unloading_data(measurement, upper, lower, beta))
+        table = calc_unloading_data_batch(self.measurements, upper, lower, beta, workers=self.workers,
+                                          cache=self.unloading_data_cache)
+        data_list.extend(get_rows_from_table(table))
 
         x = []
         y = []
@@ -110,8 +144,9 @@ class PI88Plotter:
                           upper: float = 0.95, lower: float = 0.2, beta: float = 1.0):
         if data_list is None:
             data_list = []
-        for measurement in self.measurements:
-            data_list.append(calc_unloading_data(measurement, upper, lower, beta))
+        table = calc_unloading_data_batch(self.measurements, upper, lower, beta, workers=self.workers,
+                                          cache=self.unloading_data_cache)
+        data_list.extend(get_rows_from_table(table))
 
         x = []
         y = []
@@ -126,6 +161,47 @@ class PI88Plotter:
         figure.tight_layout()
         return figure
 
+    def get_fit_window_sweep_plot(self, sweep: dict = None, value_name: str = "Er", index: int = None) -> Figure:
+        """
+        Heatmap of value_name over the fit windows (upper, lower) of a sweep (see ni_batch.calc_fit_window_sweep_batch).
+        :param sweep: result cube (calculated for self.measurements, if None)
+        :param index: measurement index in sweep (mean of all measurements, if None)
+        """
+        if sweep is None:
+            sweep = calc_fit_window_sweep_batch(self.measurements, workers=self.workers)
+        if index is None:
+            values = np.nanmean(sweep[value_name], axis=0)
+        else:
+            values = sweep[value_name][index]
+
+        figure, axes = self.create_figure_with_axes(x_label="lower [P/P_max]", y_label="upper [P/P_max]")
+        mesh = axes.pcolormesh(sweep["lower"], sweep["upper"], values, shading="nearest")
+        figure.colorbar(mesh, ax=axes, label=value_name)
+        figure.tight_layout()
+        return figure
+
+    def get_creep_dlog_plot(self, n_windows: int = 10, window_time: Optional[float] = None, t_min: float = 50,
+                            occurence: int = 1, fit: bool = True) -> Figure:
+        """
+        Double logarithmic plot of strain rate over stress of the hold segments (see ni_creep.calc_creep_windows_batch).
+        :param fit: add the power law fits (creep exponent n) of each measurement
+        """
+        windows = calc_creep_windows_batch(self.measurements, n_windows, window_time, t_min, occurence)
+        fits = fit_creep_exponents(windows["stress"], windows["strain_rate"])
+
+        figure, axes = self.create_figure_with_axes(x_label=r"F/A [$\mathrm{N/m^2}$]", y_label="creep rate [1/s]")
+        for i, name in enumerate(windows["name"]):
+            stress = windows["stress"][i]
+            color = self.graph_styler.color
+            axes.loglog(stress, windows["strain_rate"][i], **self.graph_styler.dict, label=name, fillstyle="none")
+            if fit and np.isfinite(fits["n"][i]):
+                axes.plot(stress, np.exp(fits["log_B"][i]) * stress ** fits["n"][i], **color, marker="",
+                          label=rf"$n = {fits['n'][i]:.2f}$")
+            self.graph_styler.next_style()
+        axes.legend(loc="best")
+        figure.tight_layout()
+        return figure
+
     def get_plot(self, data_x: pi88_importer.Data, data_y: pi88_importer.Data, label_suffix=None) -> Figure:
         data_type = pi88_importer.DATA_TYPE_DICT
         x_name, x_unit, x_attr_name = data_type[data_x]
@@ -166,3 +242,182 @@ class PI88Plotter:
         if style.graph_styler:
             self.graph_styler = style.graph_styler
         # ...
+
+
+def get_plot_data(measurement: PI88Measurement) -> PI88Measurement:
+    """
+    Returns a copy of measurement with the data plotted by PI88Plotter only: quasi static channels, segments,
+    settings, area function and name (no average dynamic data). Of a lazy measurement only the quasi static
+    channels and segments are read.
+    """
+    result = PI88Measurement.__new__(PI88Measurement)  # without reading filename
+    result.filename = measurement.filename
+    result.name = measurement.name
+    result._segment_index = None
+    result._data = None
+    result._lazy_attributes = {}
+    result._average_dynamic_raw = {}
+    for attribute_name, _ in PI88Measurement.static_name_tuples:
+        setattr(result, attribute_name, copy.deepcopy(getattr(measurement, attribute_name, None)))
+        setattr(result, attribute_name + "_unit", getattr(measurement, attribute_name + "_unit", None))
+    result.segments = copy.deepcopy(measurement.segments)
+    result.settings = copy.deepcopy(measurement.settings)
+    result.area_function = copy.deepcopy(measurement.area_function)
+    return result
+
+
+class PlotJob:
+    """
+    A PI88Plotter figure, that can be rendered in another process (see render_plot_jobs).
+    """
+
+    def __init__(self, plot_name: str, measurements: Union[PI88Measurement, List[PI88Measurement]],
+                 plotter_style: Optional[PlotterStyle] = None, curves: Optional[list] = None,
+                 legend: bool = False, **kwargs):
+        """
+        :param plot_name: name of a PI88Plotter method returning a Figure (e.g. "get_load_displacement_plot")
+        :param measurements: PI88Measurement or list of PI88Measurement (only the plotted data is copied, see
+            get_plot_data -> small jobs for worker processes; later changes of the measurements don't affect the job)
+        :param plotter_style: Optional PlotterStyle (copied -> later changes of the style don't affect the job)
+        :param curves: additional curves [(x, y, style dict, label), ...] (e.g. a power law fit)
+        :param legend: add a legend (loc="best")
+        :param kwargs: passed to the plot method
+        """
+        self.plot_name = plot_name
+        if isinstance(measurements, PI88Measurement):
+            self.measurements = get_plot_data(measurements)
+        else:
+            self.measurements = [get_plot_data(measurement) for measurement in measurements]
+        self.plotter_style = copy.deepcopy(plotter_style)
+        self.curves = [] if curves is None else list(curves)
+        self.legend = legend
+        self.kwargs = kwargs
+
+
+def render_plot_job(job: PlotJob, cache: "FigureCache" = None) -> bytes:
+    """
+    Renders job and returns the figure as PNG (bytes). The figure is drawn on its own Agg canvas without
+    pyplot, so rendering works in worker processes and threads and doesn't change the pyplot state.
+    :param cache: Optional FigureCache (e.g. figure_cache); the figure is only rendered, if not cached yet
+    """
+    if cache is not None:
+        key = get_plot_job_key(job)
+        image = cache.get(key)
+        if image is None:
+            image = render_plot_job(job)
+            cache.put(key, image)
+        return image
+
+    plotter = PI88Plotter(job.measurements)
+    plotter.use_pyplot = False
+    if job.plotter_style is not None:
+        plotter.set(copy.deepcopy(job.plotter_style))  # the graph styler is changed while plotting
+    figure = getattr(plotter, job.plot_name)(**job.kwargs)
+    axes = figure.axes[0]
+    for x, y, style, label in job.curves:
+        axes.plot(x, y, **style, label=label)
+    if job.legend:
+        axes.legend(loc="best")
+    with io.BytesIO() as output:
+        figure.savefig(output, format="png")
+        return output.getvalue()
+
+
+def render_plot_jobs(jobs: Iterable[PlotJob], workers: int = None, executor: Executor = None,
+                     cache: "FigureCache" = None) -> List[bytes]:
+    """
+    Renders many figures (PNG bytes, same order as jobs). Rendering runs in a process pool with workers
+    processes, or with executor (see ni_batch.map_jobs; e.g. a ThreadPoolExecutor); serial, if workers is None.
+    :param cache: Optional FigureCache. Only figures, that are not cached, are rendered (identical jobs once).
+    """
+    jobs = list(jobs)
+    if cache is None:
+        return map_jobs(render_plot_job, jobs, workers, executor)
+
+    keys = [get_plot_job_key(job) for job in jobs]
+    images = [cache.get(key) for key in keys]
+    missing = {}  # {key: index of first job}
+    for i, (key, image) in enumerate(zip(keys, images)):
+        if image is None:
+            missing.setdefault(key, i)
+    rendered = dict(zip(missing, map_jobs(render_plot_job, [jobs[i] for i in missing.values()], workers, executor)))
+    for key, image in rendered.items():
+        cache.put(key, image)
+    return [rendered[key] if image is None else image for key, image in zip(keys, images)]
+
+
+# increase, whenever the plots (and thereby the cached figures) change
+FIGURE_CACHE_VERSION = 1
+
+
+def _update_key(key, value) -> None:
+    """Adds value (arrays, containers, styles, measurements ...) to the hash key."""
+    if isinstance(value, PI88Measurement):
+        key.update(b"PI88Measurement")
+        for attribute_name, _ in PI88Measurement.static_name_tuples:  # all data plotted by PI88Plotter
+            _update_key(key, getattr(value, attribute_name, None))
+        for attribute_name, _ in PI88Segments.name_tuples:
+            _update_key(key, getattr(value.segments, attribute_name, None))
+        _update_key(key, [getattr(value.area_function, name, None) for name in AREA_FUNCTION_COEFFICIENTS])
+        _update_key(key, (value.name, value.base_name))
+    elif isinstance(value, np.ndarray) or (isinstance(value, (list, tuple))
+                                           and value and all(isinstance(x, (int, float)) for x in value)):
+        array = np.ascontiguousarray(value)
+        key.update(repr((array.dtype.str, array.shape)).encode())
+        key.update(array.tobytes())
+    elif isinstance(value, dict):
+        key.update(b"dict")
+        for name in sorted(value, key=repr):
+            _update_key(key, name)
+            _update_key(key, value[name])
+    elif isinstance(value, (list, tuple)):
+        key.update(f"{type(value).__name__}{len(value)}".encode())
+        for item in value:
+            _update_key(key, item)
+    elif hasattr(value, "__dict__"):  # e.g. PlotterStyle, GraphStyler
+        key.update(type(value).__name__.encode())
+        _update_key(key, vars(value))
+    else:
+        key.update(repr(value).encode())
+
+
+def get_plot_job_key(job: PlotJob) -> str:
+    """
+    Returns a hash (hex string) of everything, that changes the rendered figure of job: plotted data,
+    PlotterStyle (incl. GraphStyler, dpi, figure size), extra curves and plot parameters.
+    """
+    key = hashlib.sha1()
+    measurements = job.measurements if isinstance(job.measurements, (list, tuple)) else [job.measurements]
+    _update_key(key, (FIGURE_CACHE_VERSION, matplotlib.__version__, job.plot_name, job.legend, job.kwargs))
+    _update_key(key, list(measurements))
+    _update_key(key, job.plotter_style)
+    _update_key(key, job.curves)
+    return key.hexdigest()
+
+
+class FigureCache(LRUFileCache):
+    """
+    LRU cache {key: rendered figure (PNG bytes)} (see get_plot_job_key), limited by the total size of the
+    images (self.size [bytes]). Files in cache_dir: <key>.png
+    """
+    file_extension = ".png"
+
+    def __init__(self, max_bytes: int = 256 * 1024 ** 2, cache_dir: Optional[str] = None):
+        """
+        :param max_bytes: maximal total size of the images kept in memory (least recently used are removed first)
+        :param cache_dir: Optional folder. If given, images are also written to (and read from) this folder.
+        """
+        super().__init__(max_bytes, cache_dir)
+
+    def _get_size(self, value: bytes) -> int:
+        return len(value)
+
+    def _dumps(self, value: bytes) -> bytes:
+        return value
+
+    def _loads(self, data: bytes) -> bytes:
+        return data
+
+
+# cache used by PI88ToPPTX (use figure_cache.cache_dir for persistence)
+figure_cache = FigureCache()
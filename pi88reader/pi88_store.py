@@ -0,0 +1,254 @@
+"""
+Consolidated binary store for PI88Measurement objects. All channel arrays of a set of measurements
+are written back-to-back into one file, together with segments, settings (incl. area function)
+and an offset table. Reading a store maps the file once and hands out zero-copy numpy views,
+instead of parsing one TDM/TDX pair per measurement.
+The header (settings, offset table) is JSON, so reading a foreign store can't execute code. A store
+is only used by pi88_importer.load_tdm_files, if asked for (use_store=True).
+@author: Nathanael Jöhrmann
+"""
+import json
+import mmap
+import os
+import struct
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+import numpy as np
+
+from pi88reader.pi88_importer import PI88Measurement, PI88Segments, load_tdm_files
+
+# default store filename used by pi88_importer.load_tdm_files (inside the measurement folder)
+STORE_FILENAME = "pi88_measurements.pi88store"
+# increase, whenever the file format changes
+STORE_VERSION = 3
+
+_MAGIC = b"PI88STOR"
+_HEADER_FORMAT = "<8sQ"  # magic, length of JSON header (utf-8)
+_DATA_ALIGNMENT = 64
+
+
+def _encode_json(value):
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    raise TypeError(f"Can't write {type(value).__name__} into a PI88 measurement store header")
+
+
+def _decode_json(value: dict):
+    if len(value) == 1 and "__datetime__" in value:
+        return datetime.fromisoformat(value["__datetime__"])
+    return value
+
+
+def _get_group_name_tuples(measurement: PI88Measurement) -> list:
+    """Returns [(object holding the attributes, channel group name, name_tuples), ...]"""
+    result = [(measurement.segments, "Segments", PI88Segments.name_tuples),
+              (measurement, "Indentation All Data Points", PI88Measurement.static_name_tuples)]
+    for group_name, name_tuples in PI88Measurement.dynamic_groups.items():
+        result.append((measurement, group_name, name_tuples))
+    return result
+
+
+def _get_source_info(filename, store_folder: str) -> tuple:
+    """Returns (filename relative to store_folder (if possible), size, mtime) of a tdm file."""
+    stat = os.stat(filename)
+    path = os.path.abspath(filename)
+    if os.path.dirname(path) == os.path.abspath(store_folder):
+        path = os.path.basename(path)
+    return path, stat.st_size, stat.st_mtime_ns
+
+
+def write_measurement_store(measurements: Iterable[PI88Measurement], store_filename: str) -> None:
+    """
+    Writes measurements into one store file (see module doc string).
+    :param measurements: Iterable of PI88Measurement
+    :param store_filename: str
+    :return: None
+    """
+    store_folder = os.path.dirname(os.path.abspath(store_filename))
+    entries = []
+    arrays = []
+    data_size = 0
+    for measurement in measurements:
+        channels = {}
+        for obj, group_name, name_tuples in _get_group_name_tuples(measurement):
+            group = channels.setdefault(group_name, {})
+            for attribute_name, channel_name in name_tuples:
+                if group_name in PI88Measurement.dynamic_groups:  # incl. nans -> channels stay aligned
+                    value = measurement.get_average_dynamic_raw(attribute_name)
+                else:
+                    value = getattr(obj, attribute_name, None)
+                if value is None:
+                    continue
+                array = np.ascontiguousarray(np.asarray(value))
+                data_size += -data_size % array.dtype.itemsize  # align each array to its item size
+                group[channel_name] = (array.dtype.str, data_size, len(array),
+                                       getattr(obj, attribute_name + "_unit", None))
+                arrays.append((data_size, array))
+                data_size += array.nbytes
+        entries.append({
+            "filename": str(measurement.filename),
+            "name": measurement.name,
+            "source": _get_source_info(measurement.filename, store_folder),
+            "settings": measurement.settings.dict,
+            "channels": channels
+        })
+
+    header = json.dumps({"version": STORE_VERSION, "entries": entries}, default=_encode_json).encode("utf-8")
+    header_size = struct.calcsize(_HEADER_FORMAT) + len(header)
+    data_start = header_size + (-header_size % _DATA_ALIGNMENT)
+
+    temp_filename = f"{store_filename}.{os.getpid()}.tmp"
+    with open(temp_filename, "wb") as file:
+        file.write(struct.pack(_HEADER_FORMAT, _MAGIC, len(header)))
+        file.write(header)
+        file.write(bytes(data_start - header_size))
+        for offset, array in arrays:
+            file.write(bytes(data_start + offset - file.tell()))
+            file.write(array.tobytes())
+    os.replace(temp_filename, store_filename)  # never leave a half written store
+
+
+class PI88MeasurementStore:
+    """
+    Read access to a store file written by write_measurement_store.
+    The store file is mapped once; all channel arrays are read-only views into this mapping.
+    """
+
+    def __init__(self, store_filename: str):
+        self.store_filename = store_filename
+        self.store_folder = os.path.dirname(os.path.abspath(store_filename))
+        with open(store_filename, "rb") as file:
+            magic, header_length = struct.unpack(_HEADER_FORMAT, file.read(struct.calcsize(_HEADER_FORMAT)))
+            if magic != _MAGIC:
+                raise ValueError(f"Not a PI88 measurement store: {store_filename}")
+            header = json.loads(file.read(header_length).decode("utf-8"), object_hook=_decode_json)
+            if not isinstance(header, dict) or header.get("version") != STORE_VERSION:
+                raise ValueError(f"Unsupported PI88 measurement store: {store_filename}")
+            header_size = struct.calcsize(_HEADER_FORMAT) + header_length
+            self._data_start = header_size + (-header_size % _DATA_ALIGNMENT)
+            self._mmap = None
+            if os.fstat(file.fileno()).st_size > self._data_start:
+                self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.entries = header["entries"]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def close(self) -> None:
+        """Releases the memory map (as soon as no array view is in use anymore)."""
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:  # numpy views into the mapping still exist
+                pass
+            self._mmap = None
+
+    def get_array(self, dtype: str, offset: int, length: int) -> np.ndarray:
+        if length == 0:
+            return np.empty(0, dtype=dtype)
+        return np.frombuffer(self._mmap, dtype=np.dtype(dtype), count=length, offset=self._data_start + offset)
+
+    def get_source_files(self) -> List[tuple]:
+        """Returns [(tdm filename, size, mtime), ...] of all measurements at the time the store was written."""
+        return [tuple(entry["source"]) for entry in self.entries]
+
+    def is_up_to_date(self, tdm_files: Iterable) -> bool:
+        """True, if the store contains exactly tdm_files and none of them changed since writing the store."""
+        try:
+            current = {_get_source_info(file, self.store_folder) for file in tdm_files}
+        except OSError:
+            return False
+        return current == set(self.get_source_files())
+
+    def get_measurement(self, index: int, lazy: bool = False) -> PI88Measurement:
+        entry = self.entries[index]
+        filename = Path(entry["filename"])
+        source_filename = entry["source"][0]
+        if not os.path.isabs(source_filename):  # relative to store -> keep valid, if the folder is moved
+            filename = Path(self.store_folder) / source_filename
+        result = PI88Measurement(filename, lazy=lazy, data=PI88StoreData(self, entry))
+        result.name = entry["name"]
+        return result
+
+    def get_measurements(self, lazy: bool = False) -> List[PI88Measurement]:
+        return [self.get_measurement(i, lazy) for i in range(len(self))]
+
+
+class PI88StoreData:
+    """
+    Data of one measurement in a PI88MeasurementStore. Provides the reading interface of
+    tdm_importer.TDMData, that is used by PI88Measurement, PI88Segments and PI88Settings.
+    """
+
+    def __init__(self, store: PI88MeasurementStore, entry: dict):
+        self._store = store
+        self._entry = entry
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        pass  # the memory map belongs to the store
+
+    def get_instance_attributes_dict(self) -> dict:
+        return dict(self._entry["settings"])
+
+    def read_from_channel_group(self, group_name, name_tuples, to_object):
+        """Same as tdm_importer.TDMData.read_from_channel_group."""
+        channels = self._entry["channels"].get(group_name, {})
+        for attribute_name, channel_name in name_tuples:
+            if channel_name in channels:
+                dtype, offset, length, unit = channels[channel_name]
+                setattr(to_object, attribute_name, self._store.get_array(dtype, offset, length))
+                setattr(to_object, attribute_name + "_unit", unit)
+            else:
+                setattr(to_object, attribute_name, None)
+
+
+def read_measurement_store(store_filename: str, lazy: bool = False) -> List[PI88Measurement]:
+    """Returns all measurements of a store file (see write_measurement_store)."""
+    return PI88MeasurementStore(store_filename).get_measurements(lazy)
+
+
+def read_up_to_date_store(store_filename: str, tdm_files: list, lazy: bool = False) -> Optional[List[PI88Measurement]]:
+    """
+    Returns the measurements of store_filename in the order of tdm_files, if the store exists
+    and is up to date (see PI88MeasurementStore.is_up_to_date). Otherwise returns None.
+    """
+    if not os.path.isfile(store_filename):
+        return None
+    try:
+        store = PI88MeasurementStore(store_filename)
+    except (ValueError, OSError, KeyError, TypeError, struct.error):  # e.g. damaged or foreign file
+        return None
+    if not store.is_up_to_date(tdm_files):
+        store.close()
+        return None
+    order = {os.path.abspath(os.path.join(store.store_folder, source[0])): i
+             for i, source in enumerate(store.get_source_files())}
+    return [store.get_measurement(order[os.path.abspath(file)], lazy) for file in tdm_files]
+
+
+def write_folder_store(path: str, sort_key=os.path.getctime, **kwargs) -> List[PI88Measurement]:
+    """
+    Loads all *.tdm files in path (without using an existing store) and writes them into
+    path/STORE_FILENAME, which is used by pi88_importer.load_tdm_files(use_store=True) afterwards,
+    as long as it is up to date.
+    :param kwargs: passed to pi88_importer.load_tdm_files (e.g. workers, cache_dir)
+    :return: list of PI88Measurement
+    """
+    kwargs["use_store"] = False
+    result = load_tdm_files(path, sort_key, **kwargs)
+    write_measurement_store(result, os.path.join(path, STORE_FILENAME))
+    return result
@@ -4,6 +4,8 @@ todo: check pandas
 from openpyxl import Workbook
 from openpyxl.styles import Font
 
+from pi88reader.ni_batch import calc_unloading_data_batch, get_rows_from_table
+from pi88reader.ni_cache import unloading_data_cache
 from pi88reader.pi88_importer import PI88Measurement, SegmentType
 
 
@@ -22,9 +24,14 @@ class PI88ToExcel:
         self.workbook = Workbook()
         self.workbook.remove(self.workbook.active)
 
+        self.poisson_ratio = 0.3
+        self.beta = 1.0
+        self.unloading_data_cache = unloading_data_cache  # shared with PI88Plotter and PI88ToPPTX (see ni_cache)
+
     def write(self, filename):
         self.add_sheet_quasi_static_data()  # self.workbook.active)
         self.add_sheet_segment_data()
+        self.add_sheet_unloading_data()
         self.workbook.save(filename=filename)
 
     def add_sheet_quasi_static_data(self):
@@ -51,6 +58,18 @@ class PI88ToExcel:
         data = self.measurement.get_segment_curve(SegmentType.UNLOAD)
         self.write_data(ws, data, row=1, col=10)
 
+    def add_sheet_unloading_data(self):
+        wb = self.workbook
+        ws_title = "unloading"
+        ws = wb.create_sheet(title=ws_title)
+
+        table = calc_unloading_data_batch([self.measurement], beta=self.beta, poisson_ratio=self.poisson_ratio,
+                                          cache=self.unloading_data_cache)
+        data = get_rows_from_table(table)[0]
+        self.write_row(ws, data.keys(), row=1, col=1)
+        for i, value in enumerate(data.values()):
+            ws.cell(row=2, column=1+i).value = value
+
     @staticmethod
     def write_row(ws, data, row, col):
         font = Font(bold=True)
@@ -1,6 +1,7 @@
 """
 @author: Nathanael Jöhrmann
 """
+import io
 import os
 import statistics
 from typing import Union, Iterable, Optional, List
@@ -14,10 +15,12 @@ from pptx_tools.creator import PPTXCreator, PPTXPosition
 from pptx_tools.table_style import PPTXTableStyle
 from pptx_tools.templates import analyze_pptx
 
-from pi88reader.ni_analyser import calc_unloading_data, get_power_law_fit_curve
-from pi88reader.pi88_importer import PI88Measurement, load_tdm_files
-from pi88reader.pi88_plotter import PI88Plotter
-from pi88reader.plotter_styles import GraphStyler, get_power_law_fit_curve_style
+from pi88reader.ni_analyser import get_power_law_fit_curve
+from pi88reader.ni_batch import calc_unloading_data_batch, get_rows_from_table
+from pi88reader.ni_cache import unloading_data_cache
+from pi88reader.pi88_importer import PI88Measurement, load_tdm_files, TDMFolderSync
+from pi88reader.pi88_plotter import PI88Plotter, PlotJob, render_plot_job, render_plot_jobs, figure_cache
+from pi88reader.plotter_styles import GraphStyler, PlotterStyle, get_power_law_fit_curve_style
 from pi88reader.pptx_styles import table_style_summary, table_style_measurements_meta
 from pi88reader.utils_pi88measurement import get_measurement_result_table_data, get_measurement_meta_table_data
 from pi88reader.utils_pi88measurements import get_measurements_meta_table_data, \
@@ -28,6 +31,7 @@ class PI88ToPPTX:
     def __init__(self, measurements_path=None, template=None):
         self.path = measurements_path
         self.measurements = []
+        self.folder_sync = None  # see sync_tdm_folder
         if self.path:
             self.load_tdm_files(measurements_path)
         self.plotter = PI88Plotter(self.measurements)
@@ -37,11 +41,35 @@ class PI88ToPPTX:
 
         self.poisson_ratio = 0.3
         self.beta = 1.0
+        self.workers = None  # number of processes used for the unloading analysis and for rendering figures
+        self.unloading_data_cache = unloading_data_cache  # shared with PI88Plotter and PI88ToExcel (see ni_cache)
+        self.figure_cache = figure_cache  # rendered figures (see pi88_plotter.FigureCache); None -> always render
 
         self.measurements_unloading_data: dict = {}
 
-    def load_tdm_files(self, path: str, sort_key=os.path.getctime):  # sorted by creation time (using windows)
-        self.measurements.extend(load_tdm_files(path, sort_key))
+    def load_tdm_files(self, path: str, sort_key=os.path.getctime, **kwargs):  # sorted by creation time (using windows)
+        """kwargs are passed to pi88_importer.load_tdm_files() (e.g. workers, executor, errors, cache_dir)."""
+        self.measurements.extend(load_tdm_files(path, sort_key, **kwargs))
+
+    def sync_tdm_folder(self, path: str = None, sort_key=os.path.getctime, errors: list = None, **kwargs) -> None:
+        """
+        Replaces the measurements with those of the folder path. Only new or changed *.tdm files
+        are parsed, when called again (see pi88_importer.TDMFolderSync).
+        :param path: folder (default: folder of the last call or self.path)
+        :param errors: see TDMFolderSync.refresh
+        :param kwargs: passed to TDMFolderSync (e.g. cache_dir, lazy, workers, executor)
+        """
+        if path is None and self.folder_sync is None:
+            path = self.path
+            if path is None:
+                raise ValueError("sync_tdm_folder needs a path (no folder synced yet and no measurements_path)")
+        if self.folder_sync is None or (path is not None and path != self.folder_sync.path):
+            self.folder_sync = TDMFolderSync(path, sort_key, **kwargs)
+        self.folder_sync.refresh(errors)
+        self.measurements = list(self.folder_sync.measurements)
+        self.plotter.measurements = self.measurements
+        self.measurements_unloading_data = {key: value for key, value in self.measurements_unloading_data.items()
+                                            if key[0] in self.measurements}
 
     def add_measurements(self, measurements: Union[PI88Measurement, Iterable[PI88Measurement]]) -> None:
         """
@@ -67,15 +95,22 @@ class PI88ToPPTX:
         """
         return self.pptx_creator.add_matplotlib_figure(fig, slide, position, **kwargs)
 
+    def add_png_image(self, image: bytes, slide: Slide, position: PPTXPosition = None, **kwargs):
+        """
+        Same as add_matplotlib_figure for a rendered figure (see pi88_plotter.render_plot_job).
+        :return: prs.shapes.picture.Picture
+        """
+        with io.BytesIO(image) as file:
+            return self.pptx_creator.add_image(file, slide, position, **kwargs)
+
     def create_summary_slide(self, title: str = None, layout=None):
         if title is None:
             title = f"Summary - {self.path}"
         result = self.pptx_creator.add_slide(title, layout)
 
-        plotter = PI88Plotter(self.measurements)
-        fig = plotter.get_load_displacement_plot()
-        fig.axes[0].legend(loc="best")
-        self.add_matplotlib_figure(fig, result, PPTXPosition(0.02, 0.15))
+        image = render_plot_job(PlotJob("get_load_displacement_plot", self.measurements, legend=True),
+                                cache=self.figure_cache)
+        self.add_png_image(image, result, PPTXPosition(0.02, 0.15))
         self.create_measurements_result_data_table(result)
         return result
 
@@ -103,40 +138,57 @@ class PI88ToPPTX:
         result = self.pptx_creator.add_title_slide(title, layout)
         self.create_measurements_meta_table(result)
 
-        plotter = PI88Plotter(self.measurements)
-        fig = plotter.get_load_displacement_plot()
-        self.add_matplotlib_figure(fig, result, PPTXPosition(0.57, 0.24))
+        image = render_plot_job(PlotJob("get_load_displacement_plot", self.measurements), cache=self.figure_cache)
+        self.add_png_image(image, result, PPTXPosition(0.57, 0.24))
         return result
 
-    def create_measurement_slide(self, measurement: PI88Measurement, layout = None, graph_styler = None):
+    def get_measurement_plot_job(self, measurement: PI88Measurement, graph_styler: GraphStyler = None) -> PlotJob:
+        """Returns the load-displacement plot of a measurement slide (incl. power law fit, if already calculated)."""
+        plotter_style = PlotterStyle()
+        plotter_style.graph_styler = graph_styler
+        curves = []
+        if (measurement, self.poisson_ratio, self.beta) in self.measurements_unloading_data:
+            fit_data = self.measurements_unloading_data[(measurement, self.poisson_ratio, self.beta)]
+            fit_disp, fit_load = get_power_law_fit_curve(**fit_data)
+            curves.append((fit_disp, fit_load, get_power_law_fit_curve_style().dict, "power-law-fit"))
+        return PlotJob("get_load_displacement_plot", measurement, plotter_style, curves)
+
+    def create_measurement_slide(self, measurement: PI88Measurement, layout = None, graph_styler = None,
+                                 image: bytes = None):
+        """
+        :param graph_styler: style of the load-displacement plot (next_style is called afterwards)
+        :param image: already rendered load-displacement plot (see create_measurement_slides)
+        """
         title = measurement._name  # filename[:-4].split("/")[-1].split("\\")[-1]
         result = self.pptx_creator.add_slide(title, layout)
 
         self.create_measurement_result_table(result, measurement)
         self.create_measurement_meta_data_table(result, measurement)
 
-        plotter = PI88Plotter(measurement)
-        if graph_styler is not None:
-            plotter.graph_styler = graph_styler
-        fig = plotter.get_load_displacement_plot()
+        if image is None:
+            image = render_plot_job(self.get_measurement_plot_job(measurement, graph_styler), cache=self.figure_cache)
+            if graph_styler is not None:
+                graph_styler.next_style()
 
-        if (measurement, self.poisson_ratio, self.beta) in self.measurements_unloading_data:
-            fit_data = self.measurements_unloading_data[(measurement, self.poisson_ratio, self.beta)]
-            fit_disp, fit_load = get_power_law_fit_curve(**fit_data)
-            fig.axes[0].plot(fit_disp, fit_load, **get_power_law_fit_curve_style().dict, label="power-law-fit")
-
-        self.add_matplotlib_figure(fig, result, PPTXPosition(0.02, 0.15))
+        self.add_png_image(image, result, PPTXPosition(0.02, 0.15))
         return result
 
     def create_measurement_slides(self, measurements: Optional[List[PI88Measurement]] = None, layout = None) -> list:
+        """The figures of all slides are rendered first (in a process pool, if self.workers > 1)."""
         result = []
         if measurements is None:
             measurements = self.measurements
+        self.calc_measurements_unloading_data(measurements)
 
-        graph_styler = GraphStyler(len(self.measurements))
-
+        graph_styler = GraphStyler(len(measurements))
+        jobs = []
         for measurement in measurements:
-            result.append(self.create_measurement_slide(measurement, layout, graph_styler))
+            jobs.append(self.get_measurement_plot_job(measurement, graph_styler))  # job keeps a copy of the style
+            graph_styler.next_style()
+        images = render_plot_jobs(jobs, workers=self.workers, cache=self.figure_cache)
+
+        for measurement, image in zip(measurements, images):
+            result.append(self.create_measurement_slide(measurement, layout, image=image))
 
         return result
 
@@ -153,7 +205,9 @@ class PI88ToPPTX:
         if (measurement, poisson_ratio, beta) in self.measurements_unloading_data:
             data = self.measurements_unloading_data[(measurement, poisson_ratio, beta)]
         else:
-            data = calc_unloading_data(measurement, beta=self.beta, poisson_ratio=self.poisson_ratio)
+            table = calc_unloading_data_batch([measurement], beta=beta, poisson_ratio=poisson_ratio,
+                                              cache=self.unloading_data_cache)
+            data = get_rows_from_table(table)[0]
             self.measurements_unloading_data[(measurement, poisson_ratio, beta)] = data
         return get_measurement_result_table_data(measurement, data)
 
@@ -176,11 +230,25 @@ class PI88ToPPTX:
         table_style.write_shape(result)
         return result
 
+    def calc_measurements_unloading_data(self, measurements: Optional[List[PI88Measurement]] = None) -> None:
+        """
+        Calculates (batch, see ni_batch) unloading data for all measurements without data for current poisson_ratio and beta.
+        :param measurements: default: self.measurements
+        """
+        if measurements is None:
+            measurements = self.measurements
+        missing = [measurement for measurement in measurements
+                   if (measurement, self.poisson_ratio, self.beta) not in self.measurements_unloading_data]
+        table = calc_unloading_data_batch(missing, beta=self.beta, poisson_ratio=self.poisson_ratio, workers=self.workers,
+                                          cache=self.unloading_data_cache)
+        for measurement, data in zip(missing, get_rows_from_table(table)):
+            self.measurements_unloading_data[(measurement, self.poisson_ratio, self.beta)] = data
+
     def create_measurements_result_data_table(self, slide, table_style: PPTXTableStyle = None):
-        for measurement in self.measurements:
-            if measurement not in self.measurements_unloading_data.keys():
-                self._get_measurement_result_table_data(measurement, self.poisson_ratio, self.beta)  # todo: better method (name change?)
-        table_data = get_measurements_result_table_data(self.measurements_unloading_data.values())
+        self.calc_measurements_unloading_data()
+        table_data = get_measurements_result_table_data(
+            [self.measurements_unloading_data[(measurement, self.poisson_ratio, self.beta)]
+             for measurement in self.measurements])
         result = self.pptx_creator.add_table(slide, table_data)
         if table_style is None:
             table_style = table_style_summary()
@@ -6,12 +6,15 @@ Inspired by the module tdm-loader (https://pypi.org/project/tdm-loader/):
 from Josh Ayers and Florian Dobener
 ==============================================================================
 """
+import hashlib
+import mmap
 import os.path
+import pickle
 import re
 import warnings
 import xml.etree.ElementTree
 from dataclasses import dataclass, field, InitVar
-from typing import Optional, List
+from typing import Optional, List, Tuple, Dict
 
 import numpy as np
 
@@ -28,6 +31,9 @@ DTYPE_CONVERTERS = {'eInt8Usi': 'i1',
                     'eFloat64Usi': 'f8',
                     'eStringUsi': 'U'}
 
+# increase, whenever the content of the metadata cache files changes
+METADATA_CACHE_VERSION = 1
+
 
 def get_usi_from_string(string: str) -> list:
     if string is None or string.strip() == '':
@@ -36,6 +42,41 @@ def get_usi_from_string(string: str) -> list:
         return re.findall(r"id\(\"(.+?)\"\)", string)
 
 
+class TDMIndex:
+    """
+    Id -> element maps for a TDM xml tree. The whole document is walked only once,
+    afterwards every lookup by id is a dictionary access instead of a document scan.
+    """
+
+    def __init__(self, root: xml.etree.ElementTree.Element):
+        self.channels = {}
+        self.channel_groups = {}
+        self.local_columns = {}
+        self.sequences = {}  # all *_sequence elements (double_sequence, long_sequence ...)
+        self.blocks = {}  # file/block entries (inc -> block element)
+        self.file = None
+        self.tdm_root = None
+        self._read(root)
+
+    def _read(self, root: xml.etree.ElementTree.Element) -> None:
+        for element in root.iter():
+            tag = element.tag
+            if tag == 'tdm_channel':
+                self.channels[element.get('id')] = element
+            elif tag == 'tdm_channelgroup':
+                self.channel_groups[element.get('id')] = element
+            elif tag == 'localcolumn':
+                self.local_columns[element.get('id')] = element
+            elif tag.endswith('_sequence'):
+                self.sequences[element.get('id')] = element
+            elif tag == 'block':
+                self.blocks[element.get('id')] = element
+            elif tag == 'file' and self.file is None:
+                self.file = element
+            elif tag == 'tdm_root' and self.tdm_root is None:
+                self.tdm_root = element
+
+
 @dataclass()  # automatically generates __init__, __repr__, __eq, __order__, __hash__
 class TDMChannel:
     xml_root: xml.etree.ElementTree.Element = field(repr=False)
@@ -46,12 +87,15 @@ class TDMChannel:
     inc: str = None
     data_type: str = None
     local_columns_usi: str = None
+    index: TDMIndex = field(default=None, repr=False, compare=False)
 
     def __post_init__(self):
+        if self.index is None:
+            self.index = TDMIndex(self.xml_root)
         self.read()
 
     def read(self) -> None:
-        element = self.xml_root.find(f'.//tdm_channel[@id=\'{self.id}\']')
+        element = self.index.channels[self.id]
         self.name: str = element.find("name").text
         self.description: str = element.find("description").text
         self.unit: str = element.find("unit_string").text
@@ -59,16 +103,20 @@ class TDMChannel:
         self.local_columns_usi: str = get_usi_from_string(element.findtext('local_columns'))[0]
         self.inc: str = self._get_inc()
 
-    def _get_data_usi(self, root: xml.etree.ElementTree.Element) -> str:
-        local_column = root.find(
-            f".//localcolumn[@id='{self.local_columns_usi}']")
+    def _get_data_usi(self) -> str:
+        local_column = self.index.local_columns[self.local_columns_usi]
         return get_usi_from_string(local_column.findtext('values'))[0]
 
     def _get_inc(self) -> str:
-        data_type = self.data_type.split('_')[1].lower() + '_sequence'
-        data_usi = self._get_data_usi(self.xml_root)
-        return self.xml_root.find(
-            f".//{data_type}[@id='{data_usi}']/values").get('external')
+        data_usi = self._get_data_usi()
+        return self.index.sequences[data_usi].find('values').get('external')
+
+    def __getstate__(self):
+        # xml data is not needed anymore after read() -> keep pickled metadata (cache) small
+        state = self.__dict__.copy()
+        state['xml_root'] = None
+        state['index'] = None
+        return state
 
     # def __str__(self):
     #     return f"TdmChannel object\n" \
@@ -87,30 +135,67 @@ class TDMChannelGroup:
     description: str = field(default_factory=str, init=False)
     channel_ids: list = field(default_factory=list, init=False)
     channels: list = field(default_factory=list, init=False)
+    _root: xml.etree.ElementTree.Element = field(default=None, init=False, repr=False, compare=False)
+    _index: TDMIndex = field(default=None, init=False, repr=False, compare=False)
     root: InitVar[any]  # InitVar -> this is passed as parameter to __post__init__()
     _id: InitVar[any]
-
-    def __post_init__(self, root: xml.etree.ElementTree.Element, _id: str):
-        self.read(root, _id)
-        self.read_channels(root)
-
-    def read(self, root: xml.etree.ElementTree.Element, _id: str):
-        element = root.find(f'.//tdm_channelgroup[@id=\'{_id}\']')
+    index: InitVar[TDMIndex] = None
+    lazy: InitVar[bool] = False  # if True, channels are only read, when requested via get_channel()
+
+    def __post_init__(self, root: xml.etree.ElementTree.Element, _id: str, index: TDMIndex = None,
+                      lazy: bool = False):
+        if index is None:
+            index = TDMIndex(root)
+        self._root = root
+        self._index = index
+        self.read(index, _id)
+        if not lazy:
+            self.read_channels(root, index)
+
+    def read(self, index: TDMIndex, _id: str):
+        element = index.channel_groups[_id]
         self.id = element.get('id')
         self.name = element.find("name").text
         self.description = element.find("description").text
         self.channel_ids = get_usi_from_string(element.findtext('channels'))
 
-    def read_channels(self, root: xml.etree.ElementTree.Element):
+    def read_channels(self, root: xml.etree.ElementTree.Element, index: TDMIndex):
         for channel_id in self.channel_ids:
-            self.channels.append(TDMChannel(root, channel_id))
+            self.channels.append(TDMChannel(root, channel_id, index=index))
+
+    def get_channel_names(self) -> List[str]:
+        """Returns the names of all channels (including not yet read channels of a lazy group)."""
+        if len(self.channels) == len(self.channel_ids):
+            return [channel.name for channel in self.channels]
+        return [self._index.channels[channel_id].find("name").text for channel_id in self.channel_ids]
 
     def get_channel(self, channel_name: str) -> Optional[TDMChannel]:
         result = [x for x in self.channels if x.name == channel_name]
         if len(result) == 0:
+            if len(self.channels) < len(self.channel_ids):
+                return self._read_channel(channel_name)
             return None
         return result[0]
 
+    def _read_channel(self, channel_name: str) -> Optional[TDMChannel]:
+        """Reads (and caches) the first not yet read channel named channel_name."""
+        read_ids = {channel.id for channel in self.channels}
+        for channel_id in self.channel_ids:
+            if channel_id in read_ids:
+                continue
+            if self._index.channels[channel_id].find("name").text == channel_name:
+                channel = TDMChannel(self._root, channel_id, index=self._index)
+                self.channels.append(channel)
+                return channel
+        return None
+
+    def __getstate__(self):
+        # xml data is only needed for lazy reading of channels -> keep pickled metadata (cache) small
+        state = self.__dict__.copy()
+        state['_root'] = None
+        state['_index'] = None
+        return state
+
     def __str__(self):
         return f"TdmChannelGroup object\n" \
                f"\tid: {self.id}\n" \
@@ -122,28 +207,153 @@ class TDMChannelGroup:
 class TDMData:
     """Class for importing data from National Instruments TDM/TDX files."""
 
-    def __init__(self, tdm_file: str):
+    def __init__(self, tdm_file: str, lazy: bool = False, cache_dir: Optional[str] = None):
         """
         :param tdm_file: The filename including full path to the .TDM xml-file.
+        :param lazy: If True, channel groups and channels are only read, when they are
+            first requested by name (e.g. via get_channel or read_from_channel_group).
+        :param cache_dir: Optional folder for a metadata cache. If given, the parsed metadata
+            (channel groups, channels, data blocks and instance attributes) is stored there and
+            reused as long as path, size and modification time of tdm_file are unchanged.
+            Reading from the cache skips xml parsing completely (self.root and self.index are None).
+            Only use folders with trusted content (the cache files are pickle files).
         """
+        self.lazy = lazy
         self._folder, self._tdm_filename = os.path.split(tdm_file)
-        self.root = xml.etree.ElementTree.parse(tdm_file).getroot()
-        self._tdx_order = 'C'  # Set binary file reading to column-major style
-        self._tdx_filename = self.root.find('.//file').get('url')
+        self.root = None
+        self.index = None
+        self._tdx_filename = None
+        self._byte_order = None
+        self._blocks = None  # only used, if metadata was read from cache
+        self._instance_attributes = None  # only used, if metadata was read from cache
+        self._tdx_mmap = None  # one shared memory map for all data blocks; opened on first data access
+        self.channel_groups = []
+
+        if cache_dir is None or not self._read_metadata_cache(tdm_file, cache_dir):
+            self._read_metadata(tdm_file)
+            if cache_dir is not None:
+                self._write_metadata_cache(tdm_file, cache_dir)
         self._tdx_path = os.path.join(self._folder, self._tdx_filename)
 
-        self.channel_groups = []
-        self.read_channel_groups()
+    def _read_metadata(self, tdm_file: str) -> None:
+        self.root = xml.etree.ElementTree.parse(tdm_file).getroot()
+        self.index = TDMIndex(self.root)
+        self._tdx_filename = self.index.file.get('url')
+        self._byte_order = self.index.file.get('byteOrder')
+        if not self.lazy:
+            self.read_channel_groups()
+
+    @staticmethod
+    def _get_metadata_cache_key(tdm_file: str) -> tuple:
+        stat = os.stat(tdm_file)
+        return os.path.abspath(tdm_file), stat.st_size, stat.st_mtime_ns
+
+    @staticmethod
+    def _get_metadata_cache_filename(tdm_file: str, cache_dir: str) -> str:
+        path_hash = hashlib.sha1(os.path.abspath(tdm_file).encode()).hexdigest()
+        return os.path.join(cache_dir, path_hash + '.tdmcache')
+
+    def _read_metadata_cache(self, tdm_file: str, cache_dir: str) -> bool:
+        """
+        Reads metadata from cache_dir. Returns False, if there is no valid cache entry for tdm_file.
+        """
+        cache_filename = self._get_metadata_cache_filename(tdm_file, cache_dir)
+        try:
+            with open(cache_filename, 'rb') as cache_file:
+                metadata = pickle.load(cache_file)
+        except FileNotFoundError:
+            return False
+        except Exception as e:  # damaged cache file -> will be overwritten
+            warnings.warn(f"Couldn't read metadata cache {cache_filename}: {e}")
+            return False
+
+        if (metadata.get('version') != METADATA_CACHE_VERSION
+                or metadata.get('key') != self._get_metadata_cache_key(tdm_file)):
+            return False  # stale
+
+        self.lazy = False  # all channel groups and channels are already read
+        self._tdx_filename = metadata['tdx_filename']
+        self._byte_order = metadata['byte_order']
+        self._blocks = metadata['blocks']
+        self._instance_attributes = metadata['instance_attributes']
+        self.channel_groups = metadata['channel_groups']
+        return True
+
+    def _write_metadata_cache(self, tdm_file: str, cache_dir: str) -> None:
+        if self.lazy:
+            channel_groups = [TDMChannelGroup(self.root, _id, self.index) for _id in self._get_channel_group_ids()]
+        else:
+            channel_groups = self.channel_groups
+        metadata = {
+            'version': METADATA_CACHE_VERSION,
+            'key': self._get_metadata_cache_key(tdm_file),
+            'tdx_filename': self._tdx_filename,
+            'byte_order': self._byte_order,
+            'blocks': {inc: dict(block.attrib) for inc, block in self.index.blocks.items()},
+            'instance_attributes': self.get_instance_attributes_dict(),
+            'channel_groups': channel_groups
+        }
+        cache_filename = self._get_metadata_cache_filename(tdm_file, cache_dir)
+        temp_filename = f"{cache_filename}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(temp_filename, 'wb') as cache_file:
+                pickle.dump(metadata, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_filename, cache_filename)  # never leave a half written cache file
+        except OSError as e:
+            warnings.warn(f"Couldn't write metadata cache {cache_filename}: {e}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        """
+        Closes the memory map of the tdx-file. If data arrays returned by this object are still
+        in use, the mapping is released as soon as the last of those arrays is garbage collected.
+        Reading data after close() maps the tdx-file again.
+        """
+        if self._tdx_mmap is not None:
+            try:
+                self._tdx_mmap.close()
+            except BufferError:  # numpy views into the mapping still exist
+                pass
+            self._tdx_mmap = None
+
+    def _get_tdx_mmap(self) -> mmap.mmap:
+        if self._tdx_mmap is None:
+            with open(self._tdx_path, 'rb') as tdx_file:
+                self._tdx_mmap = mmap.mmap(tdx_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._tdx_mmap
+
+    def _get_channel_group_ids(self) -> List[str]:
+        return get_usi_from_string(self.index.tdm_root.findtext('channelgroups'))
 
     def read_channel_groups(self):
-        ids = get_usi_from_string(self.root.findtext('.//tdm_root//channelgroups'))
-        for _id in ids:
-            self.channel_groups.append(TDMChannelGroup(self.root, _id))
+        for _id in self._get_channel_group_ids():
+            self.channel_groups.append(TDMChannelGroup(self.root, _id, self.index, self.lazy))
+
+    def _read_channel_group(self, group_name: str) -> Optional[TDMChannelGroup]:
+        """Reads (and caches) the first not yet read channel group named group_name."""
+        read_ids = {channel_group.id for channel_group in self.channel_groups}
+        for _id in self._get_channel_group_ids():
+            if _id in read_ids:
+                continue
+            if self.index.channel_groups[_id].find("name").text == group_name:
+                channel_group = TDMChannelGroup(self.root, _id, self.index, lazy=True)
+                self.channel_groups.append(channel_group)
+                return channel_group
+        return None
 
     def get_channel_group_names(self) -> List[str]:
         """
         Returns a list with all channel_group names.
         """
+        if self.lazy:
+            names = [self.index.channel_groups[_id].find("name").text for _id in self._get_channel_group_ids()]
+            return [name for name in names if name is not None]
         return [x.name for x in self.channel_groups
                 if x.name is not None]
 
@@ -153,9 +363,8 @@ class TDMData:
         :param channel_group_name: str
         :return: list of str
         """
-        channels = self.get_channel_group(channel_group_name).channels
-        return [channel.name for channel in channels
-                if channel.name is not None]
+        names = self.get_channel_group(channel_group_name).get_channel_names()
+        return [name for name in names if name is not None]
 
     def get_channel_dict(self, channel_group_name: str) -> dict:
         """Returns a dict with {channel: data} entries of a channel_group."""
@@ -176,6 +385,8 @@ class TDMData:
     def get_channel_group(self, group_name: str) -> Optional[TDMChannelGroup]:
         result = [x for x in self.channel_groups if x.name == group_name]
         if len(result) == 0:
+            if self.lazy:
+                return self._read_channel_group(group_name)
             return None
         return result[0]
 
@@ -190,7 +401,7 @@ class TDMData:
         Returns '<' for littleEndian and '>' for bigEndian
         :return: '<' or '>'
         """
-        order = self.root.find('.//file').get('byteOrder')
+        order = self._byte_order
         if order == 'littleEndian':
             return '<'
         elif order == 'bigEndian':
@@ -201,8 +412,15 @@ class TDMData:
     def _get_dtype_from_tdm_type(self, value_type):
         return np.dtype(self.get_endian_format() + DTYPE_CONVERTERS[value_type])
 
+    def _get_block_attributes(self, inc: str) -> dict:
+        """Returns the attributes (byteOffset, length, valueType) of the file/block belonging to inc."""
+        if self._blocks is not None:
+            return self._blocks[inc]
+        return self.index.blocks[inc].attrib
+
     def _get_data(self, inc: str):
         """Gets data binary tdx-file belonging to the given inc.
+        The returned array is a read-only view into the shared memory map of the tdx-file (no copy).
 
         :return: numpy data or None
             Returns None, if inc is None, else returns numpy data.
@@ -210,17 +428,15 @@ class TDMData:
         if inc is None:
             return None
         else:
-            ext_attribs = self.root.find(f".//file/block[@id='{inc}']").attrib
+            ext_attribs = self._get_block_attributes(inc)
             try:
                 if self._tdm_filename[:-3] != self._tdx_filename[:-3]:
                     print(f"Warning: TDM: {self._tdm_filename} - TDX: {self._tdx_filename}")
-                return np.memmap(
-                    self._tdx_path,
-                    offset=int(ext_attribs['byteOffset']),
-                    shape=(int(ext_attribs['length']),),
+                return np.frombuffer(
+                    self._get_tdx_mmap(),
                     dtype=self._get_dtype_from_tdm_type(ext_attribs['valueType']),
-                    mode='r',
-                    order=self._tdx_order
+                    count=int(ext_attribs['length']),
+                    offset=int(ext_attribs['byteOffset'])
                 ).view(np.recarray)
             except Exception as e:
                 import sys
@@ -228,6 +444,51 @@ class TDMData:
                 raise type(e)(str(e) + additional_info).with_traceback(sys.exc_info()[2])
 
 
+    def read_group_array(self, group_name: str,
+                         channel_names: Optional[List[str]] = None) -> Tuple[np.ndarray, Dict[str, int]]:
+        """
+        Reads the channels of a channel group as one 2D array with shape (n_channels, n_points).
+        If the data blocks lie back-to-back in the tdx-file, the result is a single zero-copy
+        view into the memory map of the tdx-file. Otherwise the blocks are copied into one array.
+        :param group_name: str
+        :param channel_names: list of str, optional (default: all channels of the group)
+            Channel names in the wanted row order.
+        :return: numpy.ndarray, dict
+            data, {channel_name: row_index}
+        """
+        if channel_names is None:
+            channel_names = self.get_channel_names(group_name)
+        if len(channel_names) == 0:
+            raise ValueError(f"No channels to read from channel group '{group_name}'")
+
+        blocks = []
+        for channel_name in channel_names:
+            channel = self.get_channel(group_name, channel_name)
+            if channel is None or channel.inc is None:
+                raise ValueError(f"No data for channel '{channel_name}' in channel group '{group_name}'")
+            blocks.append(self._get_block_attributes(channel.inc))
+
+        if len({(block['valueType'], block['length']) for block in blocks}) > 1:
+            raise ValueError(f"Channels in channel group '{group_name}' differ in data type or length")
+
+        dtype = self._get_dtype_from_tdm_type(blocks[0]['valueType'])
+        n_points = int(blocks[0]['length'])
+        offsets = [int(block['byteOffset']) for block in blocks]
+        row_index = {}
+        for i, channel_name in enumerate(channel_names):
+            row_index.setdefault(channel_name, i)
+
+        tdx_mmap = self._get_tdx_mmap()
+        block_size = n_points * dtype.itemsize
+        if all(offset == offsets[0] + i * block_size for i, offset in enumerate(offsets)):
+            data = np.frombuffer(tdx_mmap, dtype=dtype, count=len(offsets) * n_points, offset=offsets[0])
+            return data.reshape(len(offsets), n_points), row_index
+
+        data = np.empty((len(offsets), n_points), dtype=dtype)
+        for i, offset in enumerate(offsets):
+            data[i] = np.frombuffer(tdx_mmap, dtype=dtype, count=n_points, offset=offset)
+        return data, row_index
+
     def _read_data(self, channel, attribute_name, to_object):
         if channel:
             setattr(to_object, attribute_name, self._get_data(channel.inc))
@@ -255,28 +516,52 @@ class TDMData:
         Function specific for PI88 measurement files
         :return: dict
         """
-
-        def get_name_value_pair(element):
-            if element.tag == 'string_attribute':
-                return {element.get("name"): element.find("s").text}
-            elif element.tag == 'double_attribute':
-                return {element.get("name"): float(element.text)}
-            elif element.tag == 'long_attribute':
-                return {element.get("name"): int(element.text)}
-            elif element.tag == 'time_attribute':
-                value = element.text
-                try:
-                    from datetime import datetime
-                    value = datetime.strptime(value[:19], '%Y-%m-%dT%H:%M:%S')
-                except ValueError:
-                    print(ValueError, f"\nCouldn't transform time string to datetime ({element.get('name')} - {value})")
-                return {element.get("name"): value}
-            else:
-                return {element.get("name"): element.text}
+        if self._instance_attributes is not None:
+            return dict(self._instance_attributes)
 
         result = {}
-        attributes = self.root.find(".//tdm_root//instance_attributes")
+        attributes = self.index.tdm_root.find(".//instance_attributes")
         for child in attributes:
-            result.update(get_name_value_pair(child))
+            result.update(_get_name_value_pair(child))
 
         return result
+
+
+def _get_name_value_pair(element: xml.etree.ElementTree.Element) -> dict:
+    if element.tag == 'string_attribute':
+        return {element.get("name"): element.find("s").text}
+    elif element.tag == 'double_attribute':
+        return {element.get("name"): float(element.text)}
+    elif element.tag == 'long_attribute':
+        return {element.get("name"): int(element.text)}
+    elif element.tag == 'time_attribute':
+        value = element.text
+        try:
+            from datetime import datetime
+            value = datetime.strptime(value[:19], '%Y-%m-%dT%H:%M:%S')
+        except ValueError:
+            print(ValueError, f"\nCouldn't transform time string to datetime ({element.get('name')} - {value})")
+        return {element.get("name"): value}
+    else:
+        return {element.get("name"): element.text}
+
+
+def read_instance_attributes(tdm_file: str) -> dict:
+    """
+    Returns the same dict as TDMData(tdm_file).get_instance_attributes_dict(), but only stream-parses
+    the tdm-file until the instance attributes of tdm_root are read (no index, no channels, no tdx-file).
+    """
+    result = {}
+    in_tdm_root = False
+    with open(tdm_file, 'rb') as file:
+        for event, element in xml.etree.ElementTree.iterparse(file, events=('start', 'end')):
+            if element.tag == 'tdm_root':
+                in_tdm_root = event == 'start'
+            elif event == 'end':
+                if in_tdm_root and element.tag == 'instance_attributes':
+                    for child in element:
+                        result.update(_get_name_value_pair(child))
+                    break
+                if element.tag.endswith('_sequence'):
+                    element.clear()  # not needed -> keep memory low
+    return result
@@ -1,42 +1,86 @@
+"""
+Creates input files (*_DATA.txt) for nanoindentation simulations from PI88 measurements
+(area function, polynomial fits of loading and unloading curve, power law fit of unloading curve ...).
+Runs without matplotlib (e.g. in a pipeline); use create_ni_sim_input_files for a whole folder.
+@author: Nathanael Jöhrmann
+"""
+import os
+from concurrent.futures import Executor, ThreadPoolExecutor
 from pathlib import Path
-from pprint import pprint
+from typing import Iterable, List, Optional, Tuple
 
-import matplotlib.pyplot as plt
 import numpy as np
 import numpy.typing as npt
-from numpy.polynomial import Polynomial
-from scipy import optimize
 
 from pi88reader.ni_analyser import calc_unloading_data
-from pi88reader.pi88_importer import PI88Measurement, SegmentType
+from pi88reader.ni_batch import calc_unloading_data_batch, get_rows_from_table
+from pi88reader.pi88_importer import PI88Measurement, SegmentType, load_tdm_files
 
+# weight of the last point (max. load/displacement for the loading curve) in polynomial_fit (= 1/sigma)
+LAST_POINT_WEIGHT = 1000
+WRITE_BUFFER_SIZE = 1 << 20
 
-def polynomial_fit(m: PI88Measurement,  segment_type: SegmentType, polynom_deg=5) -> npt.NDArray:
-    """
-    Polynomial fit for given SegmentType. Returns polynom coef.
-    """
-    def f(x, *p):
-        return Polynomial(p)(x)
 
-    result = np.ndarray(0)
-    _, _, depth, load = m.get_segment_curve(segment_type)
-    # x_data, y_data = m.depth, m.load
-    if len(depth) == 0:
-        return result
+def main():
+    filename = Path("D:\\PI88\\2022\\220506_Al_DeltaCanti\\delta_cantilever_500nm_Al") / "1000uN 01 LC.tdm"  # "'..\\resources\\quasi_static_12000uN.tdm'
 
-    polynom = Polynomial.fit(depth, load, polynom_deg, domain=[])  # using domain=[] gives correct coef., otherwise there is some shift/stretching
-    plt.plot(*polynom.linspace(domain=[depth.min(), depth.max()]), label="Polynom")
-    plt.plot(depth, load, '.', label="exp.")
+    measurement = PI88Measurement(filename)
+    create_ni_sim_input_file(measurement)
+    # pprint((m.settings.dict))
+    # pprint(m.area_function.get_area(100))
 
 
-    sigma = np.ones(len(depth))
-    sigma[-1] = 0.001
-    result, _ = optimize.curve_fit(f, depth, load, np.zeros(polynom_deg+1), sigma=sigma)
+def polynomial_fit_batch(curves: Iterable[Tuple[npt.NDArray, npt.NDArray]], polynom_deg=5) -> List[npt.NDArray]:
+    """
+    Polynomial fits load(depth) for many curves at once. The last point of each curve has a high weight
+    (LAST_POINT_WEIGHT), so the polynomial goes (almost) through it. All curves are solved as one stack
+    of weighted least squares problems (padded with zero weight rows; batched QR decomposition).
+    :param curves: [(depth, load), ...]
+    :return: [polynomial coefficients (lowest degree first), ...]; empty array for curves with less than
+        polynom_deg + 1 distinct depths (e.g. empty curves of aborted measurements)
+    """
+    curves = [(np.asarray(depth, dtype=float), np.asarray(load, dtype=float)) for depth, load in curves]
+    result = [np.ndarray(0) for _ in curves]
+    fitted = [i for i, (depth, _) in enumerate(curves) if len(np.unique(depth)) > polynom_deg]
+    if not fitted:
+        return result
+
+    n_points = max(len(curves[i][0]) for i in fitted)
+    x = np.zeros((len(fitted), n_points))
+    y = np.zeros((len(fitted), n_points))
+    weights = np.zeros((len(fitted), n_points))
+    for k, i in enumerate(fitted):
+        depth, load = curves[i]
+        x[k, :len(depth)] = depth
+        y[k, :len(depth)] = load
+        weights[k, :len(depth)] = 1
+        weights[k, len(depth) - 1] = LAST_POINT_WEIGHT
+
+    scale = np.abs(x).max(axis=1, keepdims=True)  # x/scale in [-1, 1] -> well conditioned
+    scale[scale == 0] = 1
+    vandermonde = (x / scale)[:, :, np.newaxis] ** np.arange(polynom_deg + 1)
+    q, r = np.linalg.qr(vandermonde * weights[:, :, np.newaxis])
+    rhs = np.einsum('kni,kn->ki', q, y * weights)
+    coefficients = np.linalg.solve(r, rhs[:, :, np.newaxis])[:, :, 0] / scale ** np.arange(polynom_deg + 1)
+    for k, i in enumerate(fitted):
+        result[i] = coefficients[k]
+    return result
 
-    plt.plot(depth, f(depth, *result), label="Polynom through max load/disp")
-    plt.legend()
-    plt.show()
 
+def polynomial_fit(m: PI88Measurement, segment_type: SegmentType, polynom_deg=5, axes=None) -> npt.NDArray:
+    """
+    Polynomial fit for given SegmentType. Returns polynom coef. (see polynomial_fit_batch)
+    :param axes: optional matplotlib Axes to plot data and fit
+    """
+    _, _, depth, load = m.get_segment_curve(segment_type)
+    # x_data, y_data = m.depth, m.load
+    result = polynomial_fit_batch([(depth, load)], polynom_deg)[0]
+    if len(result) == 0:
+        return result
+    if axes is not None:
+        axes.plot(depth, load, '.', label="exp.")
+        axes.plot(depth, np.polynomial.Polynomial(result)(depth), label="Polynom through max load/disp")
+        axes.legend()
     return result
 
 
@@ -61,61 +105,130 @@ def hold_displacement(m: PI88Measurement) -> float:
     return unloading_depth[0] - max_displacement_during_load(m)
 
 
-def create_ni_sim_input_file(measurement: PI88Measurement, poisson_ratio=0.3):
-    result = ""
+def get_ni_sim_input_filename(measurement: PI88Measurement) -> Path:
+    return Path(measurement.filename).parent / (measurement.base_name + "_DATA.txt")
+
+
+def write_ni_sim_input_file(measurement: PI88Measurement, loading_polynom: npt.NDArray,
+                            unloading_polynom: npt.NDArray, unloading_dict: dict, save_path=None) -> Path:
+    """
+    Writes the simulation input file of measurement (buffered, section by section).
+    :param loading_polynom: see polynomial_fit (SegmentType.LOAD)
+    :param unloading_polynom: see polynomial_fit (SegmentType.UNLOAD)
+    :param unloading_dict: result of calc_unloading_data
+    :param save_path: default: get_ni_sim_input_filename(measurement)
+    :return: save_path
+    """
+    if save_path is None:
+        save_path = get_ni_sim_input_filename(measurement)
     af = measurement.area_function
-    result += "TIP area function coefficients (start row 2; N=6)\n"
-    result += f"{af.c0}\n{af.c1}\n{af.c2}\n{af.c3}\n{af.c4}\n{af.c5}\n"
+    _, _, unloading_depth, unloading_load = measurement.get_segment_curve(SegmentType.UNLOAD)
 
-    result += "polynom fit loading curve (start row 9; N=7)\n"
-    for c in polynomial_fit(measurement, segment_type=SegmentType.LOAD, polynom_deg=6):
-        result += f"{c}\n"
+    with open(save_path, "w", buffering=WRITE_BUFFER_SIZE) as text_file:
+        text_file.write("TIP area function coefficients (start row 2; N=6)\n")
+        text_file.write(f"{af.c0}\n{af.c1}\n{af.c2}\n{af.c3}\n{af.c4}\n{af.c5}\n")
 
-    result += "polynom fit unloading curve (start row 17; N=7)\n"
-    for c in polynomial_fit(measurement, segment_type=SegmentType.UNLOAD, polynom_deg=6):
-        result += f"{c}\n"
+        text_file.write("polynom fit loading curve (start row 9; N=7)\n")
+        text_file.writelines(f"{c}\n" for c in loading_polynom.tolist())
 
-    result += "fit unloading curve P=A*(h-hf)^m (start row 25; N=3)\n"
-    unloading_dict = powerlaw_fit_unloading_dict(measurement, poisson_ratio=poisson_ratio)
-    result += f"{unloading_dict['fit_A']}\n"
-    result += f"{unloading_dict['fit_hf']}\n"
-    result += f"{unloading_dict['fit_m']}\n"
+        text_file.write("polynom fit unloading curve (start row 17; N=7)\n")
+        text_file.writelines(f"{c}\n" for c in unloading_polynom.tolist())
 
-    result += "poisson ratio sample (also used to calc E below) (row 29)\n"
-    result += f"{unloading_dict['poisson_ratio']}\n"
+        text_file.write("fit unloading curve P=A*(h-hf)^m (start row 25; N=3)\n")
+        text_file.write(f"{unloading_dict['fit_A']}\n")
+        text_file.write(f"{unloading_dict['fit_hf']}\n")
+        text_file.write(f"{unloading_dict['fit_m']}\n")
 
-    result += "calculated E [GPa] (not Er!) (row 31)\n"
-    result += f"{unloading_dict['E']}\n"
+        text_file.write("poisson ratio sample (also used to calc E below) (row 29)\n")
+        text_file.write(f"{unloading_dict['poisson_ratio']}\n")
 
-    result += "beta\n"
-    result += f"{unloading_dict['beta']}\n"
-    # todo: change later after implementing creep during hold in FEM
-    displacement_during_hold = hold_displacement(measurement)
-    result += "delta displacement during hold (row 33)\n"
-    result += f"{displacement_during_hold}\n"
+        text_file.write("calculated E [GPa] (not Er!) (row 31)\n")
+        text_file.write(f"{unloading_dict['E']}\n")
 
-    result += "max. displacement [nm] (row 35)\n"
-    result += f"{max_displacement_during_load(measurement)}\n"
+        text_file.write("beta\n")
+        text_file.write(f"{unloading_dict['beta']}\n")
+        # todo: change later after implementing creep during hold in FEM
+        displacement_during_hold = hold_displacement(measurement)
+        text_file.write("delta displacement during hold (row 33)\n")
+        text_file.write(f"{displacement_during_hold}\n")
 
-    result += "unload displacement end (~zero load) [nm] (row 37)\n"
-    result += f"{displacement_after_unload(measurement)}\n"
+        text_file.write("max. displacement [nm] (row 35)\n")
+        text_file.write(f"{max_displacement_during_load(measurement)}\n")
 
-    _, _, unloading_depth, unloading_load = measurement.get_segment_curve(SegmentType.UNLOAD)
-    result += "exp. unloading curve (disp;load) row(39ff)\n"
-    for i, depth in enumerate(unloading_depth):
-        result += f"{depth};{unloading_load[i]}\n"
+        text_file.write("unload displacement end (~zero load) [nm] (row 37)\n")
+        text_file.write(f"{displacement_after_unload(measurement)}\n")
 
-    result += "END"
+        text_file.write("exp. unloading curve (disp;load) row(39ff)\n")
+        text_file.writelines(f"{depth};{load}\n"
+                             for depth, load in zip(np.asarray(unloading_depth).tolist(),
+                                                    np.asarray(unloading_load).tolist()))
+        text_file.write("END")
+    return save_path
 
-    save_path = Path(measurement.filename).parent/(measurement.base_name + "_DATA.txt")
-    text_file = open(save_path, "w")
-    text_file.write(result)
-    text_file.close()
 
+def _get_polynomial_fit_error(measurement: PI88Measurement, loading_polynom,
+                              unloading_polynom) -> Optional[Exception]:
+    for segment_name, polynom in (("loading", loading_polynom), ("unloading", unloading_polynom)):
+        if len(polynom) == 0:
+            return ValueError(f"Not enough points for the polynomial fit of the {segment_name} curve: "
+                              f"{measurement.filename}")
+    return None
 
-filename = Path("D:\\PI88\\2022\\220506_Al_DeltaCanti\\delta_cantilever_500nm_Al")/"1000uN 01 LC.tdm"  # "'..\\resources\\quasi_static_12000uN.tdm'
 
-measurement = PI88Measurement(filename)
-create_ni_sim_input_file(measurement)
-# pprint((m.settings.dict))
-# pprint(m.area_function.get_area(100))
\ No newline at end of file
+def create_ni_sim_input_file(measurement: PI88Measurement, poisson_ratio=0.3) -> Path:
+    """
+    Creates the simulation input file (measurement.base_name + "_DATA.txt" next to the tdm file).
+    Raises ValueError, if loading or unloading curve are too short for the polynomial fit.
+    """
+    loading_polynom = polynomial_fit(measurement, segment_type=SegmentType.LOAD, polynom_deg=6)
+    unloading_polynom = polynomial_fit(measurement, segment_type=SegmentType.UNLOAD, polynom_deg=6)
+    error = _get_polynomial_fit_error(measurement, loading_polynom, unloading_polynom)
+    if error is not None:
+        raise error
+    unloading_dict = powerlaw_fit_unloading_dict(measurement, poisson_ratio=poisson_ratio)
+    return write_ni_sim_input_file(measurement, loading_polynom, unloading_polynom, unloading_dict)
+
+
+def create_ni_sim_input_files(path: str, sort_key=os.path.getctime, poisson_ratio=0.3, workers: int = None,
+                              executor: Executor = None, errors: list = None, **kwargs) -> List[Path]:
+    """
+    Creates simulation input files for all *.tdm files in path. The tdm files are loaded and the
+    unloading curves are fitted in parallel (workers processes or executor); polynomial fits of all
+    measurements are solved at once (polynomial_fit_batch); files are written by a thread pool.
+    :param errors: list, optional
+        If given, files that can't be loaded or whose curves are too short for the polynomial fits are
+        skipped and (file, exception) is appended to errors. Otherwise the first error is raised.
+    :param kwargs: passed to pi88_importer.load_tdm_files (e.g. cache_dir)
+    :return: list of written files
+    """
+    measurements = load_tdm_files(path, sort_key, workers=workers, executor=executor, errors=errors, **kwargs)
+    return create_ni_sim_input_files_for(measurements, poisson_ratio, workers, executor, errors)
+
+
+def create_ni_sim_input_files_for(measurements: List[PI88Measurement], poisson_ratio=0.3, workers: int = None,
+                                  executor: Executor = None, errors: list = None) -> List[Path]:
+    """Same as create_ni_sim_input_files for given measurements (errors: (filename, exception))."""
+    loading_polynoms = polynomial_fit_batch(
+        [measurement.get_segment_curve(SegmentType.LOAD)[2:] for measurement in measurements], polynom_deg=6)
+    unloading_polynoms = polynomial_fit_batch(
+        [measurement.get_segment_curve(SegmentType.UNLOAD)[2:] for measurement in measurements], polynom_deg=6)
+    unloading_dicts = get_rows_from_table(
+        calc_unloading_data_batch(measurements, poisson_ratio=poisson_ratio, workers=workers, executor=executor))
+
+    jobs = []
+    for job in zip(measurements, loading_polynoms, unloading_polynoms, unloading_dicts):
+        error = _get_polynomial_fit_error(*job[:3])
+        if error is None:
+            jobs.append(job)
+        elif errors is None:
+            raise error
+        else:
+            errors.append((job[0].filename, error))
+    if workers is not None and workers > 1 and len(jobs) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(lambda job: write_ni_sim_input_file(*job), jobs))
+    return [write_ni_sim_input_file(*job) for job in jobs]
+
+
+if __name__ == "__main__":
+    main()
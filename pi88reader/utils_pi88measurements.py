@@ -3,7 +3,7 @@ Functions to handle a collection of measurements.
 @author: Nathanael Jöhrmmann
 """
 import statistics
-from typing import Iterable, Collection, Union, ValuesView
+from typing import Iterable, Collection, Union, ValuesView, Callable, Any, List
 
 
 def get_set_by_setting_name(name: str, measurements: Iterable) -> set:
@@ -13,6 +13,22 @@ def get_set_by_setting_name(name: str, measurements: Iterable) -> set:
     return result
 
 
+def get_measurements_by_setting(name: str, condition: Callable[[Any], bool], measurements: Iterable) -> list:
+    """
+    Returns all measurements, whose setting name fulfills condition.
+    Works with PI88Measurement and PI88Header (e.g. from pi88_importer.scan_tdm_headers).
+    """
+    return [m for m in measurements if condition(m.settings.dict.get(name))]
+
+
+def get_settings_table_data(setting_names: List[str], measurements: Iterable) -> list:
+    """Get table like settings data (one row per measurement or header; first row: names)."""
+    result = [["Name"] + list(setting_names)]
+    for m in measurements:
+        result.append([m._name] + [m.settings.dict.get(name) for name in setting_names])
+    return result
+
+
 def get_summary_by_set(my_set: set) -> str:
     result = ""
     for text in my_set:
@@ -0,0 +1,104 @@
+import numpy as np
+from scipy.optimize import curve_fit
+
+from pi88reader.ni_analyser import calc_unloading_data, get_power_law_fit, get_power_law_start_values, \
+    get_subset_by_y, get_power_law_fit_curve, power_law_fit_function, power_law_fit_jacobian, fit_power_law_batch, \
+    calc_unloading_bootstrap, BOOTSTRAP_NAMES, calc_fit_window_sweep_from_curve
+from pi88reader.pi88_importer import load_tdm_files, SegmentType
+
+
+class TestPowerLawFit:
+    x_data = np.linspace(550, 600, 200)
+    y_data = power_law_fit_function(x_data, 17.6, 542.0, 1.51)
+
+    def test_power_law_fit_jacobian(self):
+        params = (17.6, 542.0, 1.51)
+        jacobian = power_law_fit_jacobian(self.x_data, *params)
+        for i in range(3):
+            step = np.zeros(3)
+            step[i] = 1e-6 * params[i]
+            numeric = (power_law_fit_function(self.x_data, *(params + step))
+                       - power_law_fit_function(self.x_data, *(params - step))) / (2 * step[i])
+            assert np.allclose(jacobian[:, i], numeric, rtol=1e-5)
+
+    def test_get_power_law_start_values(self):
+        A, hf, m = get_power_law_start_values(self.x_data, self.y_data)
+        assert np.isclose(hf, 542.0, rtol=1e-2)
+        assert np.isclose(m, 1.51, rtol=0.1)
+
+    def test_get_power_law_fit(self):
+        result = get_power_law_fit(self.x_data, self.y_data)
+        assert not result["fit_failed"]
+        assert np.allclose([result["fit_A"], result["fit_hf"], result["fit_m"]], [17.6, 542.0, 1.51])
+        assert result["fit_nfev"] < 100
+
+    def test_get_power_law_fit_degenerate(self):
+        for n in range(3):
+            assert get_power_law_fit(self.x_data[:n], self.y_data[:n])["fit_failed"]
+
+    def test_calc_fit_window_sweep_degenerate_window(self):
+        measurement = load_tdm_files('../resources/')[0]
+        header, time, displacement, load = measurement.get_segment_curve(SegmentType.UNLOAD, occurence=-1)
+        sorted_load = np.sort(load)
+        upper = sorted_load[-2] / sorted_load[-1]  # windows [lower, upper] with 2 points and with many points
+        lowers = [sorted_load[-3] / sorted_load[-1] * 1.000001, 0.2]
+        sweep = calc_fit_window_sweep_from_curve(displacement, load, measurement.area_function, [upper], lowers)
+        assert sweep["fit_failed"][0, 0] and np.isnan(sweep["Er"][0, 0])
+        assert not sweep["fit_failed"][0, 1]
+        sweep = calc_fit_window_sweep_from_curve(displacement, load, measurement.area_function, [upper], lowers,
+                                                 min_points=len(load))
+        assert sweep["fit_failed"].all()
+
+    def test_get_subset_by_y(self):
+        y_data = np.array([0, 1, 5, np.nan, 9, 10, 8, 2])
+        result = get_subset_by_y(np.arange(len(y_data)), y_data, 0.9, 0.2)
+        assert list(result["x"]) == [2, 4, 6, 7]
+        assert list(result["y"]) == [5, 9, 8, 2]
+        assert len(get_subset_by_y([], [], 0.9, 0.2)["x"]) == 0
+
+    def test_get_power_law_fit_curve(self):
+        disp, load = get_power_law_fit_curve(17.6, 542.0, 1.51, h_max=600, n_steps=50)
+        assert len(disp) == 50
+        assert np.allclose(load, [power_law_fit_function(h, 17.6, 542.0, 1.51) for h in disp])
+
+    def test_calc_unloading_data(self):
+        """Same results as the former fit (fixed start values, finite differences)."""
+        for measurement in load_tdm_files('../resources/creep_example/') + load_tdm_files('../resources/'):
+            result = calc_unloading_data(measurement)
+            assert not result["fit_failed"]
+            assert np.isclose(result["Er"], calc_unloading_data(measurement, warm_start=True)["Er"])
+
+            header, time, displacement, load = measurement.get_segment_curve(SegmentType.UNLOAD, occurence=-1)
+            x_data, y_data = get_subset_by_y(displacement, load, 0.95, 0.20).values()
+            popt, pcov = curve_fit(power_law_fit_function, x_data, y_data,
+                                   p0=[0.1, min(displacement) * 0.9, 1.8], maxfev=10000, method='trf',
+                                   bounds=((0, 0, 0), (np.inf, min(x_data), np.inf)))
+            assert np.allclose([result["fit_A"], result["fit_hf"], result["fit_m"]], popt, rtol=1e-5)
+
+
+class TestUnloadingBootstrap:
+    def test_fit_power_law_batch(self):
+        x_data = np.linspace(550, 600, 200)
+        start_values = [17.6, 542.0, 1.51]
+        y_data = np.stack([power_law_fit_function(x_data, 17.6, 542.0, 1.51),
+                           power_law_fit_function(x_data, 15.0, 530.0, 1.6)])
+        params, converged = fit_power_law_batch(x_data, y_data, start_values)
+        assert converged.all()
+        assert np.allclose(params, [[17.6, 542.0, 1.51], [15.0, 530.0, 1.6]], rtol=1e-4)
+
+    def test_calc_unloading_bootstrap(self):
+        measurement = load_tdm_files('../resources/')[0]
+        result = calc_unloading_bootstrap(measurement, n_resamples=200, seed=0)
+        assert result["Er"] == calc_unloading_data(measurement)["Er"]
+        assert result["bootstrap_failed"] < 10
+        for name in BOOTSTRAP_NAMES:
+            assert result[f"{name}_lower"] < result[name] < result[f"{name}_upper"]
+            assert result[f"{name}_std"] > 0
+        assert calc_unloading_bootstrap(measurement, n_resamples=200, seed=0)["Er_lower"] == result["Er_lower"]
+
+    def test_calc_unloading_bootstrap_without_resamples(self):
+        measurement = load_tdm_files('../resources/')[0]
+        for n_resamples in (0, 1):
+            result = calc_unloading_bootstrap(measurement, n_resamples=n_resamples, seed=0)
+            assert result["Er"] == calc_unloading_data(measurement)["Er"]
+            assert all(np.isnan(result[f"{name}_lower"]) for name in BOOTSTRAP_NAMES)
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from pi88reader.ni_analyser import calc_unloading_data
+from pi88reader.ni_batch import calc_unloading_data_batch, get_rows_from_table, calc_fit_window_sweep_batch, \
+    calc_unloading_bootstrap_batch
+from pi88reader.ni_cache import UnloadingDataCache, LRUFileCache
+from pi88reader.pi88_importer import load_tdm_files
+
+
+class TestCalcUnloadingDataBatch:
+    def test_calc_unloading_data_batch(self):
+        measurements = load_tdm_files('../resources/creep_example/') + load_tdm_files('../resources/')
+        table = calc_unloading_data_batch(measurements, workers=2)
+        assert len(table["Er"]) == len(measurements)
+        for measurement, row in zip(measurements, get_rows_from_table(table)):
+            expected = calc_unloading_data(measurement)
+            assert row["base_name"] == measurement.base_name
+            assert row["fit_failed"] == expected["fit_failed"]
+            assert np.isclose(row["Er"], expected["Er"])
+            assert np.isclose(row["hardness"], expected["hardness"])
+
+    def test_calc_unloading_data_batch_cache(self, tmp_path):
+        measurements = load_tdm_files('../resources/')
+        cache = UnloadingDataCache(cache_dir=str(tmp_path))
+        table = calc_unloading_data_batch(measurements, cache=cache)
+        assert cache.misses == len(measurements)
+        assert len(cache) == len(measurements)
+
+        cached_table = calc_unloading_data_batch(measurements, cache=cache)
+        assert cache.hits == len(measurements)
+        assert np.allclose(cached_table["Er"], table["Er"])
+        assert cached_table["base_name"] == table["base_name"]
+        assert list(cached_table) == list(table)  # same column order (e.g. PI88ToExcel)
+
+        calc_unloading_data_batch(measurements, beta=1.05, cache=cache)  # other parameters -> new results
+        assert len(cache) == 2 * len(measurements)
+
+        disk_cache = UnloadingDataCache(max_size=1, cache_dir=str(tmp_path))  # results of the previous run
+        disk_table = calc_unloading_data_batch(measurements, cache=disk_cache)
+        assert disk_cache.hits == len(measurements)
+        assert len(disk_cache) == 1
+        assert np.allclose(disk_table["Er"], table["Er"])
+        assert list(disk_table) == list(table)
+        assert disk_table["fit_failed"].dtype == bool
+        for disk_row, row in zip(get_rows_from_table(disk_table), get_rows_from_table(table)):
+            assert disk_row == row
+
+    def test_unloading_data_cache_foreign_file(self, tmp_path):
+        (tmp_path / "0123.unloading").write_bytes(b"\x80\x04garbage")  # e.g. a pickle -> not loaded
+        cache = UnloadingDataCache(cache_dir=str(tmp_path))
+        with pytest.warns(UserWarning):
+            assert cache.get("0123") is None
+
+    def test_lru_file_cache_is_abstract(self):
+        with pytest.raises(TypeError):
+            LRUFileCache(10)
+
+
+class TestCalcFitWindowSweepBatch:
+    def test_calc_fit_window_sweep_batch(self):
+        measurements = load_tdm_files('../resources/')
+        uppers = [0.95, 0.8]
+        lowers = [0.2, 0.4, 0.96]
+        sweep = calc_fit_window_sweep_batch(measurements, uppers, lowers, workers=2)
+        assert sweep["Er"].shape == (len(measurements), len(uppers), len(lowers))
+        assert sweep["base_name"] == [measurement.base_name for measurement in measurements]
+        assert sweep["fit_failed"][:, :, 2].all()  # upper <= lower
+        assert np.isnan(sweep["Er"][:, :, 2]).all()
+        for k, measurement in enumerate(measurements):
+            for i, upper in enumerate(uppers):
+                for j, lower in enumerate(lowers[:2]):
+                    expected = calc_unloading_data(measurement, upper, lower)
+                    assert np.isclose(sweep["Er"][k, i, j], expected["Er"], rtol=1e-4)
+                    assert np.isclose(sweep["hardness"][k, i, j], expected["hardness"], rtol=1e-4)
+
+
+class TestCalcUnloadingBootstrapBatch:
+    def test_calc_unloading_bootstrap_batch(self):
+        measurements = load_tdm_files('../resources/creep_example/')
+        table = calc_unloading_bootstrap_batch(measurements, n_resamples=100, workers=2, seed=1)
+        assert len(table["Er_lower"]) == len(measurements)
+        assert np.all(table["Er_lower"] < table["Er"])
+        assert np.all(table["Er"] < table["Er_upper"])
+        assert np.array_equal(calc_unloading_bootstrap_batch(measurements, n_resamples=100, seed=1)["Er_upper"],
+                              table["Er_upper"])
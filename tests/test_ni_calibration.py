@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from pi88reader.ni_analyser import calc_unloading_data
+from pi88reader.ni_calibration import calibrate_area_function, fit_area_function_coefficients, get_area_function, \
+    get_calibration_data
+from pi88reader.pi88_importer import load_tdm_files
+
+
+@pytest.fixture(scope='class')
+def measurements():
+    return load_tdm_files('../resources/') + load_tdm_files('../resources/creep_example/')
+
+
+class TestAreaFunctionCalibration:
+    def test_get_calibration_data(self, measurements):
+        Er = [calc_unloading_data(measurement)["Er"] for measurement in measurements]
+        data = get_calibration_data(measurements, Er)
+        by_base_name = {measurement.base_name: measurement for measurement in measurements}
+        for base_name, hc, area in zip(data["base_name"], data["hc_max"], data["Ac"]):
+            assert np.isclose(area, by_base_name[base_name].area_function.get_area(hc))
+
+    def test_fit_area_function_coefficients(self, measurements):
+        area_function = measurements[0].area_function
+        hc = np.linspace(50, 1500, 300)
+        coefficients = fit_area_function_coefficients(hc, area_function.get_area(hc))
+        calibrated = get_area_function(coefficients)
+        assert np.allclose(calibrated.get_area(hc), area_function.get_area(hc), rtol=1e-6)
+
+        coefficients = fit_area_function_coefficients(hc, 24.5 * hc ** 2 + 1000 * hc, n_terms=3, c0=24.5)
+        assert np.allclose(coefficients, [24.5, 1000, 0, 0, 0, 0], atol=1e-6)
+
+    def test_calibrate_area_function(self, measurements):
+        Er = [calc_unloading_data(measurement)["Er"] for measurement in measurements]
+        area_function = calibrate_area_function(measurements, Er, n_terms=4)
+        for measurement, expected in zip(measurements, Er):
+            measurement.area_function, original = area_function, measurement.area_function
+            assert np.isclose(calc_unloading_data(measurement)["Er"], expected, rtol=1e-3)
+            measurement.area_function = original
+
+    def test_get_calibration_data_empty(self, measurements):
+        expected = get_calibration_data(measurements[:1], calc_unloading_data(measurements[0])["Er"])
+        assert list(get_calibration_data([])) == list(expected)
+
+    def test_calibrate_area_function_few_indents(self, measurements):
+        measurements = measurements[:2]
+        Er = [calc_unloading_data(measurement)["Er"] for measurement in measurements]
+        data = get_calibration_data(measurements, Er)
+        with pytest.raises(ValueError):  # 2 points, 6 coefficients
+            fit_area_function_coefficients(data["hc_max"], data["Ac"])
+        area_function = calibrate_area_function(measurements, Er)  # -> only c0 and c1
+        assert list(area_function.coefficients[2:]) == [0, 0, 0, 0]
+        assert 0 < area_function.get_area(50.0) < area_function.get_area(100.0)
+        for measurement, expected in zip(measurements, Er):
+            measurement.area_function, original = area_function, measurement.area_function
+            assert np.isclose(calc_unloading_data(measurement)["Er"], expected, rtol=1e-3)
+            measurement.area_function = original
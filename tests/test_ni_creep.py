@@ -0,0 +1,93 @@
+import numpy as np
+
+from pi88reader.ni_creep import calc_creep_windows, calc_creep_windows_batch, calc_window_means, \
+    get_creep_window_edges, get_hold_segment, fit_creep_exponents, fit_global_creep_exponent, \
+    calc_creep_exponents_batch
+from pi88reader.pi88_importer import load_tdm_files
+
+
+class TestCreepWindows:
+    def test_get_creep_window_edges(self):
+        time = np.arange(100.0)
+        edges = get_creep_window_edges(time, n_windows=4, t_min=49.5)
+        assert list(edges) == [38, 50, 62, 74, 86, 98]
+        edges = get_creep_window_edges(time, window_time=10, t_min=49.5)
+        assert list(edges) == [40, 50, 60, 70, 80, 90]  # only complete windows
+
+    def test_calc_window_means(self):
+        values = np.random.default_rng(0).random(100) + 1000
+        edges = [0, 10, 10, 55, 100]
+        means = calc_window_means(values, edges)
+        assert np.isnan(means[1])
+        assert np.allclose(means[[0, 2, 3]], [values[0:10].mean(), values[10:55].mean(), values[55:100].mean()])
+
+    def test_calc_creep_windows(self):
+        measurement = load_tdm_files('../resources/creep_example/')[0]
+        time, displacement, load = get_hold_segment(measurement)
+        result = calc_creep_windows(time, displacement, load, measurement.area_function, n_windows=20)
+        assert len(result["strain_rate"]) == 20
+        # loop version (like the former get_avg_strain_rate_and_sigma)
+        n = (len(time) - np.searchsorted(time, 50, side='right')) // 20
+        start = np.searchsorted(time, 50, side='right')
+        previous = slice(start - n, start)
+        for i in range(20):
+            window = slice(start + i * n, start + (i + 1) * n)
+            strain_rate = ((displacement[window].mean() - displacement[previous].mean())
+                           / displacement[previous].mean() / (time[window].mean() - time[previous].mean()))
+            stress = load[window].mean() * 1e-6 / (measurement.area_function.get_area(displacement[window].mean()) * 1e-18)
+            assert np.isclose(result["strain_rate"][i], strain_rate)
+            assert np.isclose(result["stress"][i], stress)
+            previous = window
+
+    def test_calc_creep_windows_batch(self):
+        measurements = load_tdm_files('../resources/creep_example/') + load_tdm_files('../resources/')
+        result = calc_creep_windows_batch(measurements, window_time=2)
+        assert result["stress"].shape == (len(measurements), max(result["n_windows"]))
+        for k, measurement in enumerate(measurements):
+            expected = calc_creep_windows(*get_hold_segment(measurement), measurement.area_function, window_time=2)
+            assert result["n_windows"][k] == len(expected["stress"])
+            assert np.allclose(result["stress"][k, :result["n_windows"][k]], expected["stress"], equal_nan=True)
+            assert np.allclose(result["strain_rate"][k, :result["n_windows"][k]], expected["strain_rate"],
+                               equal_nan=True)
+            assert np.isnan(result["stress"][k, result["n_windows"][k]:]).all()
+
+
+class TestCreepExponents:
+    stress = np.array([[1e8, 2e8, 3e8, 4e8],
+                       [5e8, 6e8, 7e8, np.nan]])
+    log_B = np.array([[-100.0], [-101.0]])
+
+    def get_strain_rate(self, n):
+        return np.exp(self.log_B + n * np.log(self.stress))
+
+    def test_fit_creep_exponents(self):
+        result = fit_creep_exponents(self.stress, self.get_strain_rate(5))
+        assert np.allclose(result["n"], 5)
+        assert np.allclose(result["log_B"], self.log_B[:, 0])
+        assert list(result["n_points"]) == [4, 3]
+
+        windows = calc_creep_windows_batch(load_tdm_files('../resources/creep_example/'), n_windows=30)
+        result = fit_creep_exponents(windows["stress"], windows["strain_rate"])
+        for k in range(len(result["n"])):
+            valid = windows["strain_rate"][k] > 0
+            coefficients, covariance = np.polyfit(np.log(windows["stress"][k][valid]),
+                                                  np.log(windows["strain_rate"][k][valid]), 1, cov=True)
+            assert np.isclose(result["n"][k], coefficients[0])
+            assert np.isclose(result["n_stderr"][k], covariance[0, 0] ** 0.5)
+
+    def test_fit_global_creep_exponent(self):
+        result = fit_global_creep_exponent(self.stress, self.get_strain_rate(5))
+        assert np.isclose(result["n"], 5)
+        assert result["n_points"] == 7
+        assert result["n_measurements"] == 2
+        rng = np.random.default_rng(0)
+        strain_rate = self.get_strain_rate(5) * np.exp(rng.normal(0, 0.01, self.stress.shape))
+        result = fit_global_creep_exponent(self.stress, strain_rate, individual_intercepts=False)
+        assert abs(result["n"] - 5) > 0.1  # different intercepts
+        assert 0 < fit_global_creep_exponent(self.stress, strain_rate)["n_stderr"] < 0.1
+
+    def test_calc_creep_exponents_batch(self):
+        result = calc_creep_exponents_batch(load_tdm_files('../resources/creep_example/'), n_windows=30)
+        assert len(result["n"]) == 2
+        assert min(result["n"]) < result["global_n"] < max(result["n"])
+        assert result["global_n_stderr"] > 0
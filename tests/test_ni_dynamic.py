@@ -0,0 +1,61 @@
+import numpy as np
+
+from pi88reader.ni_dynamic import DYNAMIC_NAMES, calc_depth_profiles, get_dynamic_table, get_dynamic_valid_mask
+from pi88reader.pi88_importer import PI88Measurement
+from pi88reader.pi88_store import PI88MeasurementStore, write_measurement_store
+
+FILENAME = '../resources/nan_error_dyn_10000uN.tdm'
+
+
+class TestDynamicTable:
+    def test_get_dynamic_valid_mask(self):
+        measurement = PI88Measurement(FILENAME)
+        mask = get_dynamic_valid_mask(measurement)
+        raw = measurement.get_average_dynamic_raw("average_dynamic_hardness")
+        assert len(mask) == len(raw)
+        assert np.count_nonzero(mask) == len(measurement.average_dynamic_hardness)
+
+    def test_get_dynamic_table(self):
+        measurement = PI88Measurement(FILENAME)
+        table = get_dynamic_table(measurement)
+        assert set(table) == set(DYNAMIC_NAMES)
+        assert len({len(column) for column in table.values()}) == 1
+        assert np.array_equal(table["average_dynamic_hardness"], measurement.average_dynamic_hardness)
+        assert table["average_dynamic_hardness"].base is table["average_dynamic_depth"].base  # one block
+
+    def test_lazy_and_store(self, tmp_path):
+        expected = get_dynamic_table(PI88Measurement(FILENAME))
+        lazy_table = get_dynamic_table(PI88Measurement(FILENAME, lazy=True))
+        store_filename = str(tmp_path / "test.pi88store")
+        write_measurement_store([PI88Measurement(FILENAME)], store_filename)
+        with PI88MeasurementStore(store_filename) as store:
+            store_table = get_dynamic_table(store.get_measurement(0))
+            for name, column in expected.items():
+                assert np.array_equal(lazy_table[name], column)
+                assert np.array_equal(store_table[name], column)
+
+
+class TestDepthProfiles:
+    def test_calc_depth_profiles(self):
+        measurement = PI88Measurement(FILENAME)
+        table = get_dynamic_table(measurement)
+        depth = table["average_dynamic_contact_depth"]
+        hardness = table["average_dynamic_hardness"]
+        bins = np.linspace(depth.min(), depth.max(), 6)
+
+        result = calc_depth_profiles([measurement, measurement], bins=5)
+        assert np.allclose(result["bin_edges"], bins)
+        assert result["counts"].sum() == 2 * len(depth)
+        assert np.array_equal(result["pooled_counts"], 2 * result["counts"][0])
+        for i in range(5):
+            in_bin = (depth >= bins[i]) & ((depth < bins[i + 1]) | (i == 4))
+            assert np.isclose(result["average_dynamic_hardness_mean"][1, i], hardness[in_bin].mean())
+            assert np.isclose(result["average_dynamic_hardness_std"][0, i], hardness[in_bin].std())
+            assert np.isclose(result["average_dynamic_hardness_pooled_std"][i], hardness[in_bin].std())
+
+    def test_empty_bins(self):
+        measurement = PI88Measurement(FILENAME)
+        result = calc_depth_profiles([measurement], bins=[-20, -10, 0, 1000], names=["average_dynamic_hardness"])
+        assert list(result["counts"][0, :2]) == [0, 0]
+        assert np.isnan(result["average_dynamic_hardness_mean"][0, :2]).all()
+        assert np.isnan(result["average_dynamic_hardness_pooled_std"][:2]).all()
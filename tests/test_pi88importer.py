@@ -0,0 +1,142 @@
+import copy
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from pi88reader.pi88_importer import load_tdm_files, PI88Measurement, SegmentType, scan_tdm_headers, \
+    TDMFolderSync
+from pi88reader.utils_pi88measurements import get_aborted_measurements, get_measurements_by_setting
+
+
+class TestLoadTDMFiles:
+    def test_workers(self):
+        measurements_path = '../resources/'
+        serial = load_tdm_files(measurements_path)
+        parallel = load_tdm_files(measurements_path, workers=2)
+        assert [m.filename for m in parallel] == [m.filename for m in serial]
+        assert np.array_equal(parallel[0].load, serial[0].load)
+
+    def test_executor_errors(self, tmp_path):
+        for extension in (".tdm", ".tdx"):
+            shutil.copy('../resources/quasi_static_12000uN' + extension, tmp_path)
+        (tmp_path / "broken.tdm").write_text("no xml")
+        errors = []
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            measurements = load_tdm_files(str(tmp_path), executor=executor, errors=errors)
+        assert len(measurements) == 1
+        assert len(errors) == 1
+        assert errors[0][0].name == "broken.tdm"
+
+
+class TestTDMFolderSync:
+    def test_refresh(self, tmp_path):
+        for extension in (".tdm", ".tdx"):
+            shutil.copy('../resources/quasi_static_12000uN' + extension, tmp_path)
+        folder_sync = TDMFolderSync(str(tmp_path))
+        added, changed, removed = folder_sync.refresh()
+        assert len(added) == 1 and len(changed) == 0 and len(removed) == 0
+        first = folder_sync.measurements[0]
+        assert folder_sync.refresh() == ([], [], [])
+        assert folder_sync.measurements[0] is first  # unchanged file is not parsed again
+
+        for extension in (".tdm", ".tdx"):
+            shutil.copy('../resources/nan_error_dyn_10000uN' + extension, tmp_path)
+        (tmp_path / "unfinished.tdm").write_text("<?xml")
+        errors = []
+        added, changed, removed = folder_sync.refresh(errors)
+        assert [file.name for file in added] == ["nan_error_dyn_10000uN.tdm"]
+        assert [file.name for file, _ in errors] == ["unfinished.tdm"]
+        assert len(folder_sync.measurements) == 2
+        assert folder_sync.measurements[0] is first
+
+        os.remove(tmp_path / "unfinished.tdm")
+        os.remove(tmp_path / "quasi_static_12000uN.tdm")
+        added, changed, removed = folder_sync.refresh()
+        assert [file.name for file in removed] == ["quasi_static_12000uN.tdm"]
+        assert len(folder_sync.measurements) == 1
+
+
+class TestPI88Measurement:
+    def test_lazy(self):
+        filename = '../resources/nan_error_dyn_10000uN.tdm'
+        eager = PI88Measurement(filename)
+        lazy = PI88Measurement(filename, lazy=True)
+        assert "time" not in lazy.__dict__
+        assert "average_dynamic_hardness" not in lazy.__dict__
+        assert np.array_equal(lazy.time, eager.time)
+        assert lazy.time_unit == eager.time_unit
+        assert "average_dynamic_hardness" not in lazy.__dict__  # only the group of time was read
+        assert np.array_equal(lazy.average_dynamic_hardness, eager.average_dynamic_hardness)
+        assert np.array_equal(lazy.segments.time, eager.segments.time)
+        lazy.read_all()
+        assert lazy._data is None  # closed after all groups are read
+        assert len(lazy.average_dynamic_freq) == len(eager.average_dynamic_freq)
+
+    def test_get_segment_curve(self):
+        measurement = PI88Measurement('../resources/quasi_static_12000uN.tdm')
+        for segment_type in SegmentType:
+            mask = measurement.segments.get_segment_mask(measurement.time, segment_type, occurence=-1)
+            header, time, depth, load = measurement.get_segment_curve(segment_type, occurence=-1)
+            assert np.array_equal(time, measurement.time[mask])
+            assert np.array_equal(depth, measurement.depth[mask])
+            assert np.array_equal(load, measurement.load[mask])
+        header, time, depth, load = measurement.get_segment_curve(SegmentType.UNLOAD)
+        assert np.shares_memory(load, measurement.load)  # slice -> view
+
+    def test_get_segment_slice(self):
+        """Same selection as get_segment_mask (except for occurence=0 -> always empty)."""
+        for measurement in load_tdm_files('../resources/') + load_tdm_files('../resources/creep_example/'):
+            for segment_type in SegmentType:
+                for occurence in (-2, -1, 1, 2, 3, 10):
+                    mask = measurement.segments.get_segment_mask(measurement.time, segment_type, occurence)
+                    segment_slice = measurement.get_segment_slice(segment_type, occurence)
+                    assert np.array_equal(measurement.time[segment_slice], measurement.time[mask])
+                assert len(measurement.time[measurement.get_segment_slice(segment_type, 0)]) == 0
+
+
+class TestScanTDMHeaders:
+    def test_scan_tdm_headers(self):
+        headers = scan_tdm_headers('../resources/')
+        assert len(headers) == 4  # including sub folder creep_example
+        measurement = PI88Measurement('../resources/quasi_static_12000uN.tdm')
+        header = [h for h in headers if h.base_name == "quasi_static_12000uN"][0]
+        assert header.settings.dict.keys() == measurement.settings.dict.keys()
+        assert header.settings.dict["Acquisition_Timestamp"] == measurement.settings.dict["Acquisition_Timestamp"]
+        assert [h.filename for h in scan_tdm_headers('../resources/', workers=2)] == [h.filename for h in headers]
+
+        not_aborted = get_measurements_by_setting("Acquisition_Test_Aborted", lambda x: not x, headers)
+        assert len(get_aborted_measurements(headers)) + len(not_aborted) == len(headers)
+
+
+@pytest.fixture(scope='class')
+def area_function():
+    return load_tdm_files('../resources/')[0].area_function
+
+
+class TestPI88AreaFunction:
+    def test_get_area(self, area_function):
+        c0, c1, c2, c3, c4, c5 = area_function.coefficients
+        for h in (15.0, 100.0, 2500.0):
+            expected = c0 * h ** 2 + c1 * h + c2 * h ** (1 / 2) + c3 * h ** (1 / 4) + c4 * h ** (1 / 8) + c5 * h ** (1 / 16)
+            assert np.isclose(area_function.get_area(h), expected, rtol=1e-12)
+            assert isinstance(area_function.get_area(h), float)
+        depths = np.linspace(15, 2500, 50)
+        assert np.allclose(area_function.get_area(depths), [area_function.get_area(h) for h in depths])
+
+    def test_get_contact_depth(self, area_function):
+        depths = np.linspace(15, 2500, 50)
+        assert np.allclose(area_function.get_contact_depth(area_function.get_area(depths)), depths,
+                           rtol=1e-9)
+        assert np.isclose(area_function.get_contact_depth(area_function.get_area(100.0)), 100.0)
+        assert np.isnan(area_function.get_contact_depth(-1.0))
+
+    def test_get_contact_depth_after_coefficient_change(self, area_function):
+        area_function = copy.copy(area_function)
+        area = area_function.get_area(100.0)
+        assert np.isclose(area_function.get_contact_depth(area), 100.0)
+        area_function.c0 *= 2  # set directly (not via read) -> inverse table has to be recalculated
+        assert np.isclose(area_function.get_contact_depth(area_function.get_area(100.0)), 100.0)
+        assert area_function.get_contact_depth(area, refine=False) < 99.0
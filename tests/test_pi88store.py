@@ -0,0 +1,63 @@
+import os
+import pickle
+import shutil
+import struct
+
+import numpy as np
+
+from pi88reader.pi88_importer import load_tdm_files
+from pi88reader.pi88_store import write_folder_store, read_measurement_store, STORE_FILENAME
+
+unpickled = []
+
+
+class _Unpickled:
+    def __reduce__(self):
+        return unpickled.append, ("executed",)
+
+
+def _copy_resources(path):
+    for filename in ("quasi_static_12000uN", "nan_error_dyn_10000uN"):
+        for extension in (".tdm", ".tdx"):
+            shutil.copy('../resources/' + filename + extension, path)
+
+
+class TestPI88Store:
+    def test_folder_store(self, tmp_path):
+        _copy_resources(tmp_path)
+        path = str(tmp_path)
+        measurements = write_folder_store(path)
+        store_filename = os.path.join(path, STORE_FILENAME)
+        assert os.path.isfile(store_filename)
+
+        stored = read_measurement_store(store_filename)
+        assert [m.filename for m in stored] == [m.filename for m in measurements]
+        for m, s in zip(measurements, stored):
+            assert np.array_equal(m.load, s.load)
+            assert np.array_equal(m.segments.timestamp_end, s.segments.timestamp_end)
+            assert m.segments.segment_type == s.segments.segment_type
+            assert m.load_unit == s.load_unit
+            assert m.area_function.c0 == s.area_function.c0
+            assert repr(m.settings.dict) == repr(s.settings.dict)  # incl. datetime (and nan) values
+        assert np.array_equal(measurements[1].average_dynamic_hardness, stored[1].average_dynamic_hardness)
+
+        for filename in ("quasi_static_12000uN", "nan_error_dyn_10000uN"):
+            os.remove(os.path.join(path, filename + ".tdx"))  # tdx files aren't needed with an up to date store
+        loaded = load_tdm_files(path, use_store=True)  # uses the up to date store
+        assert [m.filename for m in loaded] == [m.filename for m in measurements]
+        assert np.array_equal(loaded[0].depth, measurements[0].depth)
+
+        shutil.copy('../resources/nan_error_dyn_10000uN.tdx', tmp_path)
+        os.remove(os.path.join(path, "quasi_static_12000uN.tdm"))  # store is not up to date anymore
+        assert len(load_tdm_files(path, use_store=True)) == 1
+
+    def test_foreign_store_is_ignored(self, tmp_path):
+        _copy_resources(tmp_path)
+        store_filename = os.path.join(str(tmp_path), STORE_FILENAME)
+        header = pickle.dumps({"version": 2, "entries": [_Unpickled()]})  # former (pickled) header
+        for content in (struct.pack("<8sQ", b"PI88STOR", len(header)) + header, b"PI88STOR\x00", b"garbage"):
+            with open(store_filename, "wb") as file:
+                file.write(content)
+            measurements = load_tdm_files(str(tmp_path), use_store=True)
+            assert len(measurements) == 2 and measurements[0].load is not None
+        assert unpickled == []
@@ -1,12 +1,18 @@
 import os
+import pickle
+import shutil
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 import pytest
 import matplotlib.pyplot as plt
 from pptx_tools.templates import TemplateExample
 
-from pi88reader.pi88_importer import PI88Measurement
+from pi88reader.pi88_importer import PI88Measurement, load_tdm_files
+from pi88reader.pi88_plotter import PlotJob, render_plot_job, render_plot_jobs, FigureCache, get_plot_job_key
 from pi88reader.pi88_to_pptx import PI88ToPPTX
+from pi88reader.plotter_styles import GraphStyler, PlotterStyle
 
 
 @pytest.fixture(scope='class')
@@ -88,4 +94,109 @@ class TestPI88ToPPTX:
         assert not os.path.isfile(temp_filepath)
         pi88_to_pptx.save(temp_filepath)
         assert os.path.isfile(temp_filepath)
-        os.remove(temp_filepath)
\ No newline at end of file
+        os.remove(temp_filepath)
+
+    def test_sync_tdm_folder(self, tmp_path):
+        pi88_to_pptx = PI88ToPPTX()
+        with pytest.raises(ValueError):
+            pi88_to_pptx.sync_tdm_folder()
+        with pytest.raises(ValueError):
+            pi88_to_pptx.plotter.sync_tdm_folder()
+        for extension in (".tdm", ".tdx"):
+            shutil.copy('../resources/quasi_static_12000uN' + extension, tmp_path)
+        pi88_to_pptx.sync_tdm_folder(str(tmp_path))
+        assert len(pi88_to_pptx.measurements) == 1
+        assert pi88_to_pptx.plotter.measurements == pi88_to_pptx.measurements
+
+
+class TestPlotJobs:
+    def test_render_plot_jobs(self):
+        measurements = load_tdm_files('../resources/')
+        jobs = [PlotJob("get_load_displacement_plot", measurement) for measurement in measurements]
+        jobs.append(PlotJob("get_creep_dlog_plot", load_tdm_files('../resources/creep_example/'), n_windows=8))
+        images = render_plot_jobs(jobs)
+        assert len(images) == len(jobs)
+        assert all(image.startswith(b"\x89PNG") for image in images)
+        assert render_plot_jobs(jobs[:2], workers=2) == images[:2]
+
+    def test_plot_job_data(self):
+        measurement = PI88Measurement('../resources/nan_error_dyn_10000uN.tdm', lazy=True)
+        job = PlotJob("get_load_displacement_plot", measurement)
+        assert "average_dynamic_storage_mod" in measurement._lazy_attributes  # dynamic data is not read
+        assert job.measurements is not measurement
+        assert not np.shares_memory(job.measurements.depth, measurement.depth)
+        assert get_plot_job_key(job) == get_plot_job_key(PlotJob("get_load_displacement_plot",
+                                                                  PI88Measurement(measurement.filename)))
+        assert render_plot_job(job) == render_plot_job(PlotJob("get_load_displacement_plot", measurement))
+        assert len(pickle.dumps(job)) < len(pickle.dumps(measurement))
+
+    def test_render_plot_jobs_threads(self):
+        measurements = load_tdm_files('../resources/')
+        jobs = [PlotJob("get_load_displacement_plot", measurement) for measurement in measurements] * 2
+        figure_numbers = plt.get_fignums()
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            images = render_plot_jobs(jobs, executor=executor)
+        assert images == render_plot_jobs(jobs)
+        assert plt.get_fignums() == figure_numbers  # pyplot is not used for rendering
+
+    def test_create_measurement_slides(self):
+        pi88_to_pptx = PI88ToPPTX(measurements_path='../resources/')
+        slides = pi88_to_pptx.create_measurement_slides()
+        assert len(slides) == len(pi88_to_pptx.measurements)
+        image = render_plot_job(pi88_to_pptx.get_measurement_plot_job(pi88_to_pptx.measurements[0],
+                                                                      GraphStyler(len(pi88_to_pptx.measurements))))
+        assert slides[0].shapes[-1].image.blob == image
+
+    def test_create_measurement_slides_subset(self):
+        pi88_to_pptx = PI88ToPPTX(measurements_path='../resources/')
+        slides = pi88_to_pptx.create_measurement_slides(pi88_to_pptx.measurements[1:])
+        assert len(slides) == 1
+        assert list(pi88_to_pptx.measurements_unloading_data) == [(pi88_to_pptx.measurements[1], 0.3, 1.0)]
+        image = render_plot_job(pi88_to_pptx.get_measurement_plot_job(pi88_to_pptx.measurements[1], GraphStyler(1)))
+        assert slides[0].shapes[-1].image.blob == image
+
+
+class TestFigureCache:
+    def test_get_plot_job_key(self):
+        measurement = PI88Measurement('../resources/quasi_static_12000uN.tdm')
+        key = get_plot_job_key(PlotJob("get_load_displacement_plot", measurement))
+        assert key == get_plot_job_key(PlotJob("get_load_displacement_plot",
+                                               PI88Measurement('../resources/quasi_static_12000uN.tdm')))
+        assert key != get_plot_job_key(PlotJob("get_load_displacement_plot", measurement, legend=True))
+        assert key != get_plot_job_key(PlotJob("get_load_displacement_plot", measurement, PlotterStyle(dpi=100)))
+        plotter_style = PlotterStyle()
+        plotter_style.graph_styler = GraphStyler()
+        plotter_style.graph_styler.next_style()
+        assert key != get_plot_job_key(PlotJob("get_load_displacement_plot", measurement, plotter_style))
+
+    def test_render_plot_jobs(self, tmp_path):
+        measurements = load_tdm_files('../resources/')
+        jobs = [PlotJob("get_load_displacement_plot", measurement) for measurement in measurements]
+        cache = FigureCache(cache_dir=str(tmp_path))
+        images = render_plot_jobs(jobs + jobs[:1], cache=cache)
+        assert cache.misses == len(jobs) + 1 and len(cache) == len(jobs)  # identical jobs are rendered once
+        assert images[-1] == images[0] == render_plot_job(jobs[0])
+        assert render_plot_jobs(jobs, cache=cache) == images[:-1]
+        assert cache.hits == len(jobs)
+
+        cache = FigureCache(cache_dir=str(tmp_path))  # next run -> images from disk
+        assert render_plot_job(jobs[1], cache=cache) == images[1]
+        assert cache.hits == 1
+
+    def test_eviction(self):
+        cache = FigureCache(max_bytes=10)
+        cache.put("a", b"12345")
+        cache.put("b", b"12345")
+        assert cache.get("a") == b"12345"  # -> b is least recently used
+        cache.put("c", b"123")
+        assert "b" not in cache and "a" in cache and "c" in cache
+        assert cache.size == 8
+
+    def test_create_summary_slide(self):
+        pi88_to_pptx = PI88ToPPTX(measurements_path='../resources/')
+        pi88_to_pptx.figure_cache = FigureCache()
+        pi88_to_pptx.create_title_slide()
+        pi88_to_pptx.create_summary_slide()
+        pi88_to_pptx.create_summary_slide()
+        assert pi88_to_pptx.figure_cache.hits == 1
+        assert len(pi88_to_pptx.figure_cache) == 2  # title slide without legend
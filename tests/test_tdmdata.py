@@ -1,8 +1,11 @@
+import os
+import shutil
+
 import pytest
 import numpy as np
 
 from pi88reader import tdm_importer
-from pi88reader.tdm_importer import TDMData, TDMChannelGroup, TDMChannel
+from pi88reader.tdm_importer import TDMData, TDMChannelGroup, TDMChannel, TDMIndex
 
 
 @pytest.fixture(scope='class')
@@ -18,6 +21,16 @@ class TestTdmData:
         assert len(tdm_data.channel_groups) == 2
         assert hasattr(tdm_data, "root")
 
+    def test_index(self, tdm_data):
+        index = tdm_data.index
+        assert type(index) is TDMIndex
+        assert len(index.channel_groups) == 2
+        assert len(index.channels) == 14
+        assert len(index.local_columns) == 14
+        assert len(index.sequences) == 14
+        assert len(index.blocks) == 14
+        assert index.blocks["inc0"].get("byteOffset") == "0"
+
     def test_read_channel_groups(self, tdm_data):
         tdm_data.channel_groups = []
         tdm_data.read_channel_groups()
@@ -58,6 +71,72 @@ class TestTdmData:
         assert type(channel) is TDMChannel
         assert channel.name == channel_name
 
+    def test_lazy(self):
+        filename = '../resources/quasi_static_12000uN.tdm'
+        tdm_data = TDMData(filename, lazy=True)
+        assert len(tdm_data.channel_groups) == 0
+        assert tdm_data.get_channel_group_names() == ["Indentation All Data Points", "Segments"]
+        channel = tdm_data.get_channel("Indentation All Data Points", "Indent Load")
+        assert channel.name == "Indent Load"
+        assert len(tdm_data.channel_groups) == 1
+        assert len(tdm_data.channel_groups[0].channels) == 1
+        assert tdm_data.get_channel("Indentation All Data Points", "Indent Load") is channel
+        assert tdm_data.get_channel("Indentation All Data Points", "non existing channel") is None
+        assert len(tdm_data.get_channel_names("Indentation All Data Points")) == 6
+        assert len(tdm_data.get_channel_dict("Segments")) == 8
+
+    def test_close(self):
+        filename = '../resources/quasi_static_12000uN.tdm'
+        with TDMData(filename) as tdm_data:
+            load = tdm_data.get_channel_dict("Indentation All Data Points")["Indent Load"]
+            time = tdm_data._get_data(tdm_data.get_channel("Indentation All Data Points", "Test Time").inc)
+            depth = tdm_data._get_data(tdm_data.get_channel("Indentation All Data Points", "Indent Disp.").inc)
+            assert np.shares_memory(time, tdm_data._get_tdx_mmap())
+            assert np.shares_memory(depth, tdm_data._get_tdx_mmap())
+        assert tdm_data._tdx_mmap is None
+        assert len(load) == len(time) == len(depth) == 1152  # data stays valid after close()
+
+    def test_read_group_array(self, tdm_data):
+        group_name = "Indentation All Data Points"
+        data, row_index = tdm_data.read_group_array(group_name)
+        assert data.shape == (6, 1152)
+        assert np.shares_memory(data, tdm_data._get_tdx_mmap())  # blocks are back-to-back -> no copy
+        channel_dict = tdm_data.get_channel_dict(group_name)
+        for name, row in row_index.items():
+            assert np.array_equal(data[row], channel_dict[name])
+
+        data, row_index = tdm_data.read_group_array(group_name, ["Indent Load", "Test Time"])
+        assert data.shape == (2, 1152)
+        assert np.array_equal(data[row_index["Test Time"]], channel_dict["Test Time"])
+
+        with pytest.raises(ValueError):
+            tdm_data.read_group_array("Segments")  # mixed int and float channels
+
+    def test_metadata_cache(self, tmp_path):
+        for extension in (".tdm", ".tdx"):
+            shutil.copy('../resources/quasi_static_12000uN' + extension, tmp_path)
+        filename = str(tmp_path / "quasi_static_12000uN.tdm")
+        cache_dir = str(tmp_path / "cache")
+
+        parsed = TDMData(filename, cache_dir=cache_dir)
+        assert len(os.listdir(cache_dir)) == 1
+        cached = TDMData(filename, cache_dir=cache_dir)
+        assert cached.root is None  # no xml parsing
+        assert cached.get_channel_group_names() == parsed.get_channel_group_names()
+        cached_attributes = cached.get_instance_attributes_dict()
+        parsed_attributes = parsed.get_instance_attributes_dict()
+        assert cached_attributes.keys() == parsed_attributes.keys()
+        assert cached_attributes["Acquisition_Timestamp"] == parsed_attributes["Acquisition_Timestamp"]
+        group_name = "Indentation All Data Points"
+        assert np.array_equal(cached.get_channel_dict(group_name)["Indent Load"],
+                              parsed.get_channel_dict(group_name)["Indent Load"])
+        assert cached.read_group_array(group_name)[0].shape == (6, 1152)
+
+        stat = os.stat(filename)
+        os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        assert TDMData(filename, cache_dir=cache_dir, lazy=True).root is not None  # stale cache entry
+        assert TDMData(filename, cache_dir=cache_dir).root is None
+
     def test_get_endian_format(self, tdm_data):
         assert tdm_data.get_endian_format() in ["<", ">"]
 
@@ -0,0 +1,58 @@
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from pi88reader.pi88_importer import load_tdm_files, SegmentType
+from pi88reader.utils_ni_input_for_sim import polynomial_fit_batch, create_ni_sim_input_files, \
+    create_ni_sim_input_files_for, LAST_POINT_WEIGHT
+
+
+class TestNISimInput:
+    def test_polynomial_fit_batch(self):
+        measurements = load_tdm_files('../resources/')
+        curves = [measurement.get_segment_curve(SegmentType.LOAD)[2:] for measurement in measurements]
+        curves.append((np.zeros(0), np.zeros(0)))
+        result = polynomial_fit_batch(curves, polynom_deg=6)
+        assert len(result[-1]) == 0
+        for (depth, load), coefficients in zip(curves[:-1], result[:-1]):
+            weights = np.ones(len(depth))
+            weights[-1] = LAST_POINT_WEIGHT
+            expected = np.polynomial.Polynomial.fit(depth, load, 6, w=weights)
+            assert np.allclose(np.polynomial.Polynomial(coefficients)(depth), expected(depth))
+
+    def test_polynomial_fit_batch_short_curve(self):
+        depth = np.arange(100.)
+        result = polynomial_fit_batch([(np.arange(3.), np.arange(3.) ** 2), (depth, depth ** 2)], 6)
+        assert len(result[0]) == 0
+        assert np.allclose(np.polynomial.Polynomial(result[1])(depth), depth ** 2)
+
+    def test_create_ni_sim_input_files_short_curve(self, tmp_path):
+        measurements = load_tdm_files('../resources/')
+        measurement = measurements[0]
+        measurement.filename = str(tmp_path / Path(measurement.filename).name)
+        measurements[1].filename = str(tmp_path / Path(measurements[1].filename).name)
+        unload = measurement.get_segment_slice(SegmentType.UNLOAD)
+        measurement.depth = measurement.depth[:unload.start + 3]
+        measurement.load = measurement.load[:unload.start + 3]
+        measurement.time = measurement.time[:unload.start + 3]
+        with pytest.raises(ValueError):
+            create_ni_sim_input_files_for(measurements)
+        errors = []
+        files = create_ni_sim_input_files_for(measurements, errors=errors)
+        assert len(files) == 1
+        assert [file for file, _ in errors] == [measurement.filename]
+
+    def test_create_ni_sim_input_files(self, tmp_path):
+        for file in Path('../resources/').glob('*.td?'):
+            shutil.copy(file, tmp_path)
+        files = create_ni_sim_input_files(str(tmp_path), workers=2)
+        assert sorted(file.name for file in files) == ["nan_error_dyn_10000uN_DATA.txt", "quasi_static_12000uN_DATA.txt"]
+        for measurement, file in zip(load_tdm_files(str(tmp_path)), files):
+            lines = file.read_text().split("\n")
+            _, _, depth, load = measurement.get_segment_curve(SegmentType.UNLOAD)
+            assert lines[0].startswith("TIP area function")
+            assert float(lines[1]) == measurement.area_function.c0
+            assert len(lines) == 41 + len(depth)  # 40 header lines + "END"
+            assert lines[-1] == "END"